@@ -80,6 +80,12 @@ class _Options(object):
         self._target_build_dir = os.path.abspath(self._default_build_dir)
         self._default_config_dir = 'config'  ## in package base directory
         self._user_config_dir = os.path.abspath(self._default_config_dir)
+        ## shared by all projects of this user
+        self._user_cache_dir = os.environ.get('SYSDEVEL_CACHE_DIR',
+            os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                        os.path.join(os.path.expanduser('~'),
+                                                     '.cache')),
+                         'sysdevel'))
         self._VERBOSE = False
         self._DEBUG = False
 
@@ -136,6 +142,13 @@ class _Options(object):
     def set_config_dir(self, d):
         self._default_config_dir = d
 
+    @property
+    def user_cache_dir(self):
+        return self._user_cache_dir
+
+    def set_user_cache_dir(self, d):
+        self._user_cache_dir = os.path.abspath(d)
+
     @property
     def target_build_dir(self):
         return self._target_build_dir
@@ -0,0 +1,398 @@
+"""
+Copyright 2013.  Los Alamos National Security, LLC.
+This material was produced under U.S. Government contract
+DE-AC52-06NA25396 for Los Alamos National Laboratory (LANL), which is
+operated by Los Alamos National Security, LLC for the U.S. Department
+of Energy. The U.S. Government has rights to use, reproduce, and
+distribute this software.  NEITHER THE GOVERNMENT NOR LOS ALAMOS
+NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+modified to produce derivative works, such modified software should be
+clearly marked, so as not to confuse it with the version available
+from LANL.
+
+Licensed under the Mozilla Public License, Version 2.0 (the
+"License"); you may not use this file except in compliance with the
+License. You may obtain a copy of the License at
+http://www.mozilla.org/MPL/2.0/
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+# pylint: disable=W0105
+"""
+Store of prebuilt prerequisites, shared by all projects of a user
+"""
+
+import os
+import sys
+import time
+import shutil
+import tarfile
+import platform
+import threading
+import hashlib
+import inspect
+from distutils.util import get_platform
+from distutils.sysconfig import get_config_var
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from sysdevel.distutils.filesystem import mkdir
+from sysdevel.distutils.file_index import file_index
+from sysdevel.distutils.object_cache import object_cache
+from sysdevel.distutils import options
+
+
+ARTIFACT_CACHE_SIZE = 4 * 1024 * 1024 * 1024  ## bytes, before eviction
+ARTIFACT_FORMAT = 2
+
+## installation directories under the local prefix (target_build_dir)
+PREFIX_DIRS = ['bin', 'sbin', 'include', 'lib', 'lib64', 'libexec',
+               'share', 'etc', 'man', options.local_lib_dir]
+
+## environment variables that change what a build produces
+BUILD_VARIABLES = ['CC', 'CXX', 'FC', 'F77', 'CFLAGS', 'CXXFLAGS', 'FFLAGS',
+                   'CPPFLAGS', 'LDFLAGS', 'MACOSX_DEPLOYMENT_TARGET']
+
+
+def _digest(path):
+    h = hashlib.sha256()
+    f = open(path, 'rb')
+    try:
+        while True:
+            block = f.read(64 * 1024)
+            if not block:
+                break
+            h.update(block)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def _helper_digest(cfg):
+    try:
+        source = inspect.getsourcefile(cfg.__class__)
+        if source:
+            return _digest(source)
+    except (TypeError, IOError, OSError):
+        pass
+    return None
+
+
+def _read_json(path):
+    f = open(path, 'r')
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+def _write_json(path, data):
+    tmp = path + '.' + str(os.getpid())
+    f = open(tmp, 'w')
+    try:
+        json.dump(data, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+    if os.path.exists(path):
+        os.remove(path)  ## rename does not overwrite on Windows
+    os.rename(tmp, path)
+
+
+class _ArtifactStore(object):
+    '''
+    Installed files of locally built prerequisites, packed after a
+    successful install (user_cache_dir/artifacts/<key>.tar.gz) and
+    unpacked into target_build_dir on later installs, by any project.
+    The key covers the helper name, its source, the requested version,
+    the platform, the compiler and the build flags. A manifest of
+    digests is checked on restore; text files naming the original
+    prefix are rewritten for the new one. Binaries naming it (rpaths,
+    compiled-in paths) cannot be rewritten, so such artifacts are only
+    restored into the prefix they were built for.
+    Installs may run concurrently; only one that had the prefix to
+    itself throughout (see begin) can tell its files apart, and is
+    captured.
+    Least recently used artifacts are evicted beyond ARTIFACT_CACHE_SIZE
+    (or SYSDEVEL_ARTIFACT_CACHE_SIZE bytes; 0 disables the store).
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._installing = dict()  ## token: [snapshot before, alone]
+
+    def directory(self):
+        return os.path.join(options.user_cache_dir, 'artifacts')
+
+    def size_limit(self):
+        try:
+            return int(os.environ['SYSDEVEL_ARTIFACT_CACHE_SIZE'])
+        except (KeyError, ValueError):
+            return ARTIFACT_CACHE_SIZE
+
+    def enabled(self):
+        return self.size_limit() > 0
+
+    def key(self, short_name, cfg, version):
+        compiler = (get_config_var('CC') or 'cc').split()[0]
+        h = hashlib.sha256()
+        h.update(repr((ARTIFACT_FORMAT, short_name, str(version),
+                       _helper_digest(cfg), sys.platform,
+                       platform.machine(), get_platform(),
+                       tuple(sys.version_info[:2]),
+                       [os.environ.get(v) for v in BUILD_VARIABLES])
+                      ).encode('utf-8'))
+        h.update(object_cache.compiler_version(compiler))
+        return short_name + '-' + h.hexdigest()[:32]
+
+    def _archive(self, key):
+        return os.path.join(self.directory(), key + '.tar.gz')
+
+    def _manifest(self, key):
+        return os.path.join(self.directory(), key + '.json')
+
+    def has(self, key):
+        '''
+        Whether an artifact can be restored into the local prefix.
+        '''
+        if not os.path.exists(self._manifest(key)) or \
+                not os.path.exists(self._archive(key)):
+            return False
+        try:
+            manifest = _read_json(self._manifest(key))
+        except (IOError, OSError, ValueError):
+            return False
+        return not manifest.get('binary') or \
+            manifest.get('prefix') == os.path.abspath(options.target_build_dir)
+
+    def snapshot(self):
+        '''
+        State of the installation directories under the local prefix,
+        to be compared after an install.
+        '''
+        prefix = os.path.abspath(options.target_build_dir)
+        state = dict()
+        for top in PREFIX_DIRS:
+            for dirpath, dirnames, filenames in \
+                    os.walk(os.path.join(prefix, top)):
+                for name in filenames + [d for d in dirnames if
+                                         os.path.islink(os.path.join(dirpath,
+                                                                     d))]:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.lstat(path)
+                    except OSError:
+                        continue
+                    state[os.path.relpath(path, prefix)] = \
+                        (st.st_mtime, st.st_size)
+        return state
+
+    def _interfere(self):
+        ## the prefix changes: running installs cannot be captured
+        self._lock.acquire()
+        try:
+            for install in self._installing.values():
+                install[1] = False
+        finally:
+            self._lock.release()
+
+    def begin(self):
+        '''
+        Note the start of an install into the local prefix. Returns a
+        token for capture and end.
+        '''
+        token = object()
+        self._lock.acquire()
+        try:
+            alone = not self._installing
+            for install in self._installing.values():
+                install[1] = False
+            self._installing[token] = [None, alone]
+        finally:
+            self._lock.release()
+        if alone:
+            self._installing[token][0] = self.snapshot()
+        return token
+
+    def end(self, token):
+        self._lock.acquire()
+        try:
+            self._installing.pop(token, None)
+        finally:
+            self._lock.release()
+
+    def capture(self, key, short_name, version, token):
+        '''
+        Pack what an install added or changed since it began, if no
+        other install (or restore) ran meanwhile.
+        '''
+        self._lock.acquire()
+        try:
+            before, alone = self._installing[token]
+        finally:
+            self._lock.release()
+        if not alone:
+            return False  ## whose files are whose is unknown
+        prefix = os.path.abspath(options.target_build_dir)
+        after = self.snapshot()
+        changed = [rel for rel in after if before.get(rel) != after[rel]]
+        if not changed:
+            return False
+        changed.sort()
+        files = dict()
+        text = []
+        binary = []
+        mkdir(self.directory())
+        archive = self._archive(key)
+        tmp = archive + '.' + str(os.getpid())
+        tar = tarfile.open(tmp, 'w:gz')
+        try:
+            for rel in changed:
+                path = os.path.join(prefix, rel)
+                if os.path.islink(path):
+                    files[rel] = 'link:' + os.readlink(path)
+                else:
+                    files[rel] = _digest(path)
+                    names = self._names_prefix(path, prefix)
+                    if names == 'text':
+                        text.append(rel)
+                    elif names == 'binary':
+                        binary.append(rel)
+                tar.add(path, rel.replace(os.sep, '/'), recursive=False)
+        finally:
+            tar.close()
+        self._lock.acquire()
+        try:
+            if os.path.exists(archive):
+                os.remove(archive)
+            os.rename(tmp, archive)
+            _write_json(self._manifest(key),
+                        dict(format=ARTIFACT_FORMAT, name=short_name,
+                             version=str(version), prefix=prefix,
+                             created=time.time(), files=files, text=text,
+                             binary=binary))
+        finally:
+            self._lock.release()
+        self.trim()
+        return True
+
+    def _names_prefix(self, path, prefix):
+        ## 'text' or 'binary' (with NUL bytes) if containing the prefix
+        f = open(path, 'rb')
+        try:
+            contents = f.read()
+        finally:
+            f.close()
+        if not prefix.encode('utf-8') in contents:
+            return None
+        if b'\0' in contents:
+            return 'binary'
+        return 'text'
+
+    def restore(self, key):
+        '''
+        Unpack a stored artifact into the local prefix, after checking
+        it against its manifest. Returns whether it was restored.
+        '''
+        if not self.has(key):
+            return False
+        prefix = os.path.abspath(options.target_build_dir)
+        staging = os.path.join(prefix, '.' + key + '_restoring')
+        try:
+            manifest = _read_json(self._manifest(key))
+            files = manifest['files']
+            if os.path.exists(staging):
+                shutil.rmtree(staging)
+            mkdir(staging)
+            tar = tarfile.open(self._archive(key), 'r:gz')
+            try:
+                members = tar.getmembers()
+                for member in members:
+                    rel = os.path.normpath(member.name)
+                    if os.path.isabs(rel) or rel.startswith('..') or \
+                            not rel in files:
+                        raise ValueError('unexpected member ' + member.name)
+                tar.extractall(staging, members)
+            finally:
+                tar.close()
+            for rel, expected in files.items():
+                path = os.path.join(staging, rel)
+                if expected.startswith('link:'):
+                    ok = os.path.islink(path) and \
+                        'link:' + os.readlink(path) == expected
+                else:
+                    ok = os.path.isfile(path) and _digest(path) == expected
+                if not ok:
+                    raise ValueError('corrupt artifact file ' + rel)
+        except Exception:  # pylint: disable=W0703
+            shutil.rmtree(staging, ignore_errors=True)
+            self.remove(key)
+            return False
+
+        old_prefix = manifest['prefix']
+        self._interfere()
+        for rel in files.keys():
+            src = os.path.join(staging, rel)
+            dst = os.path.join(prefix, rel)
+            mkdir(os.path.dirname(dst))
+            if os.path.lexists(dst):
+                os.remove(dst)
+            if rel in manifest['text'] and old_prefix != prefix:
+                f = open(src, 'rb')
+                try:
+                    contents = f.read()
+                finally:
+                    f.close()
+                f = open(src, 'wb')
+                try:
+                    f.write(contents.replace(old_prefix.encode('utf-8'),
+                                             prefix.encode('utf-8')))
+                finally:
+                    f.close()
+            os.rename(src, dst)
+        shutil.rmtree(staging, ignore_errors=True)
+        os.utime(self._archive(key), None)  ## recently used
+        file_index.invalidate(prefix)
+        return True
+
+    def remove(self, key):
+        for path in [self._archive(key), self._manifest(key)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def trim(self):
+        '''
+        Evict the least recently used artifacts beyond the size limit.
+        '''
+        limit = self.size_limit()
+        entries = []
+        total = 0
+        if not os.path.isdir(self.directory()):
+            return
+        for name in os.listdir(self.directory()):
+            if not name.endswith('.tar.gz'):
+                continue
+            path = os.path.join(self.directory(), name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name[:-len('.tar.gz')]))
+            total += st.st_size
+        entries.sort()
+        while total > limit and entries:
+            _, size, key = entries.pop(0)
+            try:
+                self.remove(key)
+                total -= size
+            except OSError:
+                pass
+
+
+artifact_store = _ArtifactStore()
@@ -28,13 +28,16 @@ Utilities for package installation
 """
 
 import os
+import re
 import sys
 import platform
 import inspect
 import fnmatch
-import time
+import hashlib
+import threading
 from glob import glob
 from distutils.errors import DistutilsSetupError, DistutilsError, DistutilsFileError
+from distutils.errors import CompileError, DistutilsExecError
 from distutils.dep_util import newer_group
 
 have_numpy = False
@@ -49,8 +52,13 @@ except ImportError:
     from distutils import log
 
 from sysdevel.util import is_string
-from sysdevel.distutils.filesystem import mkdir
+from sysdevel.distutils.filesystem import mkdir, walk
 from sysdevel.distutils.numpy_utils import filter_sources, is_sequence
+from sysdevel.distutils.numpy_utils import _get_f90_modules, _get_f90_uses
+from sysdevel.distutils.parallel import parallel_map, cpu_budget
+from sysdevel.distutils.object_cache import object_cache
+from sysdevel.distutils.configured_files import configured_files
+from sysdevel.distutils.supervisor import ProcessSupervisor, ActivityDots
 from sysdevel.distutils import options
 
 
@@ -68,26 +76,17 @@ environment_defaults = dict({
 
 
 def process_progress(p):
-    max_dots = 10
-    prev = dots = 0
-    status = p.poll()
-    while status is None:
-        if options.VERBOSE:
-            prev = dots
-            dots += 1
-            dots %= max_dots
-            if prev:
-                sys.stdout.write('\b' * prev)
-            sys.stdout.write('.' * dots)
-            sys.stdout.flush()
-        time.sleep(0.2)
-        status = p.poll()
-    if options.VERBOSE:
-        sys.stdout.write('\b' * dots)
-        sys.stdout.write('.' * max_dots)
-        sys.stdout.flush()
+    '''
+    Wait for an already started process (with activity dots on the
+    console). Prefer supervisor.run_process, which also follows output.
+    '''
+    dots = ActivityDots()
+    supervisor = ProcessSupervisor(dots)
+    supervisor.watch('process', p)
+    status = supervisor.wait_any()[1]
+    dots.finish()
     return status
- 
+
 
 
 def create_script_wrapper(pyscript, target_dir):
@@ -218,70 +217,181 @@ def configure_files(var_dict, directory_or_file_list,
     and either a list of files or a directory, an optional filename pattern
     (default '*.in') and an optional target directory,
     apply configure_file.
+    Directories matching one of the excludes are not searched.
+    Returns the outputs that were (re)written.
     '''
     if isinstance(directory_or_file_list, list):
-        file_list = directory_or_file_list
-        for filepath in file_list:
-            configure_file(var_dict, filepath)
-        return
+        jobs = [(filepath, None, '.in') for filepath in directory_or_file_list]
     else:
         directory = directory_or_file_list
-        matches = []
-        for root, _, filenames in os.walk(directory):
-            for ex in excludes:
-                if fnmatch.fnmatch(root, ex):
-                    continue
-            for filename in fnmatch.filter(filenames, pattern):
-                matches.append((root, filename))
         remove_pattern = '.in'
         if not pattern.endswith('.in'):
             remove_pattern = None
-        for path, filename in matches:
-            subdir = path[len(directory)+1:]
-            newpath = None
-            if target_dir != None:
-                newpath = os.path.join(target_dir, subdir, filename)
-            configure_file(var_dict, os.path.join(path, filename),
-                           newpath, remove_pattern)
-
-
-
-
-def nested_values(line, var_dict, d=0, style=DEFAULT_STYLE):
-    var_dict = dict(environment_defaults, **var_dict)  # pylint: disable=W0142
-
-    fr_delim = '@@{'
-    bk_delim = '}'
-    cmt_delim = '#'
-    if style == AUTOCONF_STYLE:
-        fr_delim = '$('
-        bk_delim = ')'
-    elif style == AUTOMAKE_STYLE:
-        fr_delim = '@'
-        bk_delim = '@'
-    fr_len = len(fr_delim)
-    
-    cmt = line.find(cmt_delim)
-    front = line.find(fr_delim)
-    while front >= 0:  ## sequential
-        back = line.find(bk_delim, front+fr_len)
-        if back < 0 or (cmt >= 0 and cmt < front):
-            break
-        last = line.rfind(fr_delim, front+fr_len)
-        while last >= 0 and last < back and last > front:  ## nested only
-            back2 = line.rfind(bk_delim, front+fr_len)
-            replacement = nested_values(line[front+fr_len:back2], var_dict, d+1)
-            line = line.replace(line[front+fr_len:back2], replacement)
-            last = line.rfind(fr_delim, front+fr_len)
-        back = line.find(bk_delim, front+fr_len)
-        valname = line[front+fr_len:back]
-        if len(valname.split()) > 1:  ## disallow whitespace
-            front = back
-            continue
-        value = var_dict[valname]
-        line = line.replace(line[front:back+1], str(value))
-        front = line.find(fr_delim)
-    return line
+        jobs = []
+        for root, _, filenames in walk(directory, excludes):
+            subdir = root[len(directory)+1:]
+            for filename in fnmatch.filter(filenames, pattern):
+                newpath = None
+                if target_dir != None:
+                    newpath = os.path.join(target_dir, subdir, filename)
+                jobs.append((os.path.join(root, filename),
+                             newpath, remove_pattern))
+    newpaths = []
+    for filepath, newpath, suffix in jobs:
+        if newpath is None:
+            newpath = filepath[:-(len(suffix))]
+        newpaths.append(newpath)
+    for newdir in sorted(set([os.path.dirname(p) for p in newpaths])):
+        if newdir:
+            mkdir(newdir)
+    try:
+        written = parallel_map(lambda job: _configure_file(var_dict, *job),  # pylint: disable=W0142
+                               jobs)
+    finally:
+        configured_files.save()
+    return [newpaths[idx] for idx in range(len(jobs)) if written[idx]]
+
+
+
+
+## delimiters per style: (front, back)
+_STYLE_DELIMITERS = {
+    DEFAULT_STYLE  : ('@@{', '}'),
+    AUTOCONF_STYLE : ('$(', ')'),
+    AUTOMAKE_STYLE : ('@', '@'),
+}
+_COMMENT_DELIMITER = '#'
+
+## values containing references are expanded again, up to this depth
+MAX_EXPANSION_DEPTH = 16
+
+_TEMPLATE_CACHE_SIZE = 512
+
+
+class Template(object):
+    '''
+    Text compiled once into literals and (possibly nested) variable
+    references, so that rendering is a single pass over the instructions.
+    A reference after a comment ('#') on its line is left literal,
+    as is a reference whose name contains whitespace.
+    '''
+    def __init__(self, text, style=DEFAULT_STYLE, digest=None):
+        if digest is None:
+            digest = _text_digest(text)
+        self.digest = digest
+        self.style = style
+        self.front, self.back = _STYLE_DELIMITERS[style]
+        self._code = []
+        for line in text.splitlines(True):
+            self._compile_line(line)
+
+    def _literal(self, text):
+        if not text:
+            return
+        if self._code and is_string(self._code[-1]):
+            self._code[-1] += text
+        else:
+            self._code.append(text)
+
+    def _parse_reference(self, line, idx):
+        ## returns ([name parts], end index) or None if unterminated
+        parts = []
+        while True:
+            back = line.find(self.back, idx)
+            if back < 0:
+                return None
+            front = line.find(self.front, idx)
+            if front >= 0 and front < back:  ## nested
+                if front > idx:
+                    parts.append(line[idx:front])
+                nested = self._parse_reference(line, front + len(self.front))
+                if nested is None:
+                    return None
+                parts.append(nested[0])
+                idx = nested[1]
+            else:
+                if back > idx or not parts:
+                    parts.append(line[idx:back])
+                return parts, back + len(self.back)
+
+    def _compile_line(self, line):
+        cmt = line.find(_COMMENT_DELIMITER)
+        idx = 0
+        while True:
+            front = line.find(self.front, idx)
+            ## nothing after a comment is substituted, even a reference
+            ##   that also appears before it
+            if front < 0 or (cmt >= 0 and cmt < front):
+                break
+            ref = self._parse_reference(line, front + len(self.front))
+            if ref is None:
+                break
+            self._literal(line[idx:front])
+            self._code.append(ref[0])
+            idx = ref[1]
+        self._literal(line[idx:])
+
+    def _value(self, parts, values, depth, used):
+        name = ''.join([p if is_string(p) else
+                        self._value(p, values, depth, used) for p in parts])
+        if len(name.split()) > 1:  ## disallow whitespace
+            return self.front + name + self.back
+        value = str(values[name])
+        if used is not None:
+            used[name] = value
+        if self.front in value and depth < MAX_EXPANSION_DEPTH:
+            value = compile_template(value, self.style)._render(values,
+                                                                depth + 1, used)
+        return value
+
+    def _render(self, values, depth, used):
+        return ''.join([c if is_string(c) else
+                        self._value(c, values, depth, used)
+                        for c in self._code])
+
+    def render(self, var_dict, used=None):
+        '''
+        Substitute the values of var_dict (over environment_defaults).
+        Raises KeyError for an undefined variable.
+        If given, the used dict collects the variables substituted.
+        '''
+        values = dict(environment_defaults, **var_dict)  # pylint: disable=W0142
+        return self._render(values, 0, used)
+
+
+def _text_digest(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+_template_cache = dict()
+_template_lock = threading.Lock()
+
+def compile_template(text, style=DEFAULT_STYLE):
+    '''
+    Compiled Template for the given text, cached by content hash.
+    '''
+    key = (_text_digest(text), style)
+    _template_lock.acquire()
+    try:
+        template = _template_cache.get(key)
+    finally:
+        _template_lock.release()
+    if template is None:
+        template = Template(text, style, key[0])
+        _template_lock.acquire()
+        try:
+            if len(_template_cache) >= _TEMPLATE_CACHE_SIZE:
+                _template_cache.clear()
+            _template_cache[key] = template
+        finally:
+            _template_lock.release()
+    return template
+
+
+def nested_values(line, var_dict, d=0, style=DEFAULT_STYLE):  # pylint: disable=W0613
+    return compile_template(line, style).render(var_dict)
 
 
 def configure_file(var_dict, filepath, newpath=None, suffix='.in',
@@ -292,25 +402,48 @@ def configure_file(var_dict, filepath, newpath=None, suffix='.in',
     If style is AUTOCONF_STYLE, use the style $(VAR).
     If style is AUTOMAKE_STYLE, use the style @VAR@.
     VAR may not have whitespace in the string.
+    The output is only regenerated if the template or the values it uses
+    have changed, and only rewritten if its content differs.
+    Its stamp is saved with the others at the end of the build (or exit).
+    Returns whether the output was (re)written.
     '''
+    return _configure_file(var_dict, filepath, newpath, suffix, style)
+
+
+def _configure_file(var_dict, filepath, newpath=None, suffix='.in',
+                    style=DEFAULT_STYLE):
     if newpath is None:
         newpath = filepath[:-(len(suffix))]
-    if os.path.exists(newpath) and \
-            (os.path.getmtime(filepath) < os.path.getmtime(newpath)):
-        ## i.e. original is older than existing generated file
-        return
-    if options.VERBOSE:
-        print('Configuring ' + newpath)
+    values = dict(environment_defaults, **var_dict)  # pylint: disable=W0142
     orig = open(filepath, 'r')
-    newdir = os.path.dirname(newpath)
-    if not os.path.exists(newdir):
-        mkdir(newdir)
-    new = open(newpath, 'w')
-    for line in orig:
-        line = nested_values(line, var_dict, style=style)
-        new.write(line)
-    orig.close()
-    new.close()
+    try:
+        template = compile_template(orig.read(), style)
+    finally:
+        orig.close()
+    if configured_files.current(newpath, template, values):
+        return False
+    used = dict()
+    text = template.render(values, used)
+    changed = True
+    if os.path.exists(newpath):
+        existing = open(newpath, 'r')
+        try:
+            changed = existing.read() != text
+        finally:
+            existing.close()
+    if changed:
+        if options.VERBOSE:
+            print('Configuring ' + newpath)
+        newdir = os.path.dirname(newpath)
+        if newdir and not os.path.exists(newdir):
+            mkdir(newdir)
+        new = open(newpath, 'w')
+        try:
+            new.write(text)
+        finally:
+            new.close()
+    configured_files.record(newpath, template, used)
+    return changed
 
 
 
@@ -361,6 +494,168 @@ def _put(obj, what, val):
         obj[what] = val
 
 
+def compile_jobs(builder):
+    '''
+    Number of translation units compiled at once by a build_* command
+    (the build command's --jobs, or the CPU budget of this process).
+    '''
+    jobs = getattr(builder.get_finalized_command('build'), 'jobs', None)
+    if not jobs or jobs is True:
+        return cpu_budget.jobs()
+    return max(1, int(jobs))
+
+
+## compilers that write make-style dependency files with -MMD
+DEPENDENCY_COMPILERS = ['unix', 'cygwin', 'mingw32']
+
+def _dependency_file(obj):
+    return obj + '.d'
+
+
+def _read_dependencies(dep_file):
+    ## 'object: source header ...' rule, possibly continued with '\'
+    f = open(dep_file, 'r')
+    try:
+        contents = f.read()
+    finally:
+        f.close()
+    contents = contents.replace('\\\n', ' ')
+    idx = contents.find(': ')
+    if idx < 0:
+        return []
+    rule = contents[idx+2:].split('\n')[0].strip()
+    return [dep.replace('\\ ', ' ')
+            for dep in re.split(r'(?<!\\)\s+', rule) if dep]
+
+
+def _is_stale(source, obj, depends, tracked, force=False):
+    if force or not os.path.exists(obj):
+        return True
+    obj_time = os.path.getmtime(obj)
+    dependencies = [source] + list(depends)
+    if tracked:
+        try:
+            dependencies += _read_dependencies(_dependency_file(obj))
+        except (IOError, OSError):
+            return True  ## never compiled with dependency tracking
+    for dep in dependencies:
+        if not os.path.exists(dep) or os.path.getmtime(dep) > obj_time:
+            return True
+    return False
+
+
+def _cache_key(compiler, src, obj, kwargs):
+    ## preprocess (recording the included headers, as the compile would)
+    ##  and hash the result; None if the source cannot be preprocessed
+    preprocessed = obj + '.i'
+    if os.path.exists(preprocessed):
+        os.remove(preprocessed)
+    try:
+        try:
+            compiler.preprocess(src, preprocessed,
+                                macros=kwargs.get('macros'),
+                                include_dirs=kwargs.get('include_dirs'),
+                                extra_preargs=kwargs.get('extra_preargs'),
+                                extra_postargs=list(
+                                    kwargs.get('extra_postargs') or []) +
+                                ['-MMD', '-MF', _dependency_file(obj)])
+            return object_cache.key(compiler, src, preprocessed, kwargs)
+        except (CompileError, DistutilsExecError, IOError, OSError):
+            return None
+    finally:
+        if os.path.exists(preprocessed):
+            os.remove(preprocessed)
+
+
+def _compile_each(compiler, sources, objects, jobs, output_dir, kwargs):
+    ## compile sources one by one, up to 'jobs' at once
+    tracked = compiler.compiler_type in DEPENDENCY_COMPILERS
+    targets = dict(zip(sources, objects))
+    for obj in objects:
+        compiler.mkpath(os.path.dirname(obj))  ## not from several threads
+
+    def compile_one(src):
+        args = dict(kwargs)
+        key = None
+        if tracked:
+            args['extra_postargs'] = list(kwargs.get('extra_postargs') or []) \
+                + ['-MMD', '-MF', _dependency_file(targets[src])]
+            if object_cache.enabled():
+                key = _cache_key(compiler, src, targets[src], kwargs)
+                if key and object_cache.restore(key, targets[src]):
+                    return [targets[src]]
+        if os.path.exists(targets[src]):
+            os.remove(targets[src])  ## may be linked into the cache
+        result = compiler.compile([src], output_dir=output_dir, **args)
+        if key:
+            object_cache.store(key, targets[src])
+        return result
+
+    if jobs <= 1 or len(sources) <= 1:
+        return [compile_one(src) for src in sources]
+    return parallel_map(compile_one, sources, jobs)
+
+
+def compile_sources(compiler, sources, jobs, output_dir=None,
+                    depends=None, force=False, **kwargs):
+    '''
+    Like compiler.compile, but only the sources whose object is out of
+    date are compiled, in parallel. An object is out of date if older
+    than its source, than the headers it included (recorded in a '.d'
+    file next to it, for gcc-like compilers), or than any of depends.
+    '''
+    if depends is None:
+        depends = []
+    tracked = compiler.compiler_type in DEPENDENCY_COMPILERS
+    objects = compiler.object_filenames(sources, output_dir=output_dir)
+    stale = [(src, obj) for src, obj in zip(sources, objects)
+             if _is_stale(src, obj, depends, tracked, force)]
+    if stale:
+        _compile_each(compiler, [s for s, _ in stale], [o for _, o in stale],
+                      jobs, output_dir, kwargs)
+    return objects
+
+
+def compile_fortran_modules(fcompiler, sources, jobs, output_dir=None,
+                            depends=None, force=False, **kwargs):
+    '''
+    Compile Fortran 90 module sources in parallel, each source only
+    after those defining the modules it uses (and whenever one of
+    those is recompiled).
+    '''
+    if depends is None:
+        depends = []
+    objects = dict(zip(sources, fcompiler.object_filenames(
+                sources, output_dir=output_dir)))
+    definitions = dict()
+    for src in sources:
+        for module in _get_f90_modules(src):
+            definitions[module.lower()] = src
+    needs = dict()
+    for src in sources:
+        needs[src] = [definitions[module] for module in _get_f90_uses(src)
+                      if module in definitions and definitions[module] != src]
+    done = []
+    remaining = list(sources)
+    while remaining:
+        ready = [src for src in remaining
+                 if not [dep for dep in needs[src] if not dep in done]]
+        if not ready:
+            ready = remaining[:1]  ## circular use; keep the given order
+        stale = [src for src in ready
+                 if _is_stale(src, objects[src],
+                              depends + [objects[dep] for dep in needs[src]
+                                         if dep in done],
+                              False, force)]
+        if stale:
+            _compile_each(fcompiler, stale, [objects[src] for src in stale],
+                          jobs, output_dir, kwargs)
+        for src in ready:
+            done.append(src)
+            remaining.remove(src)
+    return [objects[src] for src in sources]
+
+
 def build_target(builder, target, name, mode):
     """
     Common function for build_* commands
@@ -380,19 +675,8 @@ def build_target(builder, target, name, mode):
     ## include libraries built by build_shlib and/or build_clib
     library_dirs.append(builder.build_temp)
 
-    ## Conditional recompile
+    ## objects are recompiled individually, as needed (see compile_sources)
     build_directory = builder.build_clib
-    target_path = os.path.join(build_directory, name)
-    recompile = False
-    if not os.path.exists(target_path) or builder.force:
-        recompile = True
-    else:
-        for src in _get(target, 'sources', []):
-            if os.path.getmtime(target_path) < os.path.getmtime(src):
-                recompile = True
-                break
-    if not recompile:
-        return
     library_dirs += [builder.build_clib]
 
     ########################################
@@ -430,12 +714,8 @@ def build_target(builder, target, name, mode):
         lib_file = compiler.library_filename(name, lib_type='shared',
                                              output_dir=build_directory)
 
-    depends = sources + (_get(target, 'depends', []))
-    if not (builder.force or newer_group(depends, lib_file, 'newer')):
-        log.debug("skipping '%s' library (up-to-date)", name)
-        return
-    else:
-        log.info("building '%s' library", name)
+    depends = list(_get(target, 'depends', []))
+    log.info("building '%s' library", name)
 
     if have_numpy:
         config_fc = _get(target, 'config_fc', {})
@@ -483,25 +763,29 @@ def build_target(builder, target, name, mode):
         c_sources += cxx_sources
         cxx_sources = []
 
+    jobs = compile_jobs(builder)
+    cache_counts = (object_cache.hits, object_cache.misses)
     objects = []
     if c_sources:
         log.info("compiling C sources")
-        objects = compiler.compile(c_sources,
-                                   output_dir=builder.build_temp,
-                                   macros=macros,
-                                   include_dirs=include_dirs,
-                                   debug=builder.debug,
-                                   extra_postargs=extra_postargs)
+        objects = compile_sources(compiler, c_sources, jobs,
+                                  output_dir=builder.build_temp,
+                                  macros=macros,
+                                  include_dirs=include_dirs,
+                                  debug=builder.debug,
+                                  extra_postargs=extra_postargs,
+                                  depends=depends, force=builder.force)
 
     if cxx_sources:
         log.info("compiling C++ sources")
         cxx_compiler = compiler.cxx_compiler()
-        cxx_objects = cxx_compiler.compile(cxx_sources,
-                                           output_dir=builder.build_temp,
-                                           macros=macros,
-                                           include_dirs=include_dirs,
-                                           debug=builder.debug,
-                                           extra_postargs=extra_postargs)
+        cxx_objects = compile_sources(cxx_compiler, cxx_sources, jobs,
+                                      output_dir=builder.build_temp,
+                                      macros=macros,
+                                      include_dirs=include_dirs,
+                                      debug=builder.debug,
+                                      extra_postargs=extra_postargs,
+                                      depends=depends, force=builder.force)
         objects.extend(cxx_objects)
 
     if f_sources or fmodule_sources:
@@ -518,12 +802,15 @@ def build_target(builder, target, name, mode):
 
         if fmodule_sources:
             log.info("compiling Fortran 90 module sources")
-            f_objects += fcompiler.compile(fmodule_sources,
-                                           output_dir=builder.build_temp,
-                                           macros=macros,
-                                           include_dirs=include_dirs,
-                                           debug=builder.debug,
-                                           extra_postargs=extra_postargs)
+            f_objects += compile_fortran_modules(fcompiler, fmodule_sources,
+                                                 jobs,
+                                                 output_dir=builder.build_temp,
+                                                 macros=macros,
+                                                 include_dirs=include_dirs,
+                                                 debug=builder.debug,
+                                                 extra_postargs=extra_postargs,
+                                                 depends=depends,
+                                                 force=builder.force)
 
         if requiref90 and fcompiler.module_dir_switch is None:
             # move new compiled F90 module files to module_build_dir
@@ -542,12 +829,15 @@ def build_target(builder, target, name, mode):
 
         if f_sources:
             log.info("compiling Fortran sources")
-            f_objects += fcompiler.compile(f_sources,
-                                           output_dir=builder.build_temp,
-                                           macros=macros,
-                                           include_dirs=include_dirs,
-                                           debug=builder.debug,
-                                           extra_postargs=extra_postargs)
+            ## recompiled along with the modules they may use
+            f_objects += compile_sources(fcompiler, f_sources, jobs,
+                                         output_dir=builder.build_temp,
+                                         macros=macros,
+                                         include_dirs=include_dirs,
+                                         debug=builder.debug,
+                                         extra_postargs=extra_postargs,
+                                         depends=depends + f_objects,
+                                         force=builder.force)
     else:
         f_objects = []
 
@@ -596,4 +886,17 @@ def build_target(builder, target, name, mode):
     if not _get(target, 'link_with_fcompiler', False):
         linker_args['runtime_library_dirs'] = runtime_library_dirs
 
+    hits = object_cache.hits - cache_counts[0]
+    misses = object_cache.misses - cache_counts[1]
+    if hits or misses:
+        log.info("object cache: %d hits, %d misses", hits, misses)
+        object_cache.save_statistics()
+        object_cache.trim()
+
+    output_file = os.path.join(build_directory, target_name)
+    if not builder.force and os.path.exists(output_file) and \
+       not newer_group(objects, output_file):
+        log.debug("skipping '%s' link (up-to-date)", name)
+        return
+
     link_compiler.link(**linker_args)  # pylint: disable=W0142
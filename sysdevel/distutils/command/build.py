@@ -37,6 +37,7 @@ except ImportError:
     from distutils.command.build import build as old_build
 
 from sysdevel.distutils.recur import process_subpackages
+from sysdevel.distutils.configured_files import configured_files
 from sysdevel.distutils import options
 
 
@@ -45,16 +46,23 @@ class build(old_build):
     Subclass build command to support new commands.
     '''
     user_options = [('sublevel=', None, 'sub-package level'),
-                    ] + old_build.user_options
+                    ('jobs=', 'j', 'number of sub-packages built at once'),
+                    ] + [opt for opt in old_build.user_options
+                         if opt[1] != 'j']
 
     def initialize_options (self):
         old_build.initialize_options(self)
         self.sublevel = 0
+        self.jobs = None
         self.ran = False
 
     def finalize_options(self):
         old_build.finalize_options(self)
         self.sublevel = int(self.sublevel)
+        if self.jobs is None:
+            self.jobs = self.distribution.parallel_build
+        elif self.jobs is not True:
+            self.jobs = int(self.jobs)
         if self.build_base[-1] == '/' or self.build_base[-1] == '\\':
             self.build_base = self.build_base[:-1]
         options.set_build_dir(os.path.basename(self.build_base))
@@ -124,6 +132,9 @@ class build(old_build):
             self.run_command('dependencies')
 
         options.set_top_level(self.sublevel)
+        ## manifest of generated files, for clean
+        configured_files.declare(self.distribution.generated_files or [])
+        configured_files.save()
         if self.distribution.subpackages != None:
             install = self.get_finalized_command('install')
             if install.ran:
@@ -147,9 +158,10 @@ class build(old_build):
                     argv.remove(arg)
 
             argv += ['--sublevel=' + str(self.sublevel + 1)]
-            process_subpackages(self.distribution.parallel_build, 'build',
+            process_subpackages(self.jobs, 'build',
                                 self.build_base, self.distribution.subpackages,
                                 argv, self.distribution.quit_on_error)
 
         old_build.run(self)
+        configured_files.save()
         self.ran = True
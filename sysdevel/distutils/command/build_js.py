@@ -107,13 +107,15 @@ class build_js(build_ext):
             working_dir = os.path.abspath(os.path.join(build.build_temp,
                                                        'web', wext.name))
             mkdir(working_dir)
+            changed = False  ## pyjs inputs rewritten
+            updated = False  ## target contents rewritten
 
             for support in wext.extra_support_files:
                 src_file = os.path.join(CLIENT_SUPPORT_DIR, support + '.in')
                 if not os.path.exists(src_file):
                     src_file = src_file[:-3]
                 dst_file = os.path.join(working_dir, support)
-                configure_file(environ, src_file, dst_file)
+                changed = configure_file(environ, src_file, dst_file) or changed
 
             reprocess = True
             ref = os.path.join(target, wext.name + '.html')
@@ -124,15 +126,19 @@ class build_js(build_ext):
                         reprocess = True
             if reprocess:
                 ## Special handling for 'public' directory
-                configure_files(environ, os.path.join(src_dir, 'public'),
-                                '*', os.path.join(working_dir, 'public'),
-                                excludes=['.svn', 'CVS'])
-
-                if len(wext.sources) > 0:
-                    for s in wext.sources:
-                        configure_file(environ, s,
-                                       os.path.join(working_dir,
-                                                    os.path.basename(s)))
+                if configure_files(environ, os.path.join(src_dir, 'public'),
+                                   '*', os.path.join(working_dir, 'public'),
+                                   excludes=['.svn', 'CVS']):
+                    changed = True
+
+                for s in wext.sources:
+                    changed = configure_file(environ, s,
+                                             os.path.join(working_dir,
+                                                          os.path.basename(s))
+                                             ) or changed
+                ## not if only touched: configured the same as last time
+                if len(wext.sources) > 0 and \
+                        (changed or self.force or not os.path.exists(ref)):
                     #import pyjs  # pylint: disable=F0401,W0611,W0612
                     ## TODO: use pyjs module directly (instead of 'pyjsbuild')
                     try:
@@ -160,7 +166,10 @@ class build_js(build_ext):
 
                     os.chdir(working_dir)
                     status = subprocess.call(cmd_line)
+                    updated = True
                     if status != 0:
+                        if os.path.exists(ref):
+                            os.remove(ref)  ## retry next time
                         raise Exception("Command '" + str(cmd_line) +
                                         "' returned non-zero exit status "
                                         + str(status))
@@ -169,8 +178,9 @@ class build_js(build_ext):
             pubdir = os.path.join(working_dir, 'public')
             excludes = ['.svn', 'CVS']
             if len(wext.sources) < 1:  ## PYJS did not run
-                copy_tree(pubdir, target, excludes=excludes,
-                          verbose=self.distribution.verbose)
+                if copy_tree(pubdir, target, excludes=excludes,
+                             verbose=self.distribution.verbose):
+                    updated = True
 
             for filename in wext.extra_public_files:
                 filepath = os.path.join(CLIENT_SUPPORT_DIR, filename + '.in')
@@ -185,19 +195,21 @@ class build_js(build_ext):
                                               options.stylesheet_dir, filename)
                 if not os.path.exists(targetfile):
                     configure_file(environ, filepath, targetfile)
+                    updated = True
 
-            ## Copy over downloaded files
+            ## Copy over downloaded files (hard linked: both are build output)
             js_dir = os.path.join(options.target_build_dir,
                                   options.javascript_dir)
-            if os.path.exists(js_dir):
-                copy_tree(js_dir, os.path.join(target, options.javascript_dir))
+            copies = [(js_dir, os.path.join(target, options.javascript_dir))]
             css_dir = os.path.join(options.target_build_dir,
                                    options.stylesheet_dir)
-            if os.path.exists(css_dir):
-                copy_tree(css_dir, os.path.join(target, options.stylesheet_dir))
+            copies.append((css_dir, os.path.join(target,
+                                                 options.stylesheet_dir)))
             php_dir = os.path.join(options.target_build_dir, options.script_dir)
-            if os.path.exists(php_dir):
-                copy_tree(php_dir, target)
+            copies.append((php_dir, target))
+            for src, dst in copies:
+                if os.path.exists(src) and copy_tree(src, dst, hardlink=True):
+                    updated = True
 
             ## pyjs processing ignores hidden files in public
             hidden = []
@@ -211,11 +223,13 @@ class build_js(build_ext):
                 targetfile = os.path.join(target, filepath)
                 if not os.path.exists(targetfile):
                     shutil.copyfile(os.path.join(pubdir, filepath), targetfile)
+                    updated = True
 
-            stat_info = os.stat(os.path.join(src_dir, 'public'))
-            uid = stat_info.st_uid
-            gid = stat_info.st_gid
-            recursive_chown(target, uid, gid)
+            if updated:  ## unchanged target keeps its ownership
+                stat_info = os.stat(os.path.join(src_dir, 'public'))
+                uid = stat_info.st_uid
+                gid = stat_info.st_gid
+                recursive_chown(target, uid, gid)
 
             if not os.path.lexists(os.path.join(target, 'index.html')) and \
                     os.path.lexists(os.path.join(target, wext.name + '.html')):
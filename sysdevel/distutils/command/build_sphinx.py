@@ -120,21 +120,23 @@ class build_sphinx(Command):
                                 reprocess = True
                                 break
             if reprocess:
+                changed = []  ## Sphinx inputs rewritten
                 working_dir = os.path.abspath(build.build_lib)
                 for package in buildpy.packages:
                     pkgdir = buildpy.get_package_dir(package)
                     pkgsrcdir = os.path.join(os.path.dirname(src_dir), pkgdir)
-                    configure_files(environ, pkgsrcdir,
-                                    '*.rst', os.path.join(working_dir, pkgdir))
+                    changed += configure_files(environ, pkgsrcdir, '*.rst',
+                                               os.path.join(working_dir, pkgdir))
 
                 cfg_dir = os.path.join(working_dir, dext.source_directory)
                 environ['BUILD_DIR'] = working_dir
 
-                copy_tree(doc_dir, working_dir, True,
-                          excludes=[dext.name, '.svn', 'CVS', '.git', '.hg*'])
-                copy_tree(os.path.join(doc_dir, dext.name),
-                          os.path.join(cfg_dir, dext.name), True,
-                          excludes=['.svn', 'CVS', '.git', '.hg*'])
+                changed += copy_tree(doc_dir, working_dir, True,
+                                     excludes=[dext.name, '.svn', 'CVS',
+                                               '.git', '.hg*'])
+                changed += copy_tree(os.path.join(doc_dir, dext.name),
+                                     os.path.join(cfg_dir, dext.name), True,
+                                     excludes=['.svn', 'CVS', '.git', '.hg*'])
                 for d in extra_dirs:
                     subdir = os.path.basename(os.path.normpath(d))
                     copy_tree(d, os.path.join(target, subdir), True,
@@ -160,12 +162,13 @@ class build_sphinx(Command):
                         return
 
                     reprocess = True
-                    ref = os.path.join(working_dir, 'html', 'index.html')
-                    if os.path.exists(ref) and not self.force:
+                    doxygen_ref = os.path.join(working_dir, 'html',
+                                               'index.html')
+                    if os.path.exists(doxygen_ref) and not self.force:
                         reprocess = False
                         for d in environ['C_SOURCE_DIRS'].split(' '):
                             for orig in glob.glob(os.path.join(d, '*.h*')):
-                                if os.path.getmtime(ref) < \
+                                if os.path.getmtime(doxygen_ref) < \
                                    os.path.getmtime(orig):
                                     reprocess = True
                                     break
@@ -188,7 +191,8 @@ class build_sphinx(Command):
                             out.close()
                         copy_tree('html', os.path.join(target, 'html'), True,
                                   excludes=['.svn', 'CVS', '.git', '.hg*'])
-                        copy_tree('xml', os.path.join(cfg_dir, 'xml'), True)
+                        changed += copy_tree('xml',
+                                             os.path.join(cfg_dir, 'xml'), True)
                         os.chdir(here)
                         create_breathe_stylesheet(target)
 
@@ -205,8 +209,12 @@ class build_sphinx(Command):
                 elif os.path.dirname(dext.sphinx_config) == '':
                     dext.sphinx_config =  os.path.join(doc_dir,
                                                        dext.sphinx_config)
-                configure_file(environ, dext.sphinx_config,
-                               os.path.join(cfg_dir, 'conf.py'))
+                if configure_file(environ, dext.sphinx_config,
+                                  os.path.join(cfg_dir, 'conf.py')):
+                    changed.append(os.path.join(cfg_dir, 'conf.py'))
+                ## sources only touched: same input, same documentation
+                if not changed and os.path.exists(ref) and not self.force:
+                    continue
                 import warnings
                 try:
                     import sphinx  # pylint: disable=W0612
@@ -236,6 +244,8 @@ class build_sphinx(Command):
                                         'html', status=status)
                     sphinx_app.build(force_all=True, filenames=None)
                 except Exception:  # pylint: disable=W0703
+                    if os.path.exists(ref):
+                        os.remove(ref)  ## retry next time
                     if build_verbose:
                         print('ERROR: ' + str(sys.exc_info()[1]))
                     else:
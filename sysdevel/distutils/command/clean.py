@@ -34,66 +34,107 @@ import shutil
 from distutils.command.clean import clean as old_clean
 
 from sysdevel.distutils.recur import process_subpackages
-from sysdevel.distutils.prerequisites import delete_cache, RequirementsFinder
+from sysdevel.distutils.prerequisites import delete_cache, find_requirements
+from sysdevel.distutils.configured_files import configured_files
+from sysdevel.distutils.filesystem import walk
+from sysdevel.distutils.parallel import parallel_map
+from sysdevel.distutils import options
+
+
+STALE_SUFFIXES = ('.pyc', '.lreg', '.sibling')
+
+## not searched for stale files
+PRUNED_DIRECTORIES = ['.svn', 'CVS', '.git', '.hg']
+
+
+def _is_under(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def _remove(path):
+    if os.path.isfile(path) or os.path.islink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    elif os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
 
 
 class clean(old_clean):
+    user_options = old_clean.user_options + [
+        ('jobs=', 'j', 'number of sub-packages cleaned at once'),]
+
+    def initialize_options(self):
+        old_clean.initialize_options(self)
+        self.jobs = None
+
+    def finalize_options(self):
+        old_clean.finalize_options(self)
+        if self.jobs is not None:
+            self.jobs = int(self.jobs)
+
     def run(self):
-        # Remove .pyc, .lreg and .sibling files
-        if hasattr(os, 'walk'):
-            for _, _, files in os.walk('.'):
-                for f in files:
-                    if f.endswith('.pyc') or \
-                            f.endswith('.lreg') or f.endswith('.sibling'):
-                        try:
-                            os.unlink(f)
-                        except OSError:
-                            pass
-
-        # Remove generated directories
         build = self.get_finalized_command('build')
         build_dir = build.build_base
-        if os.path.exists(build_dir):
-            try:
-                shutil.rmtree(build_dir, ignore_errors=True)
-            except OSError:
-                pass
-        if self.distribution.subpackages != None:
-            subs = []
-            for (pkg_name, pkg_dir) in self.distribution.subpackages:
-                rf = RequirementsFinder(os.path.join(pkg_dir, 'setup.py'))
-                if rf.is_sysdevel_build:
-                    subs.append((pkg_name, pkg_dir))
+        top_dir = os.path.abspath('.')
+        jobs = self.jobs or build.jobs
+
+        ## Generated directories and files, from the manifests recorded
+        ##   while building (read before the build directory goes).
+        ## Sub-packages built by sysdevel are cleaned here, recursively;
+        ##   those without a manifest are cleaned by their own setup.py
+        directories = [os.path.abspath(build_dir)]
+        files = []
+        if self.distribution.generated_files != None:
+            files += [os.path.abspath(path)
+                      for path in self.distribution.generated_files]
+        children = []
+        packages = [(top_dir, self.distribution.subpackages or [])]
+        while packages:
+            pkg_dir, subpackages = packages.pop()
+            sysdevel_dir = os.path.join(pkg_dir, 'pysysdevel')
+            if not os.path.islink(sysdevel_dir):
+                ## ignores symlinked directory
+                directories.append(sysdevel_dir)
+            if configured_files.recorded(pkg_dir):
+                files += [path for path in configured_files.outputs(pkg_dir)
+                          if _is_under(path, top_dir)]
+            for (sub_name, sub_dir) in subpackages:
+                sub_dir = os.path.join(pkg_dir, sub_dir)
+                rf = find_requirements(os.path.join(sub_dir, 'setup.py'))
+                if not rf.is_sysdevel_build:
+                    continue
+                if configured_files.recorded(sub_dir):
+                    directories.append(
+                        os.path.abspath(os.path.join(sub_dir, build_dir)))
+                    packages.append((sub_dir, rf.subpackages_list))
+                else:
+                    children.append((sub_name, sub_dir))
+
+        # Remove .pyc, .lreg and .sibling files
+        pruned = directories + [os.path.abspath(options.default_download_dir)]
+        for root, _, filenames in walk(top_dir, PRUNED_DIRECTORIES, pruned):
+            for f in filenames:
+                if f.endswith(STALE_SUFFIXES):
+                    files.append(os.path.join(root, f))
+
+        ## nothing inside a removed directory needs removing itself
+        files = [path for path in files
+                 if not [d for d in directories if _is_under(path, d)]]
+        if children:
+            _remove(directories[0])
             idx = 0
             for i in range(len(sys.argv)):
                 idx = i
                 if 'setup.py' in sys.argv[idx]:
                     break
             argv = list(sys.argv[idx+1:])
-            process_subpackages(build.distribution.parallel_build, 'clean',
-                                build.build_base, subs, argv, False)
-
-        # Remove user-specified generated files
-        if self.distribution.generated_files != None:
-            for path in self.distribution.generated_files:
-                if os.path.isfile(path) or os.path.islink(path):
-                    try:
-                        os.unlink(path)
-                    except OSError:
-                        pass
-                elif os.path.isdir(path):
-                    try:
-                        shutil.rmtree(path, ignore_errors=True)
-                    except OSError:
-                        pass
-
-        # Remove sysdevel
-        if os.path.exists('pysysdevel'):
-            try:
-                ## ignores symlinked directory
-                shutil.rmtree('pysysdevel', ignore_errors=True)
-            except OSError:
-                pass
+            process_subpackages(jobs, 'clean', build.build_base,
+                                children, argv, False)
+        if jobs is True:
+            jobs = None  ## one per CPU
+        parallel_map(_remove, directories + files, jobs)
 
         old_clean.run(self)
         delete_cache()
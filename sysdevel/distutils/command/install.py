@@ -107,7 +107,7 @@ class install(old_install):
                     argv.remove(arg)
 
             argv += ['--sublevel=' + str(self.sublevel + 1)]
-            process_subpackages(build.distribution.parallel_build, 'install',
+            process_subpackages(build.jobs, 'install',
                                 build.build_base, self.distribution.subpackages,
                                 argv, build.distribution.quit_on_error)
 
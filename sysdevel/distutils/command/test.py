@@ -39,7 +39,7 @@ from distutils import log
 from sysdevel.distutils.configure import configure_package
 from sysdevel.distutils.extensions import FortranUnitTest, CUnitTest, CppUnitTest
 from sysdevel.distutils.recur import process_subpackages
-from sysdevel.distutils.prerequisites import RequirementsFinder, check_call
+from sysdevel.distutils.prerequisites import find_requirements, check_call
 from sysdevel.distutils.filesystem import copy_tree
 from sysdevel.util import is_string
 from sysdevel.distutils import options
@@ -194,16 +194,20 @@ def create_cppunit_driver(unit):
 class test(Command):
     description = "unit testing"
 
-    user_options = [('sublevel=', None, 'sub-package level'),]
+    user_options = [('sublevel=', None, 'sub-package level'),
+                    ('jobs=', 'j', 'number of sub-packages tested at once'),]
 
     def initialize_options(self):
         self.tests = []
         self.sublevel = 0
+        self.jobs = None
 
     def finalize_options(self):
         if not self.tests: 
             self.tests = self.distribution.tests
         self.sublevel = int(self.sublevel)
+        if self.jobs is not None:
+            self.jobs = int(self.jobs)
 
 
     def _get_python_tests(self):
@@ -295,7 +299,7 @@ class test(Command):
         if self.distribution.subpackages != None:
             subs = []
             for (pkg_name, pkg_dir) in self.distribution.subpackages:
-                rf = RequirementsFinder(os.path.join(pkg_dir, 'setup.py'))
+                rf = find_requirements(os.path.join(pkg_dir, 'setup.py'))
                 if rf.is_sysdevel_build:
                     subs.append((pkg_name, pkg_dir))
             idx = 0
@@ -309,7 +313,7 @@ class test(Command):
                     argv.remove(arg)
 
             argv += ['--sublevel=' + str(self.sublevel + 1)]
-            failed = process_subpackages(build.distribution.parallel_build,
+            failed = process_subpackages(self.jobs or build.jobs,
                                          'test',
                                          os.path.abspath(build.build_base),
                                          subs, argv, False)
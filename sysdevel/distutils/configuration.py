@@ -35,13 +35,21 @@ import imp
 import glob
 import traceback
 import shutil
+import tempfile
+import threading
+import time
 from distutils.sysconfig import get_python_lib
 from types import ModuleType
 
-from sysdevel.distutils.prerequisites import programfiles_directories, find_header, find_library, find_definitions, find_program, system_uses_homebrew, compare_versions, install_pypkg_without_fetch, RequirementsFinder, ConfigError, read_cache, requirement_versioning
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from sysdevel.distutils.prerequisites import programfiles_directories, find_header, find_library, find_definitions, find_program, system_uses_homebrew, compare_versions, install_pypkg_without_fetch, RequirementsFinder, ConfigError, requirement_versioning
 from sysdevel.distutils.filesystem import glob_insensitive, mkdir
-from sysdevel.distutils.fetching import urlretrieve, fetch, unarchive, open_archive, DownloadError, URLError, HTTPError, ContentTooShortError
-from sysdevel.distutils.building import process_progress
+from sysdevel.distutils.fetching import urlretrieve, fetch, unarchive, read_archive_member, DownloadError, URLError, HTTPError, ContentTooShortError
+from sysdevel.distutils.supervisor import run_process
 from sysdevel.distutils.pypi_exceptions import pypi_exceptions
 from sysdevel.distutils import options
 from sysdevel.util import is_string
@@ -54,13 +62,23 @@ archive_types = [ '.tar.gz', '.zip', '.tar.bz2', '.tgz', '.tar.Z', '.tar']
 # pylint: disable=W0223
 
 class config(object):
+    ## expected checksums of downloaded files, {filename: 'sha256:<hex>'}
+    checksums = dict()
+    ## whether install() must not run alongside other installs
+    ##  (e.g. because it changes the working directory)
+    exclusive_install = False
+    ## whether is_installed() (or install()) changes os.environ, so
+    ##  must not run alongside other detections and installs
+    changes_environment = False
+
     def __init__(self, dependencies=None, debug=False, force=False):
         if dependencies is None:
             self.dependencies = []
         else:
             self.dependencies = dependencies
         self.debug = debug
-        self.environment = read_cache()
+        ## only this helper's results; merged by the configure driver
+        self.environment = dict()
         self.found = False
         self.force = force
 
@@ -74,6 +92,11 @@ class config(object):
     def is_installed(self, environ, version, strict=False):
         raise NotImplementedError('is_installed')
 
+    def fingerprint_paths(self):
+        ## files whose change invalidates a configuration, besides
+        ## those named in self.environment
+        return []
+
     def install(self, environ, version, strict=False, locally=True):
         raise NotImplementedError('install')
 
@@ -188,13 +211,14 @@ class file_config(config):
 
 
     def download(self, environ, version, strict=False):
+        website = self.website
         if not version is None:
-            self.website = self.website + '/' + version + '/'
+            website = website + '/' + version + '/'
         for t in self.targets:
             if is_string(t):
-                fetch(self.website, t, t)
+                fetch(website, t, t)
             else:
-                fetch(self.website + '/' + t[0], t[1], t[1])
+                fetch(website + '/' + t[0], t[1], t[1])
         return ''
 
 
@@ -318,10 +342,8 @@ class nodejs_config(config):
 
             cmd_line = pre + [environ['NPM'], 'update'] + post
             try:
-                p = subprocess.Popen(cmd_line, stdout=log, stderr=log)
-                status = process_progress(p)
+                status = run_process(cmd_line, log)
             except KeyboardInterrupt:
-                p.terminate()
                 log.close()
                 raise
             if status != 0:
@@ -333,10 +355,8 @@ class nodejs_config(config):
 
             cmd_line = pre + [environ['NPM'], 'install', 'node-webgl'] + post
             try:
-                p = subprocess.Popen(cmd_line, stdout=log, stderr=log)
-                status = process_progress(p)
+                status = run_process(cmd_line, log)
             except KeyboardInterrupt:
-                p.terminate()
                 log.close()
                 raise
             if status != 0:
@@ -393,15 +413,31 @@ class py_config(config):
         return True
 
 
-    def is_installed(self, environ, version=None, strict=False):
+    def locate(self):
+        ## pkgutil methods don't work immediately after an install
         local_dirs = [os.path.join(os.path.abspath(options.target_build_dir),
                                    options.local_lib_dir)]
-        ## pkgutil methods don't work immediately after an install
         for d in local_dirs + [get_python_lib()] + sys.path:
             if os.path.exists(os.path.join(d, self.pkg + '.py')) or \
                os.path.exists(os.path.join(d, self.pkg, '__init__.py')):
-                self.found = True
-                break
+                return d
+        return None
+
+
+    def fingerprint_paths(self):
+        location = self.locate()
+        if location is None:
+            return []
+        if os.path.exists(os.path.join(location, self.pkg + '.py')):
+            return [os.path.join(location, self.pkg + '.py')]
+        return [os.path.join(location, self.pkg, '__init__.py')]
+
+
+    def is_installed(self, environ, version=None, strict=False):
+        local_dirs = [os.path.join(os.path.abspath(options.target_build_dir),
+                                   options.local_lib_dir)]
+        if self.locate() is not None:
+            self.found = True
         if self.did_install:  ## assume correct version was just installed
             return self.found
         if self.found and not version is None:
@@ -456,24 +492,24 @@ class pypi_config(py_config):
         name = pkg
         if indexed_as:
             name = indexed_as
-        if dependencies is None:
-            if version is None:
-                version = latest_pypi_version(name)
-            archive = name + '-' + version + pypi_archive(name, version)
-            fetch(pypi_url(name), archive, archive)
-            z, names = open_archive(archive)
-            try:
-                extract_dir = os.path.join(options.target_build_dir, '.' + pkg)
-                member = [s for s in names if 'setup.py' in s][0]
-                z.extract(member, extract_dir)
-                rf = RequirementsFinder(os.path.join(extract_dir, member))
-                dependencies = rf.requires_list + rf.prerequisite_list
-            except Exception:  # pylint: disable=W0703
-                if debug:
-                    traceback.print_exc()
-            z.close()
         py_config.__init__(self, pkg, version, dependencies, name,
                            debug, force)
+        self._dependencies = dependencies  ## None: read from setup.py
+
+
+    def _get_dependencies(self):
+        ## only needed (and looked up) if the package will be installed
+        if self._dependencies is None:
+            if not self.force and self.locate() is not None:
+                return []
+            self._dependencies = pypi_dependencies(self.indexed, self.version,
+                                                   self.debug)
+        return self._dependencies
+
+    def _set_dependencies(self, dependencies):
+        self._dependencies = dependencies
+
+    dependencies = property(_get_dependencies, _set_dependencies)
 
 
     def download(self, environ, version, strict=False):
@@ -516,14 +552,211 @@ def dynamic_module(pkg, version=None, strict=False, dependencies=None,
 
 
 def is_pypi_listed(pkg):
+    cached = pypi_listed.get(pkg)
+    if cached is not None and time.time() - cached[1] < INDEX_TTL:
+        return cached[0]
     if not os.path.exists(options.target_build_dir):
         mkdir(options.target_build_dir)
     listing = os.path.join(options.target_build_dir, '.' + pkg + '_list_test')
     try:
         urlretrieve(pypi_url(pkg, False), listing)
-        return True
+        listed = True
     except (DownloadError, URLError, HTTPError, ContentTooShortError):
-        return False
+        if getattr(sys.exc_info()[1], 'code', None) is None:
+            ## unreachable, rather than not listed
+            if cached is not None:
+                return cached[0]
+            return False
+        listed = False
+    pypi_listed.set(pkg, [listed, time.time()])
+    return listed
+
+
+## PyPI/download index listings ######
+
+INDEX_CACHE_FILE = 'index_listings.json'
+INDEX_TTL = 24 * 60 * 60  ## seconds before a listing is fetched again
+PYPI_METADATA_FILE = 'pypi_metadata.json'
+PYPI_LISTED_FILE = 'pypi_listed.json'
+
+
+def _parse_listing(contents, pattern, archives=False):
+    ## versions found in an index page, and the archive suffix of each
+    pre = pattern.split('*')[0]
+    post = pattern.split('*')[-1]
+    versions = []
+    suffixes = dict()
+    idx = contents.find(pre, 0)
+    l = len(pre)
+    while idx >= 0:
+        endl = contents.find('\n', idx)
+        end = contents.find(post, idx)
+        if archives:
+            end_t = contents.find('.tar', idx, endl)
+            end_z = contents.find('.zip', idx, endl)
+            if end_t > 0 and end_z > 0:
+                end = min(end_t, end_z)
+            else:
+                end = max(end_t, end_z)
+        if end > 0 and end < endl:
+            version = contents[idx+l:end]
+            versions.append(version)
+            for archive in archive_types:
+                if contents[end:].startswith(archive):
+                    suffixes.setdefault(version, archive)
+                    break
+        idx = contents.find(pre, end)
+    return versions, suffixes
+
+
+class _UserCache(object):
+    '''
+    Dictionary kept as JSON in the user cache directory,
+    shared by all threads of a process and across runs.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._entries = None
+        self._path = None
+
+    def _load(self):
+        path = os.path.join(options.user_cache_dir, self.filename)
+        if path != self._path:
+            self._path = path
+            self._entries = dict()
+            if os.path.exists(path):
+                try:
+                    f = open(path, 'r')
+                    try:
+                        self._entries = json.load(f)
+                    finally:
+                        f.close()
+                except Exception:  # pylint: disable=W0703
+                    pass
+        return self._entries
+
+    def _save(self):
+        directory = os.path.dirname(self._path)
+        try:
+            mkdir(directory)
+            fd, tmp_path = tempfile.mkstemp(prefix='.' + self.filename,
+                                            dir=directory)
+            f = os.fdopen(fd, 'w')
+            try:
+                json.dump(self._entries, f)
+            finally:
+                f.close()
+            if os.path.exists(self._path):
+                os.remove(self._path)  ## rename does not overwrite on Windows
+            os.rename(tmp_path, self._path)
+        except (IOError, OSError):
+            pass  ## only a cache
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            return self._load().get(key, default)
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        self._lock.acquire()
+        try:
+            self._load()[key] = value
+            self._save()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._load()
+            self._entries = dict()
+            if os.path.exists(self._path):
+                os.remove(self._path)
+        finally:
+            self._lock.release()
+
+
+class _IndexCache(_UserCache):
+    '''
+    Parsed version listings of download index pages.
+    Stale listings are used when the index is unreachable.
+    Each index is fetched by one thread at a time, without holding
+    the cache lock; other threads asking for it wait for that fetch.
+    '''
+    def __init__(self):
+        _UserCache.__init__(self, INDEX_CACHE_FILE)
+        self._fetching = dict()  ## key: Event set when fetched
+
+    def _parsed(self, entry):
+        ## json yields unicode strings
+        return ([str(v) for v in entry['versions']],
+                dict([(str(v), str(a))
+                      for v, a in entry['suffixes'].items()]))
+
+    def _fetch(self, website):
+        fd, tmp_path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            urlretrieve(website.rstrip('/') + '/', tmp_path)
+            f = open(tmp_path, 'r')
+            try:
+                return f.read()
+            finally:
+                f.close()
+        finally:
+            os.remove(tmp_path)
+
+    def listing(self, website, pattern, archives=False):
+        '''
+        The (versions, {version: archive suffix}) found at website
+        for the given glob pattern.
+        '''
+        key = '|'.join([website, pattern, str(archives)])
+        waited = False
+        while True:
+            self._lock.acquire()
+            try:
+                entry = self.get(key)
+                if entry is not None and \
+                   (waited or time.time() - entry['time'] < INDEX_TTL):
+                    return self._parsed(entry)  ## stale after a failed fetch
+                fetched = self._fetching.get(key)
+                if fetched is None:
+                    fetched = self._fetching[key] = threading.Event()
+                    break
+            finally:
+                self._lock.release()
+            while not fetched.is_set():
+                fetched.wait(0.1)  ## responsive to KeyboardInterrupt
+            waited = True
+        try:
+            try:
+                contents = self._fetch(website)
+            except (DownloadError, URLError, HTTPError, ContentTooShortError):
+                if entry is not None:  ## offline
+                    return self._parsed(entry)
+                raise
+            versions, suffixes = _parse_listing(contents, pattern, archives)
+            self.set(key, dict(time=time.time(), versions=versions,
+                               suffixes=suffixes))
+            return versions, suffixes
+        finally:
+            self._lock.acquire()
+            try:
+                del self._fetching[key]
+            finally:
+                self._lock.release()
+            fetched.set()
+
+
+index_cache = _IndexCache()
+
+pypi_metadata = _UserCache(PYPI_METADATA_FILE)
+
+pypi_listed = _UserCache(PYPI_LISTED_FILE)
 
 
 def pypi_url(pkg, src=True):
@@ -552,21 +785,9 @@ def pypi_archive(which, version):
         raise DownloadError('No PyPi version of ' + which + ' available.')
     ex = None
     try:
-        if not os.path.exists(options.target_build_dir):
-            mkdir(options.target_build_dir)
-        listing = os.path.join(options.target_build_dir, '.' + which + '_list')
-        if not os.path.exists(listing):
-            urlretrieve(pypi_url(which), listing)
-        f = open(listing, 'r')
-        contents = f.read()
-        f.close()
-        l = len(which + '-' + version)
-        idx = contents.find(which + '-' + version)
-        while idx >= 0:
-            for archive in archive_types:
-                if contents[idx+l:].startswith(archive):
-                    return archive
-            idx = contents.find(which + '-' + version, idx+1)
+        _, suffixes = index_cache.listing(pypi_url(which), which + '-*', True)
+        if version in suffixes:
+            return suffixes[version]
         raise DownloadError('Invalid PyPi page for ' + which + '.')
     except (DownloadError, URLError, HTTPError, ContentTooShortError) as e:
         ex = e
@@ -583,33 +804,53 @@ def pypi_archive(which, version):
 
 
 
+def pypi_dependencies(which, version=None, debug=False):
+    '''
+    Requirements declared by the setup.py of a PyPI source package.
+    Results are kept per version in the user cache; the setup.py is
+    read from the archive stream without downloading all of it.
+    '''
+    if version is None:
+        version = latest_pypi_version(which)
+    key = which + '-' + str(version)
+    cached = pypi_metadata.get(key)
+    if cached is not None:
+        return [_from_json(dep) for dep in cached]
+    try:
+        archive = which + '-' + version + pypi_archive(which, version)
+        url = pypi_url(which).rstrip('/') + '/' + archive
+        try:
+            code = read_archive_member(archive, 'setup.py', url=url)
+        except DownloadError:
+            fetch(pypi_url(which), archive, archive)  ## needs the whole file
+            code = read_archive_member(archive, 'setup.py', url=url)
+        dependencies = []
+        if code is not None:
+            rf = RequirementsFinder(codestring=code)
+            dependencies = rf.requires_list + rf.prerequisite_list
+    except Exception:  # pylint: disable=W0703
+        if debug:
+            traceback.print_exc()
+        return []  ## not cached; try again next time
+    pypi_metadata.set(key, dependencies)
+    return dependencies
+
+
+def _from_json(value):
+    ## json yields unicode strings and lists instead of tuples
+    if isinstance(value, list):
+        return tuple([_from_json(v) for v in value])
+    if is_string(value):
+        return str(value)
+    return value
+
+
 def available_versions(what, website, pattern, archives=False):
     pre = pattern.split('*')[0]
     post = pattern.split('*')[-1]
     ex = None
     try:
-        listing = os.path.join(options.target_build_dir, '.' + what + '_list')
-        urlretrieve(website + '/', listing)
-        versions = []
-        f = open(listing, 'r')
-        contents = f.read()
-        f.close()
-        idx = contents.find(pre, 0)
-        l = len(pre)
-        while idx >= 0:
-            endl = contents.find('\n', idx)
-            end = contents.find(post, idx)
-            if archives:
-                end_t = contents.find('.tar', idx, endl)
-                end_z = contents.find('.zip', idx, endl)
-                if end_t > 0 and end_z > 0:
-                    end = min(end_t, end_z)
-                else:
-                    end = max(end_t, end_z)
-            if end > 0 and end < endl:
-                versions.append(contents[idx+l:end])
-            idx = contents.find(pre, end)
-        return versions
+        return list(index_cache.listing(website, pattern, archives)[0])
     except (DownloadError, URLError, HTTPError, ContentTooShortError) as e:
         ex = e
 
@@ -626,7 +867,7 @@ def available_versions(what, website, pattern, archives=False):
         return version_list
     if ex:
         raise ex
-    raise DownloadError('No PyPi version of ' + which + ' available.')
+    raise DownloadError('No PyPi version of ' + what + ' available.')
 
 
 
@@ -669,6 +910,74 @@ DEBUG_PYPI = True
 DEBUG_LOCAL = False
 
 
+class _HelperModules(object):
+    '''
+    Table of configuration helper modules, from a single listing of
+    sysdevel.distutils.configure and of each user configuration directory.
+    '''
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._listings = dict()
+        self._resolved = dict()
+
+    def _modules(self, directory):
+        if not directory in self._listings:
+            names = set()
+            try:
+                entries = os.listdir(directory)
+            except OSError:
+                entries = []
+            for entry in entries:
+                base, ext = os.path.splitext(entry)
+                if ext in ['.py', '.pyc']:
+                    names.add(base)
+                elif os.path.exists(os.path.join(directory, entry,
+                                                 '__init__.py')):
+                    names.add(entry)
+            self._listings[directory] = names
+        return self._listings[directory]
+
+    def resolve(self, name, cfg_dir):
+        '''
+        Full module name of the helper for name, or None if it must
+        come from the Python Package Index.
+        '''
+        self._lock.acquire()
+        try:
+            key = (name, cfg_dir)
+            if not key in self._resolved:
+                self._resolved[key] = self._resolve(name, cfg_dir)
+            return self._resolved[key]
+        finally:
+            self._lock.release()
+
+    def _resolve(self, name, cfg_dir):
+        package = 'sysdevel.distutils.configure.'
+        builtin = self._modules(os.path.join(os.path.dirname(__file__),
+                                             'configure'))
+        for suffix in ['', '_js', '_py']:
+            if name + suffix in builtin:
+                return package + name + suffix
+        local = self._modules(cfg_dir)
+        if name in local and not is_pypi_listed(name):
+            return name
+        for suffix in ['_js', '_py']:
+            if name + suffix in local:
+                return name + suffix
+        return None
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._listings = dict()
+            self._resolved = dict()
+        finally:
+            self._lock.release()
+
+
+helper_modules = _HelperModules()
+
+
 def find_package_config(help_name, helper_funct, *args, **kwargs):
     setup_directory = kwargs.get('setup_dir', os.getcwd())
 
@@ -677,44 +986,21 @@ def find_package_config(help_name, helper_funct, *args, **kwargs):
         return None
 
     base = help_name = help_name.strip()
-    packages = ['sysdevel.distutils.configure.', '',]
     cfg_dir = os.path.abspath(os.path.join(setup_directory,
                                            options.user_config_dir))
     if os.path.exists(cfg_dir) and not cfg_dir in sys.path:
         sys.path.insert(0, cfg_dir)
 
     successful = False
-    for package in packages:
-        if successful:
-            continue
-        full_name = package + help_name
+    full_name = helper_modules.resolve(base, cfg_dir)
+    if full_name is not None:
         try:
-            if not package and is_pypi_listed(base):
-                ## Likely actual package module
-                raise ImportError('Invalid config')
             __import__(full_name, globals=globals())
             helper = sys.modules[full_name]
-            module_path = os.path.dirname(helper.__file__)
-            if not package and \
-               not module_path.endswith(options.user_config_dir):
-                ## Probably an actual package module
-                raise ImportError('Invalid config')
             successful = True
         except (ImportError, KeyError):
-            full_name = package + help_name + '_js'
-            try:
-                __import__(full_name, globals=globals())
-                helper = sys.modules[full_name]
-                successful = True
-            except (ImportError, KeyError):
-                full_name = package + help_name + '_py'
-                try:
-                    __import__(full_name, globals=globals())
-                    helper = sys.modules[full_name]
-                    successful = True
-                except (ImportError, KeyError):
-                    if DEBUG_LOCAL and not package and not is_pypi_listed(base):
-                        traceback.print_exc()
+            if DEBUG_LOCAL:
+                traceback.print_exc()
     if not successful:
         try:
             ## grab it from the Python Package Index
@@ -28,17 +28,23 @@ Entry point for finding/installing required libraries
 """
 
 import os
+import copy
 import sys
 import platform
 import traceback
 
 from sysdevel.distutils.prerequisites import read_cache, save_cache, in_prerequisites
+from sysdevel.distutils.prerequisites import environment_store
 from sysdevel.distutils.prerequisites import system_uses_macports, system_uses_homebrew
 from sysdevel.distutils.prerequisites import requirement_versioning
 from sysdevel.distutils.configuration import dynamic_module, latest_pypi_version
 from sysdevel.distutils.configuration import is_pypi_listed, find_package_config
 from sysdevel.distutils.pypi_exceptions import pypi_exceptions
 from sysdevel.distutils.filesystem import mkdir
+from sysdevel.distutils.file_index import file_index
+from sysdevel.distutils.parallel import WorkerPool, reraise, cpu_budget
+from sysdevel.distutils.fetching import register_checksums, collect_downloads
+from sysdevel.distutils.artifact_store import artifact_store
 from sysdevel.distutils import options as opts
 from sysdevel.util import is_string
 
@@ -64,8 +70,12 @@ def simplify_version(version):
 
 
 def configure_package(which, locally=True):
-    return find_package_config(which, __run_helper__, dict(), skip=False,
-                               install=True, quiet=False, locally=locally)
+    try:
+        return find_package_config(which, __run_helper__, read_cache(),
+                                   skip=False, install=True, quiet=False,
+                                   locally=locally)
+    finally:
+        environment_store.flush()
 
 
 # pylint: disable=W0102
@@ -140,14 +150,14 @@ def configure_system(prerequisite_list, version,
                                  "detected. All required libraries will be " +
                                  "built locally.\n")
 
-        for help_name in prerequisite_list:
-            if len(help_name) > 0:
-                environment = find_package_config(help_name, __run_helper__,
-                                                  environment, skip,
-                                                  install, quiet,
-                                                  out, err, locally, download)
+        environment = __configure_graph__(prerequisite_list, environment,
+                                          skip, install, quiet, out, err,
+                                          locally, download,
+                                          options.get('jobs', None))
         save_cache(environment)
+        file_index.save()
     except Exception:  # pylint: disable=W0703
+        environment_store.flush()  ## keep what was configured
         logfile = os.path.join(opts.target_build_dir, 'config.log')
         if not os.path.exists(opts.target_build_dir):
             mkdir(opts.target_build_dir)
@@ -162,12 +172,14 @@ def configure_system(prerequisite_list, version,
 
 
 configured = []
+unchanged = []  ## configured from their fingerprints
 
 def __run_helper__(short_name, helper, version, strict,
                    environment, skip, install, quiet,
                    out=sys.stdout, err=sys.stderr,
                    locally=True, download=False):
     configured.append(short_name)
+    variables = __fingerprint_variables__()  ## before detection changes them
     try:
         cfg = helper.configuration()
     except Exception:
@@ -177,53 +189,480 @@ def __run_helper__(short_name, helper, version, strict,
         err.write('Error loading ' + short_name + ver_info +
                   ' configuration.\n')
         raise
+    register_checksums(cfg.checksums)
+    dep_names = []
     for dep in cfg.dependencies:
         dep_name = dep
         if not is_string(dep):
             dep_name = dep[0]
+        dep_names.append(dep_name)
         if dep_name in configured:
             continue
-        environment = find_package_config(dep, __run_helper__, 
-                                          environment, skip, install, quiet,
-                                          out, err, locally, download)
-        if not environment is None:
-            save_cache(environment)
-    environment = read_cache()
+        dep_env = find_package_config(dep, __run_helper__,
+                                      environment, skip, install, quiet,
+                                      out, err, locally, download)
+        if not dep_env is None:
+            environment = dep_env
     if not quiet:
-        msg = 'Checking for ' + short_name
-        if version:
-            msg += ' v.' + version
-        if strict:
-            msg += ' (strict)'
-        msg += ' ' * (40 - len(msg))
-        out.write(msg)
+        out.write(__checking_message__(short_name, version, strict))
         out.flush()
     if download:
         cfg.download(environment, version, strict)
 
+    found = None
+    before = dict(os.environ)
     if skip:
         cfg.null()
+    elif __reuse__(short_name, cfg, version, strict, dep_names, variables):
+        if not quiet:
+            out.write('found.\n')
     elif not cfg.is_installed(environment, version, strict):
+        found = False
         if install:
             if not quiet:
                 out.write('Installing...\n')
             cfg.install(environment, version, strict, locally)
+            file_index.invalidate()
+            found = True
         elif not quiet:
             out.write('not found.\n')
-    elif cfg.force:
-        if install:
+    else:
+        found = True
+        if cfg.force and install:
             if not quiet:
                 out.write('Forcing install...\n')
             cfg.install(environment, version, strict, locally)
+            file_index.invalidate()
         elif not quiet:
             out.write('found.\n')
-    elif not quiet:
-        out.write('found.\n')
+    if found is not None:
+        __record__(short_name, cfg, version, strict, found, variables,
+                   __environ_delta__(before))
+    env = __merge_environment__(cfg, environment, short_name)
+    environment_store.replace(env)  ## intermediate cache, written at the end
+    return env
+
+
+def __checking_message__(short_name, version, strict):
+    msg = 'Checking for ' + short_name
+    if version:
+        msg += ' v.' + version
+    if strict:
+        msg += ' (strict)'
+    msg += ' ' * (40 - len(msg))
+    return msg
+
+
+def __merge_environment__(cfg, environment, short_name):
     env = dict(list(cfg.environment.items()) + list(environment.items()))
     if not 'PREREQUISITES' in env:
         env['PREREQUISITES'] = [short_name]
     else:
         tmp_env = env['PREREQUISITES'] + [short_name]
         env['PREREQUISITES'] = list(set(tmp_env))
-    save_cache(env)  ## intermediate cache
     return env
+
+
+
+## environment variables that influence where prerequisites are found
+FINGERPRINT_VARIABLES = ['PATH', 'LD_LIBRARY_PATH', 'DYLD_LIBRARY_PATH',
+                         'PYTHONPATH']
+
+def __fingerprint_variables__():
+    variables = dict()
+    for key, value in os.environ.items():
+        if key in FINGERPRINT_VARIABLES or key.endswith('_ROOT'):
+            variables[key] = value
+    return variables
+
+
+def __resolved_paths__(value, paths):
+    if is_string(value):
+        if os.path.isabs(value) and os.path.exists(value):
+            paths.append(value)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            __resolved_paths__(item, paths)
+    elif isinstance(value, dict):
+        for item in value.values():
+            __resolved_paths__(item, paths)
+
+
+def __file_state__(path):
+    try:
+        st = os.stat(path)
+        return [st.st_mtime, st.st_ino]
+    except OSError:
+        return None
+
+
+def __environ_delta__(before):
+    ## changes to os.environ since before: {name: (old, new)}, None if unset
+    delta = dict()
+    for key in set(list(before.keys()) + list(os.environ.keys())):
+        if before.get(key) != os.environ.get(key):
+            delta[key] = (before.get(key), os.environ.get(key))
+    return delta
+
+
+def __merge_deltas__(first, second):
+    if first is None or second is None:
+        return None
+    delta = dict(first)
+    for key, (old, new) in second.items():
+        if key in delta:
+            old = delta[key][0]
+        if old == new:
+            del delta[key]
+        else:
+            delta[key] = (old, new)
+    return delta
+
+
+def __replay_environ__(delta):
+    ## redo a detection's changes to os.environ; additions to a
+    ##  variable (e.g. PATH) are added to its current value
+    for key, (old, new) in delta.items():
+        current = os.environ.get(key)
+        if new is None:
+            if current is not None:
+                del os.environ[key]
+        elif old and current is not None and new.startswith(old):
+            added = new[len(old):]
+            if not current.endswith(added):
+                os.environ[key] = current + added
+        elif old and current is not None and new.endswith(old):
+            added = new[:-len(old)]
+            if not current.startswith(added):
+                os.environ[key] = added + current
+        else:
+            os.environ[key] = new
+
+
+def __record__(short_name, cfg, version, strict, found, variables, delta):
+    '''
+    Save the inputs of a configured prerequisite: the environment it
+    produced, the state of the files and directories named there (and
+    of its helper module), and the environment variables as they were
+    before detection. Its changes to os.environ (delta, None if unknown)
+    are saved to be redone when it is reused.
+    '''
+    if not found or delta is None:
+        environment_store.set_fingerprint(short_name, None)
+        return
+    paths = []
+    __resolved_paths__(cfg.environment, paths)
+    paths += [os.path.abspath(p) for p in cfg.fingerprint_paths()]
+    module = sys.modules.get(cfg.__class__.__module__)
+    helper_file = getattr(module, '__file__', None)
+    if helper_file:
+        if helper_file.endswith('.pyc') or helper_file.endswith('.pyo'):
+            helper_file = helper_file[:-1]
+        paths.append(os.path.abspath(helper_file))
+    files = dict()
+    for path in paths:
+        files[path] = __file_state__(path)
+    environment_store.set_fingerprint(short_name,
+                                      dict(version=version, strict=strict,
+                                           environment=cfg.environment,
+                                           files=files,
+                                           variables=variables,
+                                           environ=delta))
+
+
+def __reuse__(short_name, cfg, version, strict, dependencies, variables):
+    '''
+    If the prerequisite's fingerprint still holds (and so do those of
+    its dependencies), restore its configuration without detecting it,
+    including its changes to os.environ. The environment variables are
+    compared as they were before detection started.
+    '''
+    if cfg.force:
+        return False
+    for dep in dependencies:
+        if not dep in unchanged:
+            return False
+    fingerprint = environment_store.fingerprint(short_name)
+    if fingerprint is None or not 'environ' in fingerprint or \
+       fingerprint['version'] != version or \
+       fingerprint['strict'] != strict or \
+       fingerprint['variables'] != variables:
+        return False
+    for path, state in fingerprint['files'].items():
+        if __file_state__(path) != state:
+            return False
+    cfg.environment = dict(fingerprint['environment'])
+    cfg.found = True
+    __replay_environ__(fingerprint['environ'])
+    unchanged.append(short_name)
+    return True
+
+
+def __load_helper__(short_name, helper, version, strict,
+                    nodes, order, loading, err=sys.stderr):
+    '''
+    Instantiate a helper configuration, and recursively those of its
+    dependencies, as a node of the prerequisite graph.
+    '''
+    if short_name in nodes:
+        return short_name
+    try:
+        cfg = helper.configuration()
+    except Exception:
+        ver_info = ''
+        if version:
+            ver_info = ' v.' + str(version)
+        err.write('Error loading ' + short_name + ver_info +
+                  ' configuration.\n')
+        raise
+    register_checksums(cfg.checksums)
+    node = dict(short_name=short_name, cfg=cfg, version=version,
+                strict=strict, deps=[])
+    nodes[short_name] = node
+    loading.append(short_name)
+    for dep in cfg.dependencies:
+        dep_name = requirement_versioning(dep)[0]
+        if dep_name is None or dep_name in loading:
+            continue  ## circular reference
+        if not dep_name in nodes:
+            if dep_name in configured:
+                continue  ## configured by an earlier call
+            dep_name = find_package_config(dep, __load_helper__,
+                                           nodes, order, loading, err)
+        if dep_name is not None and not dep_name in node['deps']:
+            node['deps'].append(dep_name)
+    loading.remove(short_name)
+    order.append(short_name)  ## dependencies first
+    return short_name
+
+
+def __artifact_key__(node):
+    if not 'artifact' in node:
+        node['artifact'] = artifact_store.key(node['short_name'], node['cfg'],
+                                              node['version'])
+    return node['artifact']
+
+
+def __install__(node, environment, locally, cpus):
+    cfg = node['cfg']
+    version = node['version']
+    strict = node['strict']
+    key = None
+    if locally and artifact_store.enabled():
+        key = __artifact_key__(node)
+        if artifact_store.restore(key):
+            if opts.VERBOSE:
+                sys.stdout.write('PREREQUISITE ' + node['short_name'] +
+                                 ' restored\n')
+            if cfg.is_installed(environment, version, strict):
+                return True
+    token = None
+    if key is not None:
+        token = artifact_store.begin()
+    try:
+        cpus = cpu_budget.acquire(cpus)
+        try:
+            cfg.install(environment, version, strict, locally)
+        finally:
+            cpu_budget.release(cpus)
+        file_index.invalidate()
+        if token is not None:
+            artifact_store.capture(key, node['short_name'], version, token)
+    finally:
+        if token is not None:
+            artifact_store.end(token)
+    return True
+
+
+def __prefetch__(node, environment):
+    ## on a copy: download() may change its helper's state, and is
+    ##  called again while its archives are being collected
+    cfg = copy.copy(node['cfg'])
+    cfg.download(dict(environment), node['version'], node['strict'])
+    return cfg
+
+
+def __configure_graph__(prerequisite_list, environment, skip, install, quiet,
+                        out=sys.stdout, err=sys.stderr,
+                        locally=True, download=False, jobs=None):
+    '''
+    Detect the prerequisites (and their dependencies) concurrently,
+    each as soon as its dependencies are configured.
+    Missing prerequisites are installed concurrently as well, sharing
+    the CPU budget, unless their helper is exclusive_install (or the
+    install is global, through the system package manager): those
+    run alone. So are helpers that change os.environ (see
+    config.changes_environment), detections included, as the others
+    read it meanwhile.
+    When downloading, all archives are fetched concurrently beforehand;
+    only prerequisites whose download did not complete then download
+    (again) in turn.
+    '''
+    nodes = dict()
+    order = []
+    for help_name in prerequisite_list:
+        if len(help_name) > 0:
+            find_package_config(help_name, __load_helper__,
+                                nodes, order, [], err)
+    prefetched = []
+    if download:
+        downloads = []
+        for short_name in order:
+            node = nodes[short_name]
+            downloads.append(lambda n=node, e=environment: __prefetch__(n, e))
+        completed, failed = collect_downloads(downloads, jobs or 4, out=out)
+        for idx, cfg in completed.items():
+            ## downloaded once, as it would have been below
+            nodes[order[idx]]['cfg'] = cfg
+            prefetched.append(order[idx])
+        for idx in sorted(failed.keys()):
+            err.write('Downloading for ' + order[idx] + ' failed: ' +
+                      str(failed[idx]) + '\n')
+
+    if jobs:
+        cpu_budget.set_total(jobs)
+    variables = __fingerprint_variables__()  ## before detection changes them
+    started = dict()  ## (short_name, task): [os.environ before, alone]
+    deltas = dict()  ## short_name: os.environ changes by its detection
+    done = []
+    waiting = list(order)
+    detecting = []
+    to_install = []
+    installing = []
+    pool = WorkerPool(jobs)
+
+    def begin(key):
+        alone = not started
+        for other in started.values():
+            other[1] = False
+        started[key] = [dict(os.environ), alone]
+
+    def end(key):
+        before, alone = started.pop(key)
+        delta = __environ_delta__(before)
+        if delta and not alone:
+            return None  ## whose changes they are is unknown
+        return delta
+
+    def finish(short_name, cfg, environment, found=None, delta=None):
+        done.append(short_name)
+        if found is not None:
+            __record__(short_name, cfg, nodes[short_name]['version'],
+                       nodes[short_name]['strict'], found, variables, delta)
+        env = __merge_environment__(cfg, environment, short_name)
+        environment_store.replace(env)  ## written at the end
+        return env
+
+    def changes_environment(short_name):
+        return getattr(nodes[short_name]['cfg'], 'changes_environment', False)
+
+    def exclusive(short_name):
+        ## new artifacts are captured from installs that happen to run
+        ##  alone, rather than forcing them to
+        return not locally or \
+            getattr(nodes[short_name]['cfg'], 'exclusive_install', False) or \
+            changes_environment(short_name)
+
+    try:
+        while waiting or to_install or pool.pending():
+            blocked = [n for n in to_install + installing if exclusive(n)] + \
+                      [n for n in detecting if changes_environment(n)]
+            if not blocked:
+                for short_name in list(waiting):
+                    node = nodes[short_name]
+                    if [d for d in node['deps'] if not d in done]:
+                        continue
+                    if changes_environment(short_name):
+                        ## alone: the others read os.environ meanwhile
+                        if detecting or installing:
+                            continue
+                    waiting.remove(short_name)
+                    configured.append(short_name)
+                    cfg = node['cfg']
+                    if download and not short_name in prefetched:
+                        cfg.download(environment, node['version'],
+                                     node['strict'])
+                    before = dict(os.environ)
+                    if skip:
+                        cfg.null()
+                        environment = finish(short_name, cfg, environment)
+                    elif __reuse__(short_name, cfg, node['version'],
+                                   node['strict'], node['deps'], variables):
+                        if dict(os.environ) != before:
+                            for other in started.values():
+                                other[1] = False  ## replayed meanwhile
+                        if not quiet:
+                            out.write(__checking_message__(short_name,
+                                                           node['version'],
+                                                           node['strict']) +
+                                      'found.\n')
+                        environment = finish(short_name, cfg, environment)
+                    else:
+                        detecting.append(short_name)
+                        begin((short_name, 'detect'))
+                        pool.submit((short_name, 'detect'), cfg.is_installed,
+                                    dict(environment),
+                                    node['version'], node['strict'])
+                        if changes_environment(short_name):
+                            break
+
+            for short_name in list(to_install):
+                if [n for n in installing if exclusive(n)] or \
+                   [n for n in detecting if changes_environment(n)] or \
+                   (exclusive(short_name) and pool.pending()):
+                    break  ## exclusive installs run alone
+                to_install.remove(short_name)
+                installing.append(short_name)
+                node = nodes[short_name]
+                ## an even share of the CPUs among the installs expected,
+                ##  counting running detections as possible installs
+                expected = len(installing) + len(to_install) + len(detecting)
+                cpus = max(1, cpu_budget.total() //
+                           max(1, min(pool.jobs, expected)))
+                begin((short_name, 'install'))
+                pool.submit((short_name, 'install'), __install__,
+                            node, dict(environment), locally, cpus)
+
+            if pool.pending():
+                (short_name, task), found, exc_info = pool.next_result()
+                if exc_info is not None:
+                    reraise(exc_info)
+                node = nodes[short_name]
+                cfg = node['cfg']
+                delta = end((short_name, task))
+                if task == 'install':
+                    installing.remove(short_name)
+                    delta = __merge_deltas__(deltas.pop(short_name, dict()),
+                                             delta)
+                    environment = finish(short_name, cfg, environment, True,
+                                         delta)
+                    continue
+                detecting.remove(short_name)
+                if not quiet:
+                    out.write(__checking_message__(short_name,
+                                                   node['version'],
+                                                   node['strict']))
+                if install and (not found or cfg.force):
+                    deltas[short_name] = delta
+                    to_install.append(short_name)
+                    if not quiet:
+                        if found:
+                            out.write('Forcing install...\n')
+                        else:
+                            out.write('Installing...\n')
+                    continue
+                if not quiet:
+                    if found:
+                        out.write('found.\n')
+                    else:
+                        out.write('not found.\n')
+                    out.flush()
+                environment = finish(short_name, cfg, environment, found,
+                                     delta)
+
+            elif waiting and not to_install:
+                raise Exception('Unresolvable prerequisites: ' +
+                                ', '.join(waiting))
+    finally:
+        pool.shutdown()
+    return environment
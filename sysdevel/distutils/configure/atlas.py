@@ -13,6 +13,8 @@ class configuration(lib_config):
     """
     Find/install ATLAS library (includes libblas)
     """
+    exclusive_install = True  ## install() changes directory
+
     def __init__(self):
         lib_config.__init__(self, "atlas", "atlas_type.h", debug=False)
 
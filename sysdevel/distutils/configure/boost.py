@@ -14,6 +14,8 @@ class configuration(lib_config):
     """
     Find/install Boost
     """
+    exclusive_install = True  ## install() changes directory
+
     def __init__(self):
         lib_config.__init__(self, "boost", "", debug=False)
         if 'windows' in platform.system().lower():
@@ -13,6 +13,9 @@ class configuration(lib_config):
     """
     Find/install NASA Common Data Format library
     """
+    exclusive_install = True  ## install() changes directory
+    changes_environment = True  ## sets CDF_LIB, CDF_INC and CDF_BIN
+
     def __init__(self):
         lib_config.__init__(self, "cdf", "cdf.h", debug=False)
         if 'windows' in platform.system().lower():
@@ -13,6 +13,8 @@ class configuration(lib_config):
     """
     Find/install libdl
     """
+    exclusive_install = True  ## install() changes directory
+
     def __init__(self):
         lib_config.__init__(self, "dl", "dlfcn.h", debug=False)
         if 'windows' in platform.system().lower():
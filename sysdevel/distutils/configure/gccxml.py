@@ -12,6 +12,8 @@ class configuration(prog_config):
     """
     Find/install GCC-XML
     """
+    exclusive_install = True  ## install() changes directory
+
     def __init__(self):
         prog_config.__init__(self, 'gccxml',
                              dependencies=['git', 'cmake'], debug=False)
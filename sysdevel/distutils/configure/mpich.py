@@ -14,6 +14,8 @@ class configuration(lib_config):
     """
     Find/install MPICH library
     """
+    changes_environment = True  ## extends PATH
+
     def __init__(self):
         lib_config.__init__(self, "mpich2", "mpi.h", debug=False)
 
@@ -13,6 +13,8 @@ class configuration(lib_config):
     """
     Find/install OpenMPI library
     """
+    changes_environment = True  ## extends PATH
+
     def __init__(self):
         lib_config.__init__(self, "openmpi", "mpi.h", debug=False)
 
@@ -12,6 +12,8 @@ class configuration(lib_config):
     """
     Find/install Perl interpreter, headers and library
     """
+    exclusive_install = True  ## install() changes directory
+
     def __init__(self):
         lib_config.__init__(self, "perl", "perl.h", debug=False)
 
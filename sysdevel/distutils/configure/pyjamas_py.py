@@ -2,10 +2,9 @@
 import os
 import glob
 import sys
-import subprocess
 
 from sysdevel.distutils.prerequisites import find_program, as_admin, ConfigError
-from sysdevel.distutils.building import process_progress
+from sysdevel.distutils.supervisor import run_process
 from sysdevel.distutils.configuration import py_config
 from sysdevel.distutils.fetching import fetch, unarchive
 from sysdevel.distutils import options
@@ -14,6 +13,8 @@ class configuration(py_config):
     """
     Find/install Pyjamas
     """
+    exclusive_install = True  ## install() changes directory
+
     ##TODO should be PyPI, but ugly due to fork
     def __init__(self):
         py_config.__init__(self, 'pyjs', '0.8.1a', debug=False)
@@ -82,10 +83,8 @@ class configuration(py_config):
 
             cmd_line = [sys.executable, 'bootstrap.py',]
             try:
-                p = subprocess.Popen(cmd_line, stdout=log, stderr=log)
-                status = process_progress(p)
+                status = run_process(cmd_line, log)
             except KeyboardInterrupt:
-                p.terminate()
                 log.close()
                 raise
             self.check_install(status, log, log_file)
@@ -98,11 +97,9 @@ class configuration(py_config):
                     sudo_prefix = ['sudo']
                 cmd_line = sudo_prefix + cmd_line + ['install']
             try:
-                p = subprocess.Popen(cmd_line, stdout=log, stderr=log)
-                status = process_progress(p)
+                status = run_process(cmd_line, log)
                 log.close()
             except KeyboardInterrupt:
-                p.terminate()
                 log.close()
                 raise
             self.check_install(status, log, log_file)
@@ -0,0 +1,224 @@
+"""
+Copyright 2013.  Los Alamos National Security, LLC.
+This material was produced under U.S. Government contract
+DE-AC52-06NA25396 for Los Alamos National Laboratory (LANL), which is
+operated by Los Alamos National Security, LLC for the U.S. Department
+of Energy. The U.S. Government has rights to use, reproduce, and
+distribute this software.  NEITHER THE GOVERNMENT NOR LOS ALAMOS
+NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+modified to produce derivative works, such modified software should be
+clearly marked, so as not to confuse it with the version available
+from LANL.
+
+Licensed under the Mozilla Public License, Version 2.0 (the
+"License"); you may not use this file except in compliance with the
+License. You may obtain a copy of the License at
+http://www.mozilla.org/MPL/2.0/
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+# pylint: disable=W0105
+"""
+Record of the files generated from templates by configure_file
+"""
+
+import os
+import sys
+import atexit
+import threading
+import hashlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from sysdevel.distutils.filesystem import mkdir
+from sysdevel.distutils import options
+
+
+STAMP_DIRECTORY = '.configured_files'
+STAMP_VERSION = 2
+
+## the directory of the running setup.py, which owns what it generates
+SETUP_DIRECTORY = os.path.dirname(os.path.abspath(sys.argv[0]))
+
+
+def values_digest(names, values):
+    '''
+    Digest of the (string) values of the named variables.
+    Raises KeyError if one is undefined.
+    '''
+    h = hashlib.sha1()
+    for name in sorted(names):
+        h.update(repr((name, str(values[name]))).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _load_stamps(stamp_file):
+    if os.path.exists(stamp_file):
+        try:
+            f = open(stamp_file, 'rb')
+            try:
+                cached = pickle.load(f)
+            finally:
+                f.close()
+            if cached['version'] == STAMP_VERSION:
+                return cached['stamps']
+        except Exception:  # pylint: disable=W0703
+            pass
+    return dict()
+
+
+class _ConfiguredFiles(object):
+    '''
+    For each generated file, the digest of its template and of the
+    values of the variables it referenced. A file is only regenerated
+    when that stamp changes (or the file is missing), however old it is.
+    Together with the declared generated_files, this is the manifest of
+    generated files for clean.
+    Subpackages share target_build_dir and may build concurrently, so
+    each setup.py directory has its own file in STAMP_DIRECTORY.
+    '''
+    def __init__(self):
+        self._lock = threading.RLock()  ## shared by rendering threads
+        self._stamps = None  ## output -> (template digest, style, names, values digest)
+        self._stamp_path = None
+        self._dirty = False
+
+    def stamp_file(self, directory=None):
+        '''
+        The manifest of the setup.py in directory (default: the running one).
+        '''
+        if directory is None:
+            directory = SETUP_DIRECTORY
+        name = hashlib.sha1(os.path.normcase(os.path.abspath(directory)
+                                             ).encode('utf-8')).hexdigest()
+        return os.path.join(options.target_build_dir, STAMP_DIRECTORY, name)
+
+    def _ensure(self):
+        stamp_file = self.stamp_file()
+        if self._stamps is not None and self._stamp_path == stamp_file:
+            return
+        if self._stamps is not None:
+            self.save()  ## target_build_dir moved; keep what was recorded
+        self._stamps = _load_stamps(stamp_file)
+        self._stamp_path = stamp_file
+        self._dirty = False
+
+    def save(self):
+        '''
+        Write the stamps under target_build_dir, if they changed.
+        '''
+        self._lock.acquire()
+        try:
+            if not self._dirty:
+                return
+            stamp_file = self._stamp_path
+            mkdir(os.path.dirname(stamp_file))
+            tmp_file = stamp_file + '.tmp'
+            f = open(tmp_file, 'wb')
+            try:
+                pickle.dump(dict(version=STAMP_VERSION, stamps=self._stamps),
+                            f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            if os.name == 'nt' and os.path.exists(stamp_file):
+                os.remove(stamp_file)  ## rename does not overwrite on Windows
+            os.rename(tmp_file, stamp_file)
+            self._dirty = False
+        finally:
+            self._lock.release()
+
+    def current(self, output, template, values):
+        '''
+        Whether output exists and was generated from this template
+        with the same values of the variables it uses.
+        '''
+        output = os.path.abspath(output)
+        self._lock.acquire()
+        try:
+            self._ensure()
+            stamp = self._stamps.get(output)
+        finally:
+            self._lock.release()
+        if not stamp or stamp[:2] != (template.digest, template.style):
+            return False
+        try:
+            if values_digest(stamp[2], values) != stamp[3]:
+                return False
+        except KeyError:
+            return False
+        return os.path.exists(output)
+
+    def record(self, output, template, used):
+        '''
+        Stamp output as generated from template with the used values.
+        '''
+        names = list(used.keys())
+        stamp = (template.digest, template.style, names,
+                 values_digest(names, used))
+        self._lock.acquire()
+        try:
+            self._ensure()
+            self._stamps[os.path.abspath(output)] = stamp
+            self._dirty = True
+        finally:
+            self._lock.release()
+
+    def declare(self, paths):
+        '''
+        Add generated files (or directories) that are not configured
+        from a template to the manifest. Saving afterwards creates the
+        manifest even if paths is empty.
+        '''
+        self._lock.acquire()
+        try:
+            self._ensure()
+            for path in paths:
+                path = os.path.abspath(path)
+                if not path in self._stamps:
+                    self._stamps[path] = ()
+            self._dirty = True
+        finally:
+            self._lock.release()
+
+    def recorded(self, directory=None):
+        '''
+        Whether the setup.py in directory has saved a manifest.
+        '''
+        return os.path.exists(self.stamp_file(directory))
+
+    def outputs(self, directory=None):
+        '''
+        All generated files recorded by the setup.py in directory.
+        '''
+        stamp_file = self.stamp_file(directory)
+        self._lock.acquire()
+        try:
+            self._ensure()
+            if stamp_file == self._stamp_path:
+                return list(self._stamps.keys())
+        finally:
+            self._lock.release()
+        return list(_load_stamps(stamp_file).keys())
+
+    def forget(self, output):
+        self._lock.acquire()
+        try:
+            self._ensure()
+            output = os.path.abspath(output)
+            if output in self._stamps:
+                del self._stamps[output]
+                self._dirty = True
+        finally:
+            self._lock.release()
+
+
+configured_files = _ConfiguredFiles()
+atexit.register(configured_files.save)
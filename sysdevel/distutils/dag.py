@@ -29,53 +29,81 @@ class dag(object):
     Directed acyclic graph.
     """
     def __init__(self, arg):
-        if isinstance(arg, dag):
+        self._graph = dict()    ## node: [children], in insertion order
+        self._edges = dict()    ## node: set(children)
+        self._parents = dict()  ## reverse edges, node: [parents]
+        self._order = []        ## nodes, in insertion order
+        self._head = None
+        if isinstance(arg, (dict, list)) and len(arg) < 1:
+            pass  ## empty graph
+        elif isinstance(arg, dag):
             ## pre-screened for cycles
-            self._graph = arg._deepcopy()  # pylint: disable=W0212
+            for node in arg._order:  # pylint: disable=W0212
+                self._add(node, arg._graph[node])  # pylint: disable=W0212
             self._head = arg._head  # pylint: disable=W0212
         elif isinstance(arg, dict):
-            ## no cycles possible (would be duplicate keys)
-            self._graph = arg
-            self._head = self.topological_sort[-1]
+            for node, children in arg.items():
+                self._add(node, children)
+            self._check()
+            self._head = self.topological_sort()[-1]
         elif isinstance(arg, list):
-            adj = self._adj_lst(arg)  # pylint: disable=W0212
-            cycles = self._detect_cycles(adj)  # pylint: disable=W0212
-            if cycles:
-                raise TypeError("Initializing an acyclic graph with cycle(s) " +
-                                "found due to node(s): " + str(cycles) + ".")
-            self._graph = dict(adj)
+            for node, children in self._adj_lst(arg):
+                self._add(node, children)
+            self._check()
             self._head = arg[0]
         else:
             raise TypeError("Initializing a dag requires either an adjacency " +
                             "dictionary, a list of lists or another dag.")
 
-    def _detect_cycles(self, lstlst):
-        nodes = [l[0] for l in lstlst]
-        dupl = set([x for x in nodes if nodes.count(x) > 1])
-        if len(dupl) < 1:
-            return []
-        def entuple(lst):
-            if isinstance(lst, list):
-                return tuple(entuple(x) for x in lst)
-            return lst
-        tpltpl = entuple(lstlst)
+    def _node(self, node):
+        if not node in self._graph:
+            self._graph[node] = []
+            self._edges[node] = set()
+            self._parents[node] = []
+            self._order.append(node)
+
+    def _add(self, node, children):
+        ## repeated nodes merge their children
+        self._node(node)
+        for child in children:
+            if not child in self._edges[node]:
+                self._node(child)
+                self._graph[node].append(child)
+                self._edges[node].add(child)
+                self._parents[child].append(node)
+
+    def _check(self):
+        cycles = self._detect_cycles()
+        if cycles:
+            raise TypeError("Initializing an acyclic graph with cycle(s) " +
+                            "found due to node(s): " + str(cycles) + ".")
+
+    def _detect_cycles(self):
+        ## iterative depth-first search; a back edge closes a cycle
+        white, grey, black = 0, 1, 2
+        color = dict([(node, white) for node in self._order])
         cycles = []
-        for n in dupl:
-            s = set()
-            for t in tpltpl:
-                if t[0] == n:
-                    s.add(tuple(t))
-            if len(s) > 1:
-                cycles.append(n)
+        for root in self._order:
+            if color[root] != white:
+                continue
+            color[root] = grey
+            stack = [(root, iter(self._graph[root]))]
+            while stack:
+                node, children = stack[-1]
+                advanced = False
+                for child in children:
+                    if color[child] == white:
+                        color[child] = grey
+                        stack.append((child, iter(self._graph[child])))
+                        advanced = True
+                        break
+                    elif color[child] == grey and not child in cycles:
+                        cycles.append(child)
+                if not advanced:
+                    color[node] = black
+                    stack.pop()
         return cycles
 
-    def _deepcopy(self, arg=None):
-        if arg is None:
-            arg = self._graph
-        if isinstance(arg, list):
-            return [self._deepcopy(x) for x in arg]  # pylint: disable=W0212
-        return dict(arg.items())
-
     def _adj_lst(self, arg):
         if len(arg) == 1:
             return [[arg[0], []]]
@@ -90,11 +118,51 @@ class dag(object):
         """
         return self._graph
 
+    def children(self, key):
+        """
+        Nodes that key depends on
+        """
+        return list(self._graph[key])
+
+    def parents(self, key):
+        """
+        Nodes that depend on key (reverse edges)
+        """
+        return list(self._parents[key])
+
+    def rename(self, old, new):
+        """
+        Replace a node (merging it into new, if that exists already)
+        """
+        if old == new:
+            return
+        self._node(new)
+        self._add(new, self._graph[old])
+        for parent in self._parents[old]:
+            idx = self._graph[parent].index(old)
+            self._edges[parent].discard(old)
+            if new in self._edges[parent]:
+                del self._graph[parent][idx]
+            else:
+                self._graph[parent][idx] = new
+                self._edges[parent].add(new)
+                self._parents[new].append(parent)
+        for child in self._graph[old]:
+            self._parents[child].remove(old)
+        del self._graph[old]
+        del self._edges[old]
+        del self._parents[old]
+        self._order.remove(old)
+        if self._head == old:
+            self._head = new
+
     def list(self):
         """
         Return hierarchical list of lists representation
         """
         ## this reverses what _adj_lst() does
+        if self._head is None:
+            return []
         def nest(key, adj):
             lsts = [key]
             if len(adj[key]) < 1:
@@ -108,7 +176,7 @@ class dag(object):
         """
         'len' operator: Return number of nodes
         """
-        return len(set(self._graph.keys()))
+        return len(self._graph)
 
     def __str__(self):
         """
@@ -124,26 +192,28 @@ class dag(object):
             for l in lst[1:]:
                 ret_val += ascii_art(l, idx+1)
             return ret_val
+        if self._head is None:
+            return ''
         return ascii_art(self.list())
 
     def __contains__(self, key):
         """
         'in' operator: Is key a node or leaf?
         """
-        return key in self._graph.keys()
+        return key in self._graph
 
     def __iter__(self):
         """
         Forward iterator
         """
-        for key in self._graph.keys():
+        for key in list(self._order):
             yield key
 
     def __reversed__(self):
         """
         'reversed' operator: Reverse iterator
         """
-        for key in self._graph.keys().reverse():
+        for key in reversed(self._order):
             yield key
 
     def __getitem__(self, key):
@@ -169,28 +239,80 @@ class dag(object):
         parent[parent.index(root)] = [root[0]] + value
     '''
 
+    def _kahn(self):
+        ## leaves first; each round holds the nodes whose children
+        ##  are all in earlier rounds
+        remaining = dict([(node, len(self._graph[node]))
+                          for node in self._order])
+        rounds = []
+        ready = [node for node in self._order if remaining[node] == 0]
+        while ready:
+            rounds.append(ready)
+            unblocked = []
+            for node in ready:
+                for parent in self._parents[node]:
+                    remaining[parent] -= 1
+                    if remaining[parent] == 0:
+                        unblocked.append(parent)
+            ready = unblocked
+        return rounds
+
     def topological_sort(self):
         """
         Single list in order from leaves to root(s)
         """
         ## DAG is guaranteed to be acyclic from constructor
-        unsorted_g = dict(self._graph)  ## copy
-        sorted_g = []
-        while unsorted_g:
-            for node, edges in unsorted_g.items():
-                ## enforce depth-first traversal
-                if  next((False for edge in edges
-                          if edge in unsorted_g.keys()), True):
-                    del unsorted_g[node]
-                    sorted_g.append(node)
+        remaining = dict([(node, len(self._graph[node]))
+                          for node in self._order])
+        sorted_g = [node for node in self._order if remaining[node] == 0]
+        idx = 0
+        while idx < len(sorted_g):
+            for parent in self._parents[sorted_g[idx]]:
+                remaining[parent] -= 1
+                if remaining[parent] == 0:
+                    sorted_g.append(parent)
+            idx += 1
         return sorted_g
 
+    def levels(self):
+        """
+        Nodes grouped by depth from the leaves; those within a level
+        are independent of each other (e.g. can be built in parallel)
+        """
+        return self._kahn()
+
+
+
+def _is_sorted(g, order):
+    ## every node once, after all of its children
+    if len(order) != len(g) or len(set(order)) != len(g):
+        return False
+    position = dict([(order[idx], idx) for idx in range(len(order))])
+    for node in order:
+        for child in g.children(node):
+            if position[child] >= position[node]:
+                return False
+    return True
+
+
+def _is_leveled(g, levels):
+    ## every node once, one level above its highest child
+    level = dict()
+    for idx in range(len(levels)):
+        for node in levels[idx]:
+            level[node] = idx
+    if len(level) != len(g) or sum([len(l) for l in levels]) != len(g):
+        return False
+    for node in level:
+        below = [level[child] for child in g.children(node)]
+        if level[node] != max([-1] + below) + 1:
+            return False
+    return True
 
 
 def test():
     sample1 = ['a', ['b', ['c', ['d'], ['e']], ['f']], ['g', ['h']], ['i']]
-    if dag(sample1).topological_sort() != \
-       ['e', 'd', 'f', 'i', 'h', 'c', 'b', 'g', 'a']:
+    if not _is_sorted(dag(sample1), dag(sample1).topological_sort()):
         raise RuntimeError('Failed test 1')
     if dag(sample1).list() != sample1:
         raise RuntimeError('Failed test 2')
@@ -203,8 +325,24 @@ def test():
         pass
 
     sample3 = ['a', ['b', ['c', ['i'], ['e']], ['f']], ['g', ['h']], ['i']]
-    if dag(sample3).topological_sort() != \
-       ['e', 'f', 'i', 'h', 'c', 'b', 'g', 'a']:
+    if not _is_sorted(dag(sample3), dag(sample3).topological_sort()):
         raise RuntimeError('Failed test 4')
 
+    if not _is_leveled(dag(sample1), dag(sample1).levels()):
+        raise RuntimeError('Failed test 5')
+
+    try:
+        dag({'a': ['b'], 'b': ['c'], 'c': ['a']})
+        raise RuntimeError('Failed test 6')
+    except TypeError:
+        pass
+
+    if str(dag(dict(a=['b', 'c'], b=['c']))) != 'a\n+--b\n|  +--c\n+--c':
+        raise RuntimeError('Failed test 7')
+
+    for empty in [dict(), list()]:
+        if len(dag(empty)) != 0 or dag(empty).topological_sort() != [] or \
+                dag(empty).levels() != [] or dag(empty).list() != []:
+            raise RuntimeError('Failed test 8')
+
     print 'Success'
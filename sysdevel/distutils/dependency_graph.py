@@ -23,14 +23,135 @@ implied. See the License for the specific language governing
 permissions and limitations under the License.
 """
 import os
+import time
+import hashlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 from sysdevel.distutils.dag import dag
-from sysdevel.distutils.configuration import find_package_config
-from sysdevel.distutils.prerequisites import RequirementsFinder
+from sysdevel.distutils.configuration import find_package_config, INDEX_TTL
+from sysdevel.distutils.prerequisites import find_requirements
+from sysdevel.distutils.filesystem import mkdir
+from sysdevel.distutils import options
+
+
+GRAPH_CACHE_FILE = '.dependency_graph'
+GRAPH_CACHE_VERSION = 1
+
+
+class _Subpackage(object):
+    ## reference to the graph of a subpackage, by its directory
+    def __init__(self, path):
+        self.path = path
+
+
+def _digest(path):
+    f = open(path, 'rb')
+    try:
+        return hashlib.sha256(f.read()).hexdigest()
+    finally:
+        f.close()
+
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime, st.st_size)
+    except OSError:
+        return None
+
+
+def _helper_file(helper):
+    ## None for helpers made up from PyPI
+    filename = getattr(helper, '__file__', None)
+    if filename and filename[-4:] in ['.pyc', '.pyo'] and \
+       os.path.exists(filename[:-1]):
+        filename = filename[:-1]
+    return filename
+
+
+class _GraphCache(object):
+    '''
+    The part of the dependency graph from each setup.py (its package,
+    prerequisites and requirements, with subpackages by reference),
+    kept with the digest of that setup.py and the state of the helper
+    modules it was resolved with. Parts that depend on PyPI expire
+    after INDEX_TTL.
+    '''
+    def __init__(self):
+        self._entries = None
+        self._dirty = False
+
+    def _cache_file(self):
+        return os.path.join(options.target_build_dir, GRAPH_CACHE_FILE)
+
+    def _load(self):
+        self._entries = dict()
+        cache_file = self._cache_file()
+        if os.path.exists(cache_file):
+            try:
+                f = open(cache_file, 'rb')
+                try:
+                    cached = pickle.load(f)
+                finally:
+                    f.close()
+                if cached['version'] == GRAPH_CACHE_VERSION:
+                    self._entries = cached['entries']
+            except Exception:  # pylint: disable=W0703
+                pass
+
+    def get(self, setup_py, req_only, digest):
+        if self._entries is None:
+            self._load()
+        entry = self._entries.get((setup_py, req_only))
+        if entry is None or entry['digest'] != digest:
+            return None
+        if entry['dynamic'] and time.time() - entry['time'] > INDEX_TTL:
+            return None
+        for path, state in entry['helpers'].items():
+            if _file_state(path) != state:
+                return None
+        return entry['graph']
+
+    def set(self, setup_py, req_only, digest, graph, helpers):
+        if self._entries is None:
+            self._load()
+        self._entries[(setup_py, req_only)] = dict(
+            digest=digest, graph=graph, time=time.time(),
+            dynamic=None in helpers,
+            helpers=dict([(h, _file_state(h)) for h in helpers if h]))
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        mkdir(options.target_build_dir)
+        cache_file = self._cache_file()
+        tmp_file = cache_file + '.tmp'
+        f = open(tmp_file, 'wb')
+        try:
+            pickle.dump(dict(version=GRAPH_CACHE_VERSION,
+                             entries=self._entries),
+                        f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        if os.path.exists(cache_file):
+            os.remove(cache_file)  ## rename does not overwrite on Windows
+        os.rename(tmp_file, cache_file)
+        self._dirty = False
+
+
+graph_cache = _GraphCache()
 
 
 # pylint: disable=W0613
-def _fetch_deps(short_name, helper, version, strict, setup_dir=None):
+def _fetch_deps(short_name, helper, version, strict, setup_dir=None,
+                helpers=None):
+    if helpers is not None:
+        helpers.append(_helper_file(helper))
     try:
         cfg = helper.configuration()
     except Exception:
@@ -44,22 +165,43 @@ def _fetch_deps(short_name, helper, version, strict, setup_dir=None):
     else:
         results = [short_name]
     for dep in cfg.dependencies:
-        results.append(find_package_config(dep, _fetch_deps))
+        results.append(find_package_config(dep, _fetch_deps, helpers=helpers))
     return results
 
 
-def _recurse_prereqs(path, req_only=False):
-    rf = RequirementsFinder(os.path.join(path, 'setup.py'))
+def _own_prereqs(path, req_only):
+    ## this setup.py's part of the graph, re-parsed only when changed
+    setup_py = os.path.abspath(os.path.join(path, 'setup.py'))
+    digest = _digest(setup_py)
+    required = graph_cache.get(setup_py, req_only, digest)
+    if required is not None:
+        return required
+    helpers = []
+    rf = find_requirements(setup_py)
+    helpers.extend(rf.local_modules)  ## imported by setup.py
     required = [rf.package]  ## must be first
     for _, pkg_dir in rf.subpackages_list:
-        required.append(_recurse_prereqs(os.path.join(path, pkg_dir),
-                                         req_only))
+        required.append(_Subpackage(pkg_dir))
     if not req_only:
         for pkg in rf.prerequisite_list:
             required.append(find_package_config(pkg, _fetch_deps,
-                                                setup_dir=path))
+                                                setup_dir=path,
+                                                helpers=helpers))
     for pkg in rf.requires_list:
-        required.append(find_package_config(pkg, _fetch_deps, setup_dir=path))
+        required.append(find_package_config(pkg, _fetch_deps, setup_dir=path,
+                                            helpers=helpers))
+    graph_cache.set(setup_py, req_only, digest, required, helpers)
+    return required
+
+
+def _recurse_prereqs(path, req_only=False):
+    required = []
+    for item in _own_prereqs(path, req_only):
+        if isinstance(item, _Subpackage):
+            required.append(_recurse_prereqs(os.path.join(path, item.path),
+                                             req_only))
+        else:
+            required.append(item)
     return required
 
 
@@ -69,25 +211,12 @@ def get_dep_dag(pkg_path, req_only=False):
     Construct a directed acyclic graph of dependencies.
     Takes the path of the root package.
     '''
-    # pylint: disable=W0212
     graph = dag(_recurse_prereqs(pkg_path, req_only))
+    graph_cache.save()
 
     ## remove duplicates where name,version,strict tuple equals name string
-    adjacency_list = dict(graph.adjacency_list())
-    changed = []
-    for dep in adjacency_list.keys():
-        if isinstance(dep, tuple):
-            if dep[0] in adjacency_list.keys():
-                changed.append(dep)
-                graph._graph[dep] = graph._graph.pop(dep[0])
-    adjacency_list = dict(graph.adjacency_list())
-    def _dep_test(x, dep_tpl):
-        if x != dep[0]:
-            return x
-        return dep
-    for dep in changed:
-        for k,v in adjacency_list.items():
-            if dep[0] in v:
-                graph._graph[k] = [_dep_test(x, dep) for x in v]
+    for dep in list(graph):
+        if isinstance(dep, tuple) and dep[0] in graph:
+            graph.rename(dep[0], dep)
 
     return graph
@@ -33,6 +33,14 @@ import tarfile
 import zipfile
 import tempfile
 import shutil
+import time
+import hashlib
+import threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 try:
     # pylint: disable=F0401,E0611
@@ -50,10 +58,13 @@ from sysdevel.distutils.filesystem import mkdir
 from sysdevel.distutils import options
 
 
+BLOCK_SIZE = 64 * 1024
+
 class DownloadError(Exception):
     def __init__(self, which, url=None, code=None):
         # pylint: disable=W0231
         self.header = 'DownloadError -- '
+        self.code = code
         self.explanation = ''
         if not url is None:
             self.explanation += str(url) + ' : '
@@ -88,34 +99,357 @@ def download_progress(count, block_size, total_size):
         sys.stdout.flush()
 
 
-def fetch(website, remote, local, dwnld_dir=options.download_dir, force=False):
+## Checksums ################
+
+__CHECKSUMS = dict()
+
+def register_checksums(checksums):
+    '''
+    Declare the expected checksums of downloadable files, as a dictionary
+    of filename: 'sha256:<hexdigest>' (or 'md5:', 'sha1:', etc.;
+    a bare hexdigest is taken as sha256). Used by fetch().
+    '''
+    __CHECKSUMS.update(checksums)
+
+
+def _split_checksum(checksum):
+    if ':' in checksum:
+        algorithm, digest = checksum.split(':', 1)
+        return algorithm.lower(), digest.lower()
+    return 'sha256', checksum.lower()
+
+
+def file_digest(path, algorithm='sha256'):
+    h = hashlib.new(algorithm)
+    f = open(path, 'rb')
+    try:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def verify_checksum(path, checksum):
+    algorithm, digest = _split_checksum(checksum)
+    return file_digest(path, algorithm) == digest
+
+
+## Download store #############
+
+class _ArchiveStore(object):
+    '''
+    Content-addressed download cache shared by all projects
+    (user_cache_dir/archives/<sha256>), with an index from URL to digest.
+    Incomplete downloads are kept in 'partial' and resumed.
+    '''
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._index = None
+        self._index_path = None
+
+    def directory(self):
+        return os.path.join(options.user_cache_dir, 'archives')
+
+    def _load_index(self):
+        path = os.path.join(self.directory(), 'index.json')
+        if path != self._index_path:
+            self._index_path = path
+            self._index = dict()
+            if os.path.exists(path):
+                try:
+                    f = open(path, 'r')
+                    try:
+                        self._index = json.load(f)
+                    finally:
+                        f.close()
+                except (IOError, ValueError):
+                    sys.stderr.write('WARNING: unreadable archive index ' +
+                                     path + ', starting a new one.\n')
+        return self._index
+
+    def _save_index(self):
+        mkdir(self.directory())
+        fd, tmp_path = tempfile.mkstemp(prefix='index', dir=self.directory())
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(self._index, f)
+        finally:
+            f.close()
+        if os.path.exists(self._index_path):
+            os.remove(self._index_path)  ## rename does not overwrite on Windows
+        os.rename(tmp_path, self._index_path)
+
+    def lookup(self, url, checksum=None):
+        '''
+        Path of the stored copy of the given url (or checksum), if any.
+        '''
+        self._lock.acquire()
+        try:
+            if checksum is not None:
+                algorithm, digest = _split_checksum(checksum)
+                if algorithm == 'sha256':
+                    path = os.path.join(self.directory(), digest)
+                    if os.path.exists(path):
+                        return path
+            digest = self._load_index().get(url)
+            if digest is None:
+                return None
+            path = os.path.join(self.directory(), digest)
+            if not os.path.exists(path):
+                return None
+            if checksum is not None and not verify_checksum(path, checksum):
+                return None
+            return path
+        finally:
+            self._lock.release()
+
+    def retrieve(self, url, checksum=None, progress=None):
+        '''
+        Download url into the store (resuming a partial download),
+        verify it, and return the stored path.
+        '''
+        partial_dir = os.path.join(self.directory(), 'partial')
+        mkdir(partial_dir)
+        partial = os.path.join(partial_dir,
+                               hashlib.sha1(url.encode('utf-8')).hexdigest())
+        resume_urlretrieve(url, partial, progress)
+        digest = file_digest(partial)
+        if checksum is not None and not verify_checksum(partial, checksum):
+            os.remove(partial)
+            raise DownloadError('Checksum mismatch (expected ' + checksum +
+                                ')', url)
+        path = os.path.join(self.directory(), digest)
+        self._lock.acquire()
+        try:
+            if os.path.exists(path):
+                os.remove(partial)
+            else:
+                os.rename(partial, path)
+            self._load_index()[url] = digest
+            self._save_index()
+        finally:
+            self._lock.release()
+        return path
+
+
+archive_store = _ArchiveStore()
+
+
+def _link_or_copy(src, dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):  ## cross-device, or Windows
+        shutil.copy2(src, dst)
+
+
+## Concurrent downloads ######
+
+class DeferredDownload(Exception):
+    '''
+    Raised by fetch() for a missing archive while downloads are being
+    collected (see collect_downloads).
+    '''
+    def __init__(self, url, checksum=None):
+        Exception.__init__(self, url)
+        self.url = url
+        self.checksum = checksum
+
+
+__COLLECTING = None  ## url: failure, while collecting
+
+def _set_collecting(failures):
+    global __COLLECTING  # pylint: disable=W0603
+    __COLLECTING = failures
+
+
+class DownloadScheduler(object):
+    '''
+    Fetches a set of URLs into the archive store concurrently, with at
+    most 'jobs' transfers in flight and 'per_host' per server, and
+    reports aggregate progress on a single line.
+    '''
+    def __init__(self, jobs=4, per_host=2, out=sys.stdout):
+        self.jobs = max(1, jobs)
+        self.per_host = max(1, per_host)
+        self.out = out
+        self._requests = []
+        self._lock = threading.Lock()
+        self._progress = dict()
+
+    def add(self, url, checksum=None):
+        if not url in [r[0] for r in self._requests]:
+            self._requests.append((url, checksum))
+
+    def _report(self, finished):
+        if not options.VERBOSE:
+            return
+        self._lock.acquire()
+        try:
+            done = total = 0
+            for read, size in self._progress.values():
+                done += read
+                total += max(size, read, 0)
+            percent = 0
+            if total > 0:
+                percent = int(done * 100 / total)
+            self.out.write('\rFETCHING %d/%d archives  %2d%%' %
+                           (finished, len(self._requests), percent))
+            self.out.flush()
+        finally:
+            self._lock.release()
+
+    def _fetch(self, url, checksum, finished):
+        def progress(count, block_size, total_size):
+            self._progress[url] = (min(count * block_size,
+                                       max(total_size, 0) or count * block_size),
+                                   total_size)
+            self._report(finished[0])
+        return archive_store.retrieve(url, checksum, progress)
+
+    def run(self):
+        '''
+        Perform the downloads. Returns a dictionary of url: stored path,
+        and one of url: exception for the failures.
+        '''
+        from sysdevel.distutils.parallel import WorkerPool
+        try:
+            from urlparse import urlparse  # pylint: disable=F0401
+        except ImportError:
+            from urllib.parse import urlparse  # pylint: disable=F0401,E0611
+        stored = dict()
+        failed = dict()
+        waiting = list(self._requests)
+        active = dict()  ## host: transfers in flight
+        finished = [0]
+        pool = WorkerPool(min(self.jobs, len(waiting)))
+        try:
+            while waiting or pool.pending():
+                for url, checksum in list(waiting):
+                    if pool.pending() >= self.jobs:
+                        break
+                    host = urlparse(url)[1]
+                    if active.get(host, 0) >= self.per_host:
+                        continue
+                    waiting.remove((url, checksum))
+                    active[host] = active.get(host, 0) + 1
+                    pool.submit(url, self._fetch, url, checksum, finished)
+                url, path, exc_info = pool.next_result()
+                host = urlparse(url)[1]
+                active[host] -= 1
+                finished[0] += 1
+                if exc_info is None:
+                    stored[url] = path
+                else:
+                    failed[url] = exc_info[1]
+                self._report(finished[0])
+        finally:
+            pool.shutdown()
+        if options.VERBOSE and self._requests:
+            self.out.write('\n')
+        return stored, failed
+
+
+## a download function needing more than this many rounds is left
+##   to fetch the rest itself when called for real
+MAX_COLLECTION_ROUNDS = 8
+
+def collect_downloads(functions, jobs=4, per_host=2, out=sys.stdout):
+    '''
+    Call each of the given download functions with fetch() deferring
+    the archives that are not yet stored, download those concurrently,
+    and repeat until the functions need nothing new.
+    Returns a dictionary of function index: return value for those that
+    completed, and one of function index: exception for those that
+    failed (including the downloads they needed). Any others gave up
+    collecting after MAX_COLLECTION_ROUNDS, and are left to be called
+    for real. The functions should not change state that a later call
+    depends on.
+    '''
+    remaining = range(len(functions))
+    completed = dict()
+    failed = dict()
+    failures = dict()
+    for _ in range(MAX_COLLECTION_ROUNDS):
+        if not remaining:
+            break
+        scheduler = DownloadScheduler(jobs, per_host, out)
+        deferred = []
+        _set_collecting(failures)
+        try:
+            for idx in remaining:
+                try:
+                    completed[idx] = functions[idx]()
+                except DeferredDownload:
+                    exc = sys.exc_info()[1]
+                    scheduler.add(exc.url, exc.checksum)
+                    deferred.append(idx)
+                except Exception:  # pylint: disable=W0703
+                    failed[idx] = sys.exc_info()[1]
+        finally:
+            _set_collecting(None)
+        if not deferred:
+            break
+        failures.update(scheduler.run()[1])
+        remaining = deferred
+    return completed, failed
+
+
+def fetch(website, remote, local, dwnld_dir=options.download_dir, force=False,
+          checksum=None):
+    '''
+    Download website/remote as dwnld_dir/local, through the shared
+    archive store. A checksum, given or registered (see
+    register_checksums), is verified.
+    '''
     mkdir(dwnld_dir)
     set_downloading_file(remote)
-    if force or not os.path.exists(os.path.join(dwnld_dir, local)):
-        url = website + '/' + remote
-        if website.endswith('/'):
-            url = website + remote
-        urlretrieve(url, os.path.join(dwnld_dir, local), download_progress)
+    if checksum is None:
+        checksum = __CHECKSUMS.get(local, __CHECKSUMS.get(remote))
+    target = os.path.join(dwnld_dir, local)
+    if not force and os.path.exists(target):
+        if checksum is None or verify_checksum(target, checksum):
+            return
+        os.remove(target)  ## corrupt or outdated
+    url = website + '/' + remote
+    if website.endswith('/'):
+        url = website + remote
+    stored = None
+    if not force:
+        stored = archive_store.lookup(url, checksum)
+    if stored is None and __COLLECTING is not None:
+        if url in __COLLECTING:
+            raise __COLLECTING[url]
+        raise DeferredDownload(url, checksum)
+    if stored is None:
+        stored = archive_store.retrieve(url, checksum, download_progress)
         if options.VERBOSE:
             sys.stdout.write('\n')
+    _link_or_copy(stored, target)
 
 
-def zipextractall(zip_file):
-    ## zip_file.extractall not in 2.4
-    for name in zip_file.namelist():
-        (dirname, filename) = os.path.split(name)
-        if not os.path.exists(dirname):
-            mkdir(dirname)
-        if not filename == '':
-            f = open(name, 'w')
-            f.write(zip_file.read(name))
-            f.close()
+## Extraction ######
 
-    
-def tarextractall(tar_file):
-    ## tar_file.extractall not in 2.4
-    for tarinfo in tar_file:
-        tar_file.extract(tarinfo)
+def _decompress_z(archive_dir, archive):
+    ## Ugly, but necessary (neither gzip nor zlib packages work)
+    import subprocess
+    source = os.path.join(archive_dir, archive)
+    dest = source[:-2]
+    tmp = dest + '.partial'
+    f = open(tmp, 'wb')
+    try:
+        status = subprocess.call(['gunzip', '-c', source], stdout=f)
+    finally:
+        f.close()
+    if status != 0:
+        os.remove(tmp)
+        raise DownloadError('Unable to decompress ' + archive)
+    os.rename(tmp, dest)
 
 
 def open_archive(archive, archive_dir=None):
@@ -123,11 +457,7 @@ def open_archive(archive, archive_dir=None):
         archive_dir = options.download_dir
     if archive.endswith('.tar.Z'):
         if not os.path.exists(os.path.join(archive_dir, archive[:-2])):
-            ## Ugly, but necessary (neither gzip nor zlib packages work)
-            here = os.path.abspath(os.getcwd())
-            os.chdir(archive_dir)
-            os.system('gunzip ' + archive)
-            os.chdir(here)
+            _decompress_z(archive_dir, archive)
         archive = archive[:-2]
 
     if archive.endswith('.tgz') or archive.endswith('.tar.gz'):
@@ -147,39 +477,285 @@ def open_archive(archive, archive_dir=None):
 
     return z, names
 
-    
-def unarchive(archive, target, archive_dir=None):
+
+def _member_parts(name):
+    parts = [p for p in name.replace('\\', '/').split('/')
+             if p != '' and p != '.']
+    if name.startswith('/') or '..' in parts or \
+       (parts and os.path.splitdrive(parts[0])[0]):
+        raise DownloadError('Unsafe archive member: ' + name)
+    return parts
+
+
+def _archive_root(names):
+    ## the single top-level directory, if there is one
+    roots = set()
+    nested = False
+    for name in names:
+        parts = _member_parts(name)
+        if parts:
+            roots.add(parts[0])
+            nested = nested or len(parts) > 1
+    if len(roots) == 1 and nested:
+        return roots.pop()
+    return None
+
+
+def _destination(name, root, target_dir):
+    parts = _member_parts(name)
+    if root is not None:
+        parts = parts[1:]
+    if not parts:
+        return None
+    return os.path.join(target_dir, *parts)  # pylint: disable=W0142
+
+
+def _up_to_date(path, size, mtime):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_size == size and int(st.st_mtime) == int(mtime)
+
+
+def _write_member(source, path, size, mtime, mode=None):
+    if _up_to_date(path, size, mtime):
+        return
+    mkdir(os.path.dirname(path))
+    if os.path.islink(path):
+        os.remove(path)
+    out = open(path, 'wb')
+    try:
+        shutil.copyfileobj(source, out, BLOCK_SIZE)
+    finally:
+        out.close()
+    if mode:
+        os.chmod(path, mode & int('777', 8))
+    os.utime(path, (mtime, mtime))
+
+
+class _NoArchiveRoot(Exception):
+    pass
+
+
+def _extract_tar(path, mode, target_dir, strip=True):
+    ## sequential stream: each member is decompressed exactly once
+    tar = tarfile.open(path, mode)
+    try:
+        links = []
+        root = None
+        for member in tar:
+            parts = _member_parts(member.name)
+            if strip and root is None and parts:
+                if len(parts) == 1 and not member.isdir():
+                    raise _NoArchiveRoot()
+                root = parts[0]
+            if root is not None and parts and parts[0] != root:
+                raise _NoArchiveRoot()
+            dest = _destination(member.name, root, target_dir)
+            if dest is None:
+                continue
+            if member.isdir():
+                mkdir(dest)
+            elif member.isfile():
+                source = tar.extractfile(member)
+                try:
+                    _write_member(source, dest, member.size,
+                                  member.mtime, member.mode)
+                finally:
+                    source.close()
+            elif member.issym() or member.islnk():
+                links.append((member, dest))
+        for member, dest in links:
+            if os.path.lexists(dest):
+                continue
+            mkdir(os.path.dirname(dest))
+            if member.issym() and hasattr(os, 'symlink'):
+                os.symlink(member.linkname, dest)
+            else:
+                if member.issym():
+                    source = os.path.join(os.path.dirname(dest),
+                                          member.linkname)
+                else:
+                    source = _destination(member.linkname, root, target_dir)
+                if source is not None and os.path.isfile(source):
+                    shutil.copy2(source, dest)
+    finally:
+        tar.close()
+
+
+def _zip_mtime(info):
+    return time.mktime(tuple(info.date_time) + (0, 0, -1))
+
+
+def _extract_zip_members(path, names, target_dir, root):
+    ## one ZipFile per worker; members are streamed, not read whole
+    z = zipfile.ZipFile(path, 'r')
+    try:
+        for name in names:
+            info = z.getinfo(name)
+            dest = _destination(name, root, target_dir)
+            if dest is None:
+                continue
+            if name.endswith('/'):
+                mkdir(dest)
+                continue
+            source = z.open(info)
+            try:
+                _write_member(source, dest, info.file_size, _zip_mtime(info),
+                              info.external_attr >> 16)
+            finally:
+                source.close()
+    finally:
+        z.close()
+
+
+def _extract_zip(path, target_dir, root, jobs=None):
+    from sysdevel.distutils.parallel import parallel_map, cpu_count
+    z = zipfile.ZipFile(path, 'r')
+    try:
+        infos = z.infolist()
+    finally:
+        z.close()
+    if jobs is None:
+        jobs = cpu_count()
+    ## directories first, serially, as the workers share them
+    directories = set()
+    for info in infos:
+        dest = _destination(info.filename, root, target_dir)
+        if dest is None:
+            continue
+        if info.filename.endswith('/'):
+            directories.add(dest)
+        else:
+            directories.add(os.path.dirname(dest))
+    for directory in sorted(directories):
+        mkdir(directory)
+    ## balance the workers by uncompressed size
+    infos.sort(key=lambda i: i.file_size, reverse=True)
+    shares = [[0, []] for _ in range(max(1, min(jobs, len(infos))))]
+    for info in infos:
+        share = min(shares, key=lambda s: s[0])
+        share[0] += info.file_size
+        share[1].append(info.filename)
+    parallel_map(lambda s: _extract_zip_members(path, s[1], target_dir, root),
+                 shares, len(shares))
+
+
+def unarchive(archive, target, archive_dir=None, jobs=None):
+    '''
+    Extract archive (from archive_dir) directly into target under
+    the build directory, dropping the archive's top-level directory.
+    An interrupted extraction resumes, skipping files whose size and
+    mtime already match.
+    '''
     if archive_dir is None:
         archive_dir = options.download_dir
-    here = os.path.abspath(os.getcwd())
-    if not os.path.isabs(archive_dir):
-        archive_dir = os.path.join(here, archive_dir)
-    if not os.path.exists(os.path.join(options.target_build_dir, target)):
-        mkdir(options.target_build_dir)
-        os.chdir(options.target_build_dir)
-        z, members = open_archive(archive, archive_dir)
-        root = os.path.commonprefix(members)
-        if root.endswith(os.sep):
-            root = root[:-1]
-        if root == '':
-            root = target
-            mkdir(target)
-            os.chdir(target)
-        if archive.endswith('.zip'):
-            zipextractall(z)
+    archive_dir = os.path.abspath(archive_dir)
+    target_dir = os.path.abspath(os.path.join(options.target_build_dir,
+                                              target))
+    marker = os.path.join(options.target_build_dir,
+                          '.' + target.replace(os.sep, '_') + '_unarchiving')
+    if os.path.exists(target_dir) and not os.path.exists(marker):
+        return
+    mkdir(target_dir)
+    open(marker, 'w').close()
+
+    if archive.endswith('.tar.Z'):
+        if not os.path.exists(os.path.join(archive_dir, archive[:-2])):
+            _decompress_z(archive_dir, archive)
+        archive = archive[:-2]
+    path = os.path.join(archive_dir, archive)
+    if archive.endswith('.zip'):
+        z = zipfile.ZipFile(path, 'r')
+        try:
+            root = _archive_root(z.namelist())
+        finally:
+            z.close()
+        _extract_zip(path, target_dir, root, jobs)
+    else:
+        if archive.endswith('.tgz') or archive.endswith('.tar.gz'):
+            mode = 'gz'
+        elif archive.endswith('.tar.bz2'):
+            mode = 'bz2'
+        elif archive.endswith('.tar'):
+            mode = ''
         else:
-            tarextractall(z)
-        z.close()
-        if root != target:
-            shutil.move(root, target)
-        os.chdir(here)
+            raise DownloadError('Unsupported archive compression: ' + archive)
+        try:
+            _extract_tar(path, 'r|' + mode, target_dir)
+        except _NoArchiveRoot:
+            ## no single top-level directory after all; start over
+            shutil.rmtree(target_dir)
+            mkdir(target_dir)
+            _extract_tar(path, 'r|' + mode, target_dir, False)
+    os.remove(marker)
 
 
-def urlretrieve(url, filename=None, progress=None, data=None, proxy=None):
+def _top_level_member(name, filename):
+    parts = [p for p in name.replace('\\', '/').split('/')
+             if p != '' and p != '.']
+    return len(parts) <= 2 and parts[-1:] == [filename]
+
+
+def read_archive_member(archive, filename, archive_dir=None, url=None):
     '''
-    Identical to urllib.urlretrieve, except that it handles
-    SSL, proxies, and redirects properly.
+    Contents of the named file at the top of the archive, or of its
+    top-level directory (None if there is no such file).
+    A tarball that has not been downloaded is streamed from url,
+    reading only as far as that member.
     '''
+    if archive_dir is None:
+        archive_dir = options.download_dir
+    path = os.path.join(archive_dir, archive)
+    if not os.path.exists(path) and url is not None:
+        stored = archive_store.lookup(url)
+        if stored is not None:
+            path = stored
+    process = None
+    if os.path.exists(path):
+        if archive.endswith('.zip'):
+            z = zipfile.ZipFile(path, 'r')
+            try:
+                for name in z.namelist():
+                    if _top_level_member(name, filename):
+                        return z.read(name)
+            finally:
+                z.close()
+            return None
+        if archive.endswith('.tar.Z'):
+            import subprocess
+            process = subprocess.Popen(['gunzip', '-c', path],
+                                       stdout=subprocess.PIPE)
+            stream = process.stdout
+        else:
+            stream = open(path, 'rb')
+    elif url is None or archive.endswith('.zip') or \
+         archive.endswith('.tar.Z'):
+        raise DownloadError('Archive not available: ' + archive)
+    else:
+        _install_opener()
+        try:
+            stream = urlopen(Request(url=url))
+        except (URLError, HTTPError):
+            _download_error(url)
+    try:
+        tar = tarfile.open(fileobj=stream, mode='r|*')
+        try:
+            for member in tar:
+                if member.isfile() and \
+                   _top_level_member(member.name, filename):
+                    return tar.extractfile(member).read()
+        finally:
+            tar.close()
+    finally:
+        stream.close()
+        if process is not None:
+            process.wait()
+    return None
+
+
+def _install_opener(proxy=None):
     proxy_url = proxy
     if proxy_url is None:
         try:
@@ -197,6 +773,20 @@ def urlretrieve(url, filename=None, progress=None, data=None, proxy=None):
         opener = build_opener()
     install_opener(opener)
 
+
+def _download_error(url):
+    exc_class, exc, tb = sys.exc_info()
+    which = str(getattr(exc, 'reason', str(exc_class.__name__)))
+    new_exc = DownloadError(which, url, getattr(exc, 'code', None))
+    raise new_exc.__class__, new_exc, tb
+
+
+def urlretrieve(url, filename=None, progress=None, data=None, proxy=None):
+    '''
+    Identical to urllib.urlretrieve, except that it handles
+    SSL, proxies, and redirects properly.
+    '''
+    _install_opener(proxy)
     try:
         req = Request(url=url, data=data)
         fp = urlopen(req)
@@ -211,7 +801,7 @@ def urlretrieve(url, filename=None, progress=None, data=None, proxy=None):
             try:
                 result = filename, headers
                 size = -1
-                bs = 1024*8
+                bs = BLOCK_SIZE
                 read = 0
                 blocknum = 0
                 if "content-length" in headers:
@@ -235,10 +825,7 @@ def urlretrieve(url, filename=None, progress=None, data=None, proxy=None):
         del fp
         del tfp
     except (URLError, HTTPError):
-        exc_class, exc, tb = sys.exc_info()
-        which = str(getattr(exc, 'reason', str(exc_class.__name__)))
-        new_exc = DownloadError(which, url, str(getattr(exc, 'code', None)))
-        raise new_exc.__class__, new_exc, tb
+        _download_error(url)
 
     if size >= 0 and read < size:
         raise ContentTooShortError("%s: retrieval incomplete: "
@@ -246,3 +833,132 @@ def urlretrieve(url, filename=None, progress=None, data=None, proxy=None):
                                    (url, read, size), result)
 
     return result
+
+
+def _validator(headers):
+    ## what identifies this version of the resource, for If-Range
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):  ## weak tags cannot be used
+        return etag
+    return headers.get('Last-Modified')
+
+
+def resume_urlretrieve(url, filename, progress=None, proxy=None):
+    '''
+    Like urlretrieve, but continues an existing partial file
+    with an HTTP Range request (restarting if the server ignores it).
+    The partial file is only continued if the resource is unchanged,
+    as told by the validator (ETag or Last-Modified) kept beside it.
+    '''
+    _install_opener(proxy)
+    validator_file = filename + '.validator'
+    offset = 0
+    validator = None
+    if os.path.exists(filename) and os.path.exists(validator_file):
+        f = open(validator_file, 'r')
+        try:
+            validator = f.read().strip()
+        finally:
+            f.close()
+        if validator:
+            offset = os.path.getsize(filename)
+    req = Request(url=url)
+    if offset:
+        req.add_header('Range', 'bytes=%d-' % offset)
+        req.add_header('If-Range', validator)
+    try:
+        try:
+            fp = urlopen(req)
+        except HTTPError:
+            if offset and sys.exc_info()[1].code == 416:
+                os.remove(validator_file)
+                return filename, None  ## already complete
+            raise
+        try:
+            headers = fp.info()
+            code = getattr(fp, 'code', None)
+            if offset and code != 206:
+                offset = 0  ## range not supported, or changed upstream
+            mode = 'wb'
+            if offset:
+                mode = 'ab'
+            else:
+                validator = _validator(headers)
+                if os.path.exists(validator_file):
+                    os.remove(validator_file)
+            tfp = open(filename, mode)
+            try:
+                if not offset and validator:
+                    f = open(validator_file, 'w')
+                    try:
+                        f.write(validator)
+                    finally:
+                        f.close()
+                size = -1
+                bs = BLOCK_SIZE
+                read = offset
+                blocknum = offset // bs
+                if "content-length" in headers:
+                    size = int(headers["Content-Length"]) + offset
+                if progress:
+                    progress(blocknum, bs, size)
+                while True:
+                    block = fp.read(bs)
+                    if not block:
+                        break
+                    read += len(block)
+                    tfp.write(block)
+                    blocknum += 1
+                    if progress:
+                        progress(blocknum, bs, size)
+            finally:
+                tfp.close()
+        finally:
+            fp.close()
+    except (URLError, HTTPError):
+        _download_error(url)
+
+    if size >= 0 and read < size:
+        raise ContentTooShortError("%s: retrieval incomplete: "
+                                   "got only %i out of %i bytes" %
+                                   (url, read, size), (filename, headers))
+    if os.path.exists(validator_file):
+        os.remove(validator_file)
+    return filename, headers
+
+
+
+def test():
+    import tempfile as tmp
+    cache_dir = options.user_cache_dir
+    work = tmp.mkdtemp()
+    try:
+        options.set_user_cache_dir(os.path.join(work, 'cache'))
+        served = os.path.join(work, 'served')
+        mkdir(served)
+        for name in ['a.tar.gz', 'b.tar.gz']:
+            f = open(os.path.join(served, name), 'wb')
+            f.write(name.encode('utf-8') * 1000)
+            f.close()
+        website = 'file://' + served.replace(os.sep, '/')
+        dwnld_dir = os.path.join(work, 'downloads')
+        def download(*names):
+            for name in names:
+                fetch(website, name, name, dwnld_dir)
+            return names
+        functions = [lambda: download('a.tar.gz'),
+                     lambda: download('a.tar.gz', 'b.tar.gz'),
+                     lambda: download('missing.tar.gz')]
+        completed, failed = collect_downloads(functions)
+        if sorted(completed.keys()) != [0, 1] or list(failed.keys()) != [2]:
+            raise RuntimeError('Failed test 1')
+        if archive_store.lookup(website + '/b.tar.gz') is None:
+            raise RuntimeError('Failed test 2')
+        ## stored: nothing left to collect
+        completed, failed = collect_downloads(functions[:2])
+        if sorted(completed.keys()) != [0, 1] or failed:
+            raise RuntimeError('Failed test 3')
+    finally:
+        options.set_user_cache_dir(cache_dir)
+        shutil.rmtree(work, ignore_errors=True)
+    print('Success')
@@ -0,0 +1,307 @@
+"""
+Copyright 2013.  Los Alamos National Security, LLC.
+This material was produced under U.S. Government contract
+DE-AC52-06NA25396 for Los Alamos National Laboratory (LANL), which is
+operated by Los Alamos National Security, LLC for the U.S. Department
+of Energy. The U.S. Government has rights to use, reproduce, and
+distribute this software.  NEITHER THE GOVERNMENT NOR LOS ALAMOS
+NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+modified to produce derivative works, such modified software should be
+clearly marked, so as not to confuse it with the version available
+from LANL.
+
+Licensed under the Mozilla Public License, Version 2.0 (the
+"License"); you may not use this file except in compliance with the
+License. You may obtain a copy of the License at
+http://www.mozilla.org/MPL/2.0/
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+# pylint: disable=W0105
+"""
+Persistent filesystem index for the prerequisite search functions
+"""
+
+import os
+import time
+import threading
+import fnmatch
+import bisect
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from sysdevel.distutils.filesystem import mkdir
+from sysdevel.distutils import options
+
+
+INDEX_FILE = '.file_index'
+INDEX_VERSION = 1
+
+## directory mtimes this close to the scan time are not trusted
+MTIME_RESOLUTION = 2.0
+
+
+def _literal_prefix(pattern):
+    for idx in range(len(pattern)):
+        if pattern[idx] in '*?[':
+            return pattern[:idx]
+    return pattern
+
+
+def _normalize(path):
+    return os.path.normpath(os.path.abspath(path))
+
+
+def _is_under(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+class _FileIndex(object):
+    '''
+    Scan cache of the directory trees searched by find_header,
+    find_libraries and find_definitions.
+    Each directory maps to its mtime and listing, so a directory is only
+    re-read when it has changed. Every root is validated once per run
+    (or after invalidate()); queries are answered from name tables.
+    '''
+    def __init__(self):
+        self._lock = threading.RLock()  ## shared by detection threads
+        self._dirs = None   ## dirpath -> (mtime, filenames, dirnames, links)
+        self._roots = []
+        self._validated = []
+        self._dirty = False
+        self._tables = None
+
+    def _index_file(self):
+        return os.path.join(options.target_build_dir, INDEX_FILE)
+
+    def load(self):
+        self._dirs = dict()
+        self._roots = []
+        self._tables = None
+        index_file = self._index_file()
+        if os.path.exists(index_file):
+            try:
+                f = open(index_file, 'rb')
+                try:
+                    cached = pickle.load(f)
+                finally:
+                    f.close()
+                if cached['version'] == INDEX_VERSION:
+                    self._dirs = cached['directories']
+                    self._roots = cached['roots']
+            except Exception:  # pylint: disable=W0703
+                pass
+
+    def save(self):
+        '''
+        Write the index next to the configuration cache, if it changed.
+        '''
+        self._lock.acquire()
+        try:
+            if not self._dirty or self._dirs is None:
+                return
+            mkdir(options.target_build_dir)
+            index_file = self._index_file()
+            tmp_file = index_file + '.tmp'
+            f = open(tmp_file, 'wb')
+            try:
+                pickle.dump(dict(version=INDEX_VERSION, roots=self._roots,
+                                 directories=self._dirs),
+                            f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            if os.path.exists(index_file):
+                os.remove(index_file)  ## rename does not overwrite on Windows
+            os.rename(tmp_file, index_file)
+            self._dirty = False
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        '''
+        Forget everything, including the saved index.
+        '''
+        self._lock.acquire()
+        try:
+            self._dirs = dict()
+            self._roots = []
+            self._validated = []
+            self._tables = None
+            self._dirty = False
+            index_file = self._index_file()
+            if os.path.exists(index_file):
+                os.remove(index_file)
+        finally:
+            self._lock.release()
+
+    def invalidate(self, path=None):
+        '''
+        Force revalidation of the roots containing path (or all roots)
+        on their next query, e.g. after installing into them.
+        '''
+        self._lock.acquire()
+        try:
+            if path is None:
+                self._validated = []
+            else:
+                path = _normalize(path)
+                self._validated = [r for r in self._validated
+                                   if not _is_under(path, r) and
+                                   not _is_under(r, path)]
+        finally:
+            self._lock.release()
+
+
+    def _scan(self, directory, mtime):
+        filenames = []
+        dirnames = []
+        links = []
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        for name in names:
+            full = os.path.join(directory, name)
+            if os.path.isdir(full):
+                dirnames.append(name)
+                if os.path.islink(full):
+                    links.append(name)  ## listed, but not descended
+            else:
+                filenames.append(name)
+        if time.time() - mtime < MTIME_RESOLUTION:
+            mtime = None  ## modified too recently to be trusted
+        self._dirs[directory] = (mtime, filenames, dirnames, links)
+        self._dirty = True
+        self._tables = None
+
+    def _forget(self, directory):
+        for d in list(self._dirs.keys()):
+            if _is_under(d, directory):
+                del self._dirs[d]
+        self._dirty = True
+        self._tables = None
+
+    def _refresh(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            if directory in self._dirs:
+                self._forget(directory)
+            return
+        entry = self._dirs.get(directory)
+        if entry is None or entry[0] is None or entry[0] != mtime:
+            self._scan(directory, mtime)
+            if entry is not None:  ## drop vanished subtrees
+                for name in entry[2]:
+                    if not name in self._dirs[directory][2]:
+                        self._forget(os.path.join(directory, name))
+            entry = self._dirs[directory]
+        for name in entry[2]:
+            if not name in entry[3]:
+                self._refresh(os.path.join(directory, name))
+
+    def _ensure(self, root):
+        if self._dirs is None:
+            self.load()
+        for r in self._validated:
+            if _is_under(root, r):
+                return
+        if not os.path.isdir(root):
+            return
+        self._refresh(root)
+        self._validated.append(root)
+        for r in self._roots:
+            if _is_under(root, r):
+                return
+        self._roots = [r for r in self._roots if not _is_under(r, root)]
+        self._roots.append(root)
+        self._dirty = True
+
+
+    def _build_tables(self):
+        by_name = dict()
+        dirs_by_name = dict()
+        for directory, (_, filenames, dirnames, _) in self._dirs.items():
+            for name in filenames:
+                by_name.setdefault(os.path.normcase(name),
+                                   []).append((directory, name))
+            for name in dirnames:
+                dirs_by_name.setdefault(os.path.normcase(name),
+                                        []).append(directory)
+        names = list(by_name.keys())
+        names.sort()
+        self._tables = (by_name, names, dirs_by_name)
+
+    def find_files(self, root, patterns):
+        '''
+        Find the files under root matching the given pattern(s).
+        Returns a list of (directory, [filenames]) tuples, ordered
+        shallowest directory first.
+        '''
+        self._lock.acquire()
+        try:
+            if not isinstance(patterns, (list, tuple)):
+                patterns = [patterns]
+            root = _normalize(root)
+            self._ensure(root)
+            if self._tables is None:
+                self._build_tables()
+            by_name, names, _ = self._tables
+            found = dict()
+            for pattern in patterns:
+                key = os.path.normcase(pattern)
+                prefix = _literal_prefix(key)
+                if prefix == key:
+                    candidates = [key]
+                else:
+                    candidates = []
+                    idx = bisect.bisect_left(names, prefix)
+                    while idx < len(names) and names[idx].startswith(prefix):
+                        candidates.append(names[idx])
+                        idx += 1
+                for candidate in candidates:
+                    for directory, name in by_name.get(candidate, []):
+                        if _is_under(directory, root) and \
+                           fnmatch.fnmatch(name, pattern):
+                            found.setdefault(directory, set()).add(name)
+            results = []
+            for directory, filenames in found.items():
+                filenames = list(filenames)
+                filenames.sort()
+                results.append((directory.count(os.sep), directory, filenames))
+            results.sort()
+            return [(directory, filenames) for _, directory, filenames in results]
+        finally:
+            self._lock.release()
+
+    def find_directories(self, root, name):
+        '''
+        Find the directories under root that contain the named subdirectory.
+        Returns a list ordered shallowest first.
+        '''
+        self._lock.acquire()
+        try:
+            root = _normalize(root)
+            self._ensure(root)
+            if self._tables is None:
+                self._build_tables()
+            dirs_by_name = self._tables[2]
+            results = [(d.count(os.sep), d)
+                       for d in dirs_by_name.get(os.path.normcase(name), [])
+                       if _is_under(d, root)]
+            results.sort()
+            return [d for _, d in results]
+        finally:
+            self._lock.release()
+
+
+file_index = _FileIndex()
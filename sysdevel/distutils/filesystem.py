@@ -29,10 +29,20 @@ Utilities for portable filesystem manipulation
 
 import os
 import sys
+import errno
 import fnmatch
 import glob
+import re
 import shutil
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # pylint: disable=F0401
+    except ImportError:
+        scandir = None
+
 
 def mkdir(newdir):
     if os.path.isdir(newdir):
@@ -45,70 +55,207 @@ def mkdir(newdir):
         if head and not os.path.isdir(head):
             mkdir(head)
         if tail:
-            os.mkdir(newdir)
+            try:
+                os.mkdir(newdir)
+            except OSError:
+                ## created meanwhile by another thread or process
+                if sys.exc_info()[1].errno != errno.EEXIST or \
+                        not os.path.isdir(newdir):
+                    raise
+
+
+def exclusion_matcher(excludes):
+    '''
+    Compile fnmatch-style exclude patterns into a single predicate on
+    names (None if there is nothing to exclude).
+    '''
+    if not excludes:
+        return None
+    regex = re.compile('|'.join(['(?:' + fnmatch.translate(os.path.normcase(ex))
+                                 + ')' for ex in excludes]))
+    return lambda name: regex.match(os.path.normcase(name)) is not None
+
+
+def list_dir(directory):
+    '''
+    Names of the subdirectories and other entries of a directory,
+    using scandir where available.
+    '''
+    dirnames = []
+    filenames = []
+    if scandir is not None:
+        for entry in scandir(directory):
+            if entry.is_dir():
+                dirnames.append(entry.name)
+            else:
+                filenames.append(entry.name)
+    else:
+        for name in os.listdir(directory):
+            if os.path.isdir(os.path.join(directory, name)):
+                dirnames.append(name)
+            else:
+                filenames.append(name)
+    return dirnames, filenames
+
+
+def walk(top, excludes=None, pruned=()):
+    '''
+    Like os.walk (top down, without following links), except that
+    entries whose name or path matches one of the excludes are neither
+    listed nor descended into, nor are the pruned directories.
+    '''
+    excluded = exclusion_matcher(excludes)
+    pruned = set([os.path.normcase(os.path.abspath(p)) for p in pruned])
+    pending = [top]
+    while pending:
+        root = pending.pop()
+        try:
+            dirnames, filenames = list_dir(root)
+        except OSError:
+            continue
+        if excluded is not None:
+            dirnames = [d for d in dirnames
+                        if not excluded(d) and
+                        not excluded(os.path.join(root, d))]
+            filenames = [f for f in filenames if not excluded(f)]
+        yield root, dirnames, filenames
+        for d in reversed(dirnames):
+            path = os.path.join(root, d)
+            if not os.path.islink(path) and \
+                    not os.path.normcase(os.path.abspath(path)) in pruned:
+                pending.append(path)
+
+
+def _entries(directory):
+    ## (name, path, is_dir, is_link, scandir entry or None)
+    if scandir is not None:
+        return [(entry.name, entry.path, entry.is_dir(), entry.is_symlink(),
+                 entry) for entry in scandir(directory)]
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        entries.append((name, path, os.path.isdir(path),
+                        os.path.islink(path), None))
+    return entries
+
+
+def _stat(path, entry=None):
+    ## None if missing (e.g. a dangling link)
+    try:
+        if entry is not None:
+            return entry.stat()
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _up_to_date(src_stat, dst_name, preserve_times, update):
+    dst_stat = _stat(dst_name)
+    if src_stat is None or dst_stat is None:
+        return False
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        return True  ## hard linked
+    if update and dst_stat.st_mtime >= src_stat.st_mtime:
+        return True
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if preserve_times:
+        return int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+    return dst_stat.st_mtime >= src_stat.st_mtime
+
+
+def _hardlink(src_name, dst_name):
+    try:
+        if os.path.lexists(dst_name):
+            os.remove(dst_name)
+        os.link(src_name, dst_name)
+        return True
+    except (OSError, AttributeError):  ## e.g. across filesystems
+        return False
+
+
+## files to copy, beyond which the copies are made in parallel
+PARALLEL_COPY_THRESHOLD = 64
 
 
 def copy_tree(src, dst, preserve_mode=1, preserve_times=1, preserve_symlinks=0,
-              update=0, verbose=0, dry_run=0, excludes=None):
+              update=0, verbose=0, dry_run=0, excludes=None, hardlink=False,
+              jobs=None):
     '''
-    Extends distutils.dir_util.copy_tree to exclude given patterns
+    Extends distutils.dir_util.copy_tree to exclude given patterns.
+    Files whose size and modification time already match are skipped;
+    with hardlink, files are linked rather than copied where possible.
+    Returns the destination files that were (re)created, so that
+    nothing downstream needs doing if it is empty.
     '''
-    from distutils import dir_util, file_util
+    from distutils import file_util
     from distutils.errors import DistutilsFileError
     from distutils import log
-
-    if excludes is None:
-        excludes = []
+    from sysdevel.distutils.parallel import parallel_map
 
     if not dry_run and not os.path.isdir(src):
         raise DistutilsFileError("cannot copy tree '%s': not a directory" % src)
-    try:
-        names = os.listdir(src)
-    except OSError:
-        e = sys.exc_info()[1]
-        if dry_run:
-            names = []
-        else:
-            raise DistutilsFileError("error listing files in '%s': %s" %
-                                     (src, e.strerror))
-
-    if not dry_run:
-        dir_util.mkpath(dst)
-
-    outputs = []
-
-    for n in names:
-        exclude = False
-        for excl in excludes:
-            if fnmatch.fnmatch(n, excl):
-                exclude = True
-        if exclude:
+    excluded = exclusion_matcher(excludes)
+
+    changed = []
+    copies = []
+    pending = [(src, dst)]
+    while pending:
+        src_dir, dst_dir = pending.pop()
+        try:
+            entries = _entries(src_dir)
+        except OSError:
+            e = sys.exc_info()[1]
+            if dry_run:
+                entries = []
+            else:
+                raise DistutilsFileError("error listing files in '%s': %s" %
+                                         (src_dir, e.strerror))
+        if not dry_run and not os.path.isdir(dst_dir):
             if verbose:
-                log.info("excluding %s from copy", n)
-            continue
+                log.info("creating %s", dst_dir)
+            mkdir(dst_dir)
 
-        src_name = os.path.join(src, n)
-        dst_name = os.path.join(dst, n)
-
-        if preserve_symlinks and os.path.islink(src_name):
-            link_dest = os.readlink(src_name)
-            log.info("linking %s -> %s", dst_name, link_dest)
-            if not dry_run:
-                os.symlink(link_dest, dst_name)
-            outputs.append(dst_name)
-
-        elif os.path.isdir(src_name):
-            outputs.extend(
-                copy_tree(src_name, dst_name, preserve_mode,
-                          preserve_times, preserve_symlinks, update,
-                          verbose, dry_run, excludes))
-        else:
-            file_util.copy_file(src_name, dst_name, preserve_mode,
-                                preserve_times, update, None,
-                                verbose=verbose, dry_run=dry_run)
-            outputs.append(dst_name)
-
-    return outputs
+        for name, src_name, is_dir, is_link, entry in entries:
+            if excluded is not None and excluded(name):
+                if verbose:
+                    log.info("excluding %s from copy", name)
+                continue
+            dst_name = os.path.join(dst_dir, name)
+
+            if preserve_symlinks and is_link:
+                link_dest = os.readlink(src_name)
+                if os.path.islink(dst_name) and \
+                        os.readlink(dst_name) == link_dest:
+                    continue
+                log.info("linking %s -> %s", dst_name, link_dest)
+                if not dry_run:
+                    if os.path.lexists(dst_name):
+                        os.remove(dst_name)
+                    os.symlink(link_dest, dst_name)
+                changed.append(dst_name)
+            elif is_dir:
+                pending.append((src_name, dst_name))
+            elif not _up_to_date(_stat(src_name, entry), dst_name,
+                                 preserve_times, update):
+                copies.append((src_name, dst_name))
+
+    def copy_one(names):
+        if hardlink and not dry_run and _hardlink(*names):  # pylint: disable=W0142
+            if verbose:
+                log.info("hard linking %s -> %s", names[0], names[1])
+            return
+        file_util.copy_file(names[0], names[1], preserve_mode,
+                            preserve_times, 0, None,
+                            verbose=verbose, dry_run=dry_run)
+
+    if len(copies) > PARALLEL_COPY_THRESHOLD:
+        parallel_map(copy_one, copies, jobs)
+    else:
+        for names in copies:
+            copy_one(names)
+    changed.extend([dst_name for _, dst_name in copies])
+    return changed
 
 
 
@@ -36,6 +36,8 @@ cxx_ext_match = re.compile(r'.*[.](cpp|cxx|cc)\Z',re.I).match
 fortran_ext_match = re.compile(r'.*[.](f90|f95|f77|for|ftn|f)\Z',re.I).match
 f90_ext_match = re.compile(r'.*[.](f90|f95)\Z',re.I).match
 f90_module_name_match = re.compile(r'\s*module\s*(?P<name>[\w_]+)',re.I).match
+f90_use_match = re.compile(r'\s*use(?:\s*,\s*\w+\s*::\s*|\s+)(?P<name>[\w_]+)',
+                           re.I).match
 
 def _get_f90_modules(source):
     """Return a list of Fortran f90 module names that
@@ -54,6 +56,24 @@ def _get_f90_modules(source):
     f.close()
     return modules
 
+def _get_f90_uses(source):
+    """Return a list of Fortran f90 module names that
+    given source file uses.
+    """
+    if not fortran_ext_match(source):
+        return []
+    modules = []
+    f = open(source,'r')
+    f_readlines = getattr(f,'xreadlines',f.readlines)
+    for line in f_readlines():
+        m = f90_use_match(line)
+        if m:
+            name = m.group('name').lower()
+            if not name in modules:
+                modules.append(name)
+    f.close()
+    return modules
+
 def all_strings(lst):
     """Return True if all items in lst are string objects. """
     for item in lst:
@@ -0,0 +1,245 @@
+"""
+Copyright 2013.  Los Alamos National Security, LLC.
+This material was produced under U.S. Government contract
+DE-AC52-06NA25396 for Los Alamos National Laboratory (LANL), which is
+operated by Los Alamos National Security, LLC for the U.S. Department
+of Energy. The U.S. Government has rights to use, reproduce, and
+distribute this software.  NEITHER THE GOVERNMENT NOR LOS ALAMOS
+NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+modified to produce derivative works, such modified software should be
+clearly marked, so as not to confuse it with the version available
+from LANL.
+
+Licensed under the Mozilla Public License, Version 2.0 (the
+"License"); you may not use this file except in compliance with the
+License. You may obtain a copy of the License at
+http://www.mozilla.org/MPL/2.0/
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+# pylint: disable=W0105
+"""
+Content-addressed cache of compiled objects, shared across builds
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+import hashlib
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from sysdevel.distutils.filesystem import mkdir
+from sysdevel.distutils import options
+
+
+OBJECT_CACHE_SIZE = 1024 * 1024 * 1024  ## bytes, before eviction
+STATISTICS_FILE = 'statistics.json'
+
+
+class _ObjectCache(object):
+    '''
+    Compiled objects (user_cache_dir/objects), keyed by a hash of the
+    preprocessed source, the compiler command and version, and the
+    compile options. Hits are hard linked (or copied) into build_temp.
+    Least recently used objects are evicted beyond OBJECT_CACHE_SIZE
+    (or SYSDEVEL_OBJECT_CACHE_SIZE bytes; 0 disables the cache).
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = dict()
+        self.hits = 0
+        self.misses = 0
+        self._counted = (0, 0)  ## already added to the statistics file
+        self._total = None  ## bytes in the cache, since the last trim
+
+    def directory(self):
+        return os.path.join(options.user_cache_dir, 'objects')
+
+    def size_limit(self):
+        try:
+            return int(os.environ['SYSDEVEL_OBJECT_CACHE_SIZE'])
+        except (KeyError, ValueError):
+            return OBJECT_CACHE_SIZE
+
+    def enabled(self):
+        return self.size_limit() > 0
+
+    def compiler_version(self, executable):
+        self._lock.acquire()
+        try:
+            if not executable in self._versions:
+                try:
+                    p = subprocess.Popen([executable, '--version'],
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT)
+                    self._versions[executable] = p.communicate()[0]
+                except OSError:
+                    self._versions[executable] = ''
+            return self._versions[executable]
+        finally:
+            self._lock.release()
+
+    def key(self, compiler, source, preprocessed, kwargs):
+        '''
+        Cache key for compiling source (already preprocessed into the
+        given file) with the given compiler and compile() arguments.
+        '''
+        command = list(getattr(compiler, 'compiler_so', None) or [])
+        h = hashlib.sha256()
+        h.update(repr((compiler.compiler_type, command,
+                       kwargs.get('macros'), kwargs.get('include_dirs'),
+                       kwargs.get('debug'), kwargs.get('extra_preargs'),
+                       kwargs.get('extra_postargs'),
+                       os.path.splitext(source)[1])).encode('utf-8'))
+        if command:
+            h.update(self.compiler_version(command[0]))
+        f = open(preprocessed, 'rb')
+        try:
+            while True:
+                block = f.read(64 * 1024)
+                if not block:
+                    break
+                h.update(block)
+        finally:
+            f.close()
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory(), key[:2], key + '.o')
+
+    def restore(self, key, obj):
+        '''
+        Put the cached object into place, if there is one.
+        '''
+        cached = self._path(key)
+        if not os.path.exists(cached):
+            self._count(False)
+            return False
+        if os.path.exists(obj):
+            os.remove(obj)
+        try:
+            os.link(cached, obj)
+        except (AttributeError, OSError):
+            shutil.copy2(cached, obj)
+        os.utime(obj, None)  ## newer than its sources; touches the entry
+        self._count(True)
+        return True
+
+    def store(self, key, obj):
+        if not os.path.exists(obj):
+            return
+        cached = self._path(key)
+        mkdir(os.path.dirname(cached))
+        tmp = cached + '.' + str(os.getpid()) + '.' + \
+              str(threading.current_thread().ident)
+        try:
+            os.link(obj, tmp)
+        except (AttributeError, OSError):
+            shutil.copy2(obj, tmp)
+        if os.path.exists(cached):
+            os.remove(cached)  ## rename does not overwrite on Windows
+        os.rename(tmp, cached)
+        self._lock.acquire()
+        try:
+            if self._total is not None:
+                self._total += os.path.getsize(cached)
+        finally:
+            self._lock.release()
+
+    def _count(self, hit):
+        self._lock.acquire()
+        try:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        finally:
+            self._lock.release()
+
+    def statistics(self):
+        '''
+        Totals of (hits, misses), over all builds.
+        '''
+        path = os.path.join(self.directory(), STATISTICS_FILE)
+        totals = dict(hits=0, misses=0)
+        if os.path.exists(path):
+            try:
+                f = open(path, 'r')
+                try:
+                    totals = json.load(f)
+                finally:
+                    f.close()
+            except Exception:  # pylint: disable=W0703
+                pass
+        return totals['hits'], totals['misses']
+
+    def save_statistics(self):
+        self._lock.acquire()
+        try:
+            hits, misses = self.statistics()
+            hits += self.hits - self._counted[0]
+            misses += self.misses - self._counted[1]
+            self._counted = (self.hits, self.misses)
+            mkdir(self.directory())
+            path = os.path.join(self.directory(), STATISTICS_FILE)
+            tmp = path + '.' + str(os.getpid())
+            f = open(tmp, 'w')
+            try:
+                json.dump(dict(hits=hits, misses=misses), f)
+            finally:
+                f.close()
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp, path)
+        finally:
+            self._lock.release()
+
+    def trim(self):
+        '''
+        Evict the least recently used objects beyond the size limit.
+        The cache is only scanned once per run, then again when what
+        this run stored takes it over the limit.
+        '''
+        limit = self.size_limit()
+        if self._total is not None and self._total <= limit:
+            return
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.directory()):
+            for name in filenames:
+                if not name.endswith('.o'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        entries.sort()
+        while total > limit and entries:
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total = total
+
+    def clear(self):
+        if os.path.exists(self.directory()):
+            shutil.rmtree(self.directory(), ignore_errors=True)
+        self._total = None
+
+
+object_cache = _ObjectCache()
@@ -0,0 +1,224 @@
+"""
+Copyright 2013.  Los Alamos National Security, LLC.
+This material was produced under U.S. Government contract
+DE-AC52-06NA25396 for Los Alamos National Laboratory (LANL), which is
+operated by Los Alamos National Security, LLC for the U.S. Department
+of Energy. The U.S. Government has rights to use, reproduce, and
+distribute this software.  NEITHER THE GOVERNMENT NOR LOS ALAMOS
+NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+modified to produce derivative works, such modified software should be
+clearly marked, so as not to confuse it with the version available
+from LANL.
+
+Licensed under the Mozilla Public License, Version 2.0 (the
+"License"); you may not use this file except in compliance with the
+License. You may obtain a copy of the License at
+http://www.mozilla.org/MPL/2.0/
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+# pylint: disable=W0105
+"""
+Thread pool utilities for concurrent configuration and building
+"""
+
+import os
+import sys
+import threading
+
+try:
+    import queue  # pylint: disable=F0401
+except ImportError:
+    import Queue as queue
+
+
+## set for subpackage builds run concurrently: their share of the CPUs
+JOBS_VARIABLE = 'SYSDEVEL_JOBS'
+
+
+def cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def cpu_share():
+    '''
+    CPUs this process may use: the share given by a parent build
+    (JOBS_VARIABLE), or all of them.
+    '''
+    try:
+        return max(1, int(os.environ[JOBS_VARIABLE]))
+    except (KeyError, ValueError):
+        return cpu_count()
+
+
+def _wait(q):
+    ## a timeout keeps the main thread responsive to KeyboardInterrupt
+    while True:
+        try:
+            return q.get(True, 3600)
+        except queue.Empty:
+            pass
+
+
+class WorkerPool(object):
+    '''
+    Fixed set of daemon worker threads. Results of submitted calls are
+    collected in completion order with next_result().
+    With jobs <= 1, calls are run immediately in the calling thread.
+    '''
+    def __init__(self, jobs=None):
+        if jobs is None:
+            jobs = cpu_count()
+        self.jobs = max(1, int(jobs))
+        self._tasks = queue.Queue()
+        self._results = queue.Queue()
+        self._pending = 0
+        self._threads = []
+        if self.jobs > 1:
+            for _ in range(self.jobs):
+                t = threading.Thread(target=self._work)
+                t.setDaemon(True)
+                t.start()
+                self._threads.append(t)
+
+    def _run(self, key, function, args, kwargs):
+        try:
+            result = function(*args, **kwargs)  # pylint: disable=W0142
+            self._results.put((key, result, None))
+        except:  # pylint: disable=W0702
+            self._results.put((key, None, sys.exc_info()))
+
+    def _work(self):
+        while True:
+            task = _wait(self._tasks)
+            if task is None:
+                break
+            self._run(*task)  # pylint: disable=W0142
+
+    def submit(self, key, function, *args, **kwargs):
+        self._pending += 1
+        if self._threads:
+            self._tasks.put((key, function, args, kwargs))
+        else:
+            self._run(key, function, args, kwargs)
+
+    def pending(self):
+        return self._pending
+
+    def next_result(self):
+        '''
+        Block until a submitted call finishes.
+        Returns a (key, result, exc_info) tuple; exc_info is None on success.
+        '''
+        result = _wait(self._results)
+        self._pending -= 1
+        return result
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._tasks.put(None)
+        self._threads = []
+
+
+class _CPUBudget(object):
+    '''
+    Process-wide allowance of CPUs for concurrent builds (such as
+    prerequisite installs, each running 'make -j'), so that together
+    they do not oversubscribe the machine.
+    '''
+    def __init__(self):
+        self._total = None
+        self._available = 0
+        self._cond = threading.Condition()
+        self._held = threading.local()
+
+    def total(self):
+        if self._total is None:
+            self.set_total(cpu_share())
+        return self._total
+
+    def set_total(self, count):
+        self._cond.acquire()
+        try:
+            count = max(1, int(count))
+            self._available += count - (self._total or 0)
+            self._total = count
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def acquire(self, wanted=1):
+        '''
+        Block until a CPU is free, then take up to 'wanted' of those free.
+        Returns the number taken.
+        '''
+        self.total()
+        self._cond.acquire()
+        try:
+            while self._available < 1:
+                self._cond.wait()
+            granted = max(1, min(wanted, self._available))
+            self._available -= granted
+            self._held.count = self.held() + granted
+            return granted
+        finally:
+            self._cond.release()
+
+    def release(self, count):
+        self._cond.acquire()
+        try:
+            self._available += count
+            self._held.count = max(0, self.held() - count)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def held(self):
+        return getattr(self._held, 'count', 0)
+
+    def jobs(self):
+        '''
+        CPUs the calling thread may use: those it holds, or all of
+        them if it holds none.
+        '''
+        return self.held() or self.total()
+
+
+cpu_budget = _CPUBudget()
+
+
+def reraise(exc_info):
+    raise exc_info[0], exc_info[1], exc_info[2]
+
+
+def parallel_map(function, items, jobs=None):
+    '''
+    Apply function to every item using a WorkerPool.
+    Results are returned in item order; the first failure is re-raised.
+    '''
+    items = list(items)
+    pool = WorkerPool(min(jobs or cpu_count(), max(1, len(items))))
+    try:
+        for idx in range(len(items)):
+            pool.submit(idx, function, items[idx])
+        results = [None] * len(items)
+        failure = None
+        while pool.pending():
+            idx, result, exc_info = pool.next_result()
+            if exc_info is not None and failure is None:
+                failure = exc_info
+            results[idx] = result
+    finally:
+        pool.shutdown()
+    if failure is not None:
+        reraise(failure)
+    return results
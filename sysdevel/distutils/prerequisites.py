@@ -29,7 +29,9 @@ Utilities for prerequisite library and build-tool installation
 
 import os
 import sys
+import imp
 import platform
+import collections
 import subprocess
 import fnmatch
 import struct
@@ -37,6 +39,9 @@ import glob
 import traceback
 import re
 import shutil
+import tempfile
+import threading
+import atexit
 from distutils.sysconfig import get_python_lib
 
 COMPATIBILITY_MODE = False
@@ -55,9 +60,16 @@ try:
 except ImportError:
     import simplejson as json
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from sysdevel.distutils.filesystem import mkdir
-from sysdevel.distutils.building import process_progress
+from sysdevel.distutils.supervisor import ActivityDots, check_process, run_process
 from sysdevel.distutils.fetching import fetch, unarchive
+from sysdevel.distutils.file_index import file_index
+from sysdevel.distutils.parallel import cpu_budget
 from sysdevel.util import is_string
 from sysdevel.distutils import options
 
@@ -136,6 +148,26 @@ def literal_eval(node_or_string):
         return ast.literal_eval(node_or_string)
 
 
+def _load_module(parent, part, path):
+    ## import parent.part (or top level part) found on path
+    name = part
+    if parent is not None:
+        name = parent.__name__ + '.' + part
+    if name in sys.modules:
+        return sys.modules[name]
+    if path is None:
+        raise ImportError('No module named ' + name)
+    found = imp.find_module(part, path)
+    try:
+        mod = imp.load_module(name, *found)  # pylint: disable=W0142
+    finally:
+        if found[0] is not None:
+            found[0].close()
+    if parent is not None:
+        setattr(parent, part, mod)
+    return mod
+
+
 class RequirementsFinder(NodeVisitor):
     keywords = {'setup': ['setup'],
                 'pkgs': ['packages'],
@@ -158,9 +190,11 @@ class RequirementsFinder(NodeVisitor):
         self.requires_list = []
         self.prerequisite_list = []
         self.setup_directory = '.'
+        self.local_modules = []  ## source files imported to resolve values
         self.debug = debug
 
-        sys.path.append(os.path.abspath('.'))
+        if not os.path.abspath('.') in sys.path:
+            sys.path.append(os.path.abspath('.'))
         if filepath:
             if len(glob.glob(os.path.join(os.path.dirname(filepath),
                                           'sysdevel*'))) > 0:
@@ -237,18 +271,50 @@ class RequirementsFinder(NodeVisitor):
             self.preprocess_call(value)
 
 
+    def _note_module(self, obj):
+        ## remember local source files that values were taken from
+        source = getattr(obj, '__file__', None)
+        if not is_string(source):
+            return
+        if source[-4:] in ['.pyc', '.pyo']:
+            source = source[:-1]
+        source = os.path.abspath(os.path.join(self.setup_directory, source))
+        if source.startswith(self.setup_directory + os.sep) and \
+           not source in self.local_modules:
+            self.local_modules.append(source)
+
+
+    def _import(self, module_name, from_name):
+        ## Like __import__(module_name, fromlist=[from_name]) with the
+        ##  setup directory as working directory and last on sys.path,
+        ##  but without changing either: finders run in several threads
+        imp.acquire_lock()
+        try:
+            path = [p or self.setup_directory for p in sys.path] + \
+                   [self.setup_directory]
+            mod = None
+            for part in module_name.split('.'):
+                mod = _load_module(mod, part, path)
+                path = getattr(mod, '__path__', None)
+            if path is not None and not hasattr(mod, from_name):
+                try:
+                    _load_module(mod, from_name, path)
+                except ImportError:
+                    pass  ## not a submodule either; getattr will tell
+            return mod
+        finally:
+            imp.release_lock()
+
+
     def get_attribute(self, name, node):
         attr = None
         if type(node.value) == ast.Name:
             if node.value.id in self.module_objects.keys():
-                here = os.getcwd()
-                os.chdir(self.setup_directory)
-                sys.path.append(self.setup_directory)
-                mod = __import__(self.module_objects[node.value.id],
-                                 globals(), locals(), [node.value.id])
-                sys.path.pop()
-                os.chdir(here)
+                mod = self._import(self.module_objects[node.value.id],
+                                   node.value.id)
                 obj = getattr(mod, node.value.id)
+                self._note_module(mod)
+                self._note_module(obj)
                 attr = getattr(obj, name)
             elif name in globals().keys():
                 attr = globals()[name]
@@ -397,45 +463,300 @@ class RequirementsFinder(NodeVisitor):
             self.is_sysdevel_build = True
 
 
-    
+
+
+REQUIREMENTS_CACHE_FILE = 'requirements.cache'
+REQUIREMENTS_CACHE_VERSION = 2
+
+## the RequirementsFinder results that are kept
+REQUIREMENTS_FIELDS = ['package', 'requires_list', 'prerequisite_list',
+                       'subpackages_list', 'is_sysdevel_build',
+                       'is_sysdevel_itself', 'needs_early_config',
+                       'setup_directory', 'local_modules']
+
+Requirements = collections.namedtuple('Requirements', REQUIREMENTS_FIELDS)
+
+
+def _frozen(value):
+    if isinstance(value, (list, tuple)):
+        return tuple([_frozen(v) for v in value])
+    return value
+
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime, st.st_size)
+    except OSError:
+        return None
+
+
+class _RequirementsCache(object):
+    '''
+    RequirementsFinder results (as immutable Requirements) for each
+    setup.py, by path, mtime and size, and the state of the local modules
+    imported to resolve them. Results are shared in memory, and also
+    kept in user_cache_dir, so unchanged setup.py files are not parsed
+    again.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None  ## path: (states, fields)
+        self._results = dict()  ## path: (states, Requirements)
+
+    def _cache_file(self):
+        return os.path.join(options.user_cache_dir, REQUIREMENTS_CACHE_FILE)
+
+    def _load(self):
+        self._entries = dict()
+        cache_file = self._cache_file()
+        if os.path.exists(cache_file):
+            try:
+                f = open(cache_file, 'rb')
+                try:
+                    cached = pickle.load(f)
+                finally:
+                    f.close()
+                if cached['version'] == REQUIREMENTS_CACHE_VERSION:
+                    self._entries = cached['entries']
+            except Exception:  # pylint: disable=W0703
+                pass
+
+    def _save(self):
+        try:
+            mkdir(options.user_cache_dir)
+            cache_file = self._cache_file()
+            tmp_file = cache_file + '.' + str(os.getpid())
+            f = open(tmp_file, 'wb')
+            try:
+                pickle.dump(dict(version=REQUIREMENTS_CACHE_VERSION,
+                                 entries=self._entries),
+                            f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            if os.path.exists(cache_file):
+                os.remove(cache_file)  ## rename does not overwrite on Windows
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError):
+            pass  ## just slower next time
+
+    def find(self, setup_py):
+        setup_py = os.path.abspath(setup_py)
+        os.stat(setup_py)  ## must exist
+        def current(states):
+            for path, state in states:
+                if _file_state(path) != state:
+                    return False
+            return True
+        self._lock.acquire()
+        try:
+            if setup_py in self._results and \
+               current(self._results[setup_py][0]):
+                return self._results[setup_py][1]
+            if self._entries is None:
+                self._load()
+            entry = self._entries.get(setup_py)
+            if entry is not None and current(entry[0]):
+                states, fields = entry
+            else:
+                rf = RequirementsFinder(setup_py)
+                fields = dict([(field, _frozen(getattr(rf, field)))
+                               for field in REQUIREMENTS_FIELDS])
+                states = tuple([(path, _file_state(path)) for path in
+                                [setup_py] + list(fields['local_modules'])])
+                self._entries[setup_py] = (states, fields)
+                self._save()
+            result = Requirements(**fields)  # pylint: disable=W0142
+            self._results[setup_py] = (states, result)
+            return result
+        finally:
+            self._lock.release()
+
+
+requirements_cache = _RequirementsCache()
+
+
+def find_requirements(setup_py):
+    '''
+    The RequirementsFinder results (Requirements, with tuples for lists)
+    for the given setup.py, parsed only if it or the local modules it
+    imports changed.
+    '''
+    return requirements_cache.find(setup_py)
+
 
 
 ## Caching ###################
 
-def read_cache():
-    environ = dict()
-    cache_file = os.path.join(options.target_build_dir, '.cache')
-    if os.path.exists(cache_file):
+CACHE_FILE = '.cache'
+
+
+class _EnvironmentStore(object):
+    '''
+    In-memory configuration environment, backed by the JSON cache file
+    in target_build_dir. The cache is read once (per build directory);
+    changes only mark the store dirty, and flush() writes the file
+    atomically. Configuration helpers should use:
+
+      snapshot()        -- copy of the cached environment
+      get(key, default) -- single cached value
+      update(mapping)   -- merge values into the environment
+      replace(environ)  -- substitute the whole environment
+      fingerprint(name) -- recorded inputs of a configured prerequisite
+      flush()           -- write the cache file, if anything changed
+    The fingerprints of configured prerequisites are kept alongside.
+    '''
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._path = None
+        self._environment = dict()
+        self._fingerprints = dict()
+        self._dirty = False
+
+    def _cache_file(self):
+        return os.path.join(options.target_build_dir, CACHE_FILE)
+
+    def _load(self):
+        path = self._cache_file()
+        if path == self._path:
+            return
+        if self._dirty:
+            self._write()  ## build directory changed
+        self._path = path
+        self._environment = dict()
+        self._fingerprints = dict()
+        self._dirty = False
+        if os.path.exists(path):
+            try:
+                cache = open(path, 'rb')
+                try:
+                    cached = json.load(cache)
+                finally:
+                    cache.close()
+                options.set_local_search_paths(cached['local_search_paths'])
+                self._environment = cached['environment']
+                self._fingerprints = cached.get('fingerprints', dict())
+                if len(options.local_search_paths) == 0:
+                    options.set_local_search_paths(
+                        [os.path.abspath(options.target_build_dir)])
+            except Exception:  # pylint: disable=W0703
+                pass
+
+    def _write(self):
+        directory = os.path.dirname(self._path)
+        if not os.path.isdir(directory):
+            if os.path.exists(directory):
+                os.remove(directory)
+            mkdir(directory)
+        cached = dict()
+        cached['local_search_paths'] = options.local_search_paths
+        cached['environment'] = self._environment
+        cached['fingerprints'] = self._fingerprints
+        fd, tmp_path = tempfile.mkstemp(prefix=CACHE_FILE, dir=directory)
+        cache = os.fdopen(fd, 'w')
         try:
-            cache = open(cache_file, 'rb')
-            cached = json.load(cache)
-            options.set_local_search_paths(cached['local_search_paths'])
-            environ = cached['environment']
+            json.dump(cached, cache)
+        finally:
             cache.close()
-            if len(options.local_search_paths) == 0:
-                options.set_local_search_paths(
-                    [os.path.abspath(options.target_build_dir)])
-        except Exception:  # pylint: disable=W0703
-            pass
-    return environ
+        os.chmod(tmp_path, int('644', 8))
+        if os.path.exists(self._path):
+            os.remove(self._path)  ## rename does not overwrite on Windows
+        os.rename(tmp_path, self._path)
+        self._dirty = False
+
+    def snapshot(self):
+        self._lock.acquire()
+        try:
+            self._load()
+            return dict(self._environment)
+        finally:
+            self._lock.release()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            self._load()
+            return self._environment.get(key, default)
+        finally:
+            self._lock.release()
+
+    def update(self, mapping):
+        self._lock.acquire()
+        try:
+            self._load()
+            self._environment.update(mapping)
+            self._dirty = True
+        finally:
+            self._lock.release()
+
+    def replace(self, environ):
+        self._lock.acquire()
+        try:
+            self._load()
+            self._environment = dict(environ)
+            self._dirty = True
+        finally:
+            self._lock.release()
+
+    def fingerprint(self, name):
+        self._lock.acquire()
+        try:
+            self._load()
+            return self._fingerprints.get(name)
+        finally:
+            self._lock.release()
+
+    def set_fingerprint(self, name, fingerprint):
+        self._lock.acquire()
+        try:
+            self._load()
+            if fingerprint is None:
+                self._fingerprints.pop(name, None)
+            else:
+                self._fingerprints[name] = fingerprint
+            self._dirty = True
+        finally:
+            self._lock.release()
+
+    def is_dirty(self):
+        return self._dirty
+
+    def flush(self):
+        self._lock.acquire()
+        try:
+            if self._dirty and self._path is not None:
+                self._write()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._path = None
+            self._environment = dict()
+            self._fingerprints = dict()
+            self._dirty = False
+        finally:
+            self._lock.release()
+
+
+environment_store = _EnvironmentStore()
+atexit.register(environment_store.flush)
+
+
+def read_cache():
+    return environment_store.snapshot()
 
 def save_cache(environ):
-    cache_file = os.path.join(options.target_build_dir, '.cache')
-    if not os.path.isdir(options.target_build_dir):
-        if os.path.exists(options.target_build_dir):
-            os.remove(options.target_build_dir)
-        mkdir(options.target_build_dir)
-    cache = open(cache_file, 'wb')
-    cached = dict()
-    cached['local_search_paths'] = options.local_search_paths
-    cached['environment'] = environ
-    json.dump(cached, cache)
-    cache.close()
+    environment_store.replace(environ)
+    environment_store.flush()
 
 def delete_cache():
-    cache = os.path.join(options.target_build_dir, '.cache')
+    environment_store.clear()
+    cache = os.path.join(options.target_build_dir, CACHE_FILE)
     if os.path.exists(cache):
         os.remove(cache)
+    file_index.clear()
 
 ##############################
 
@@ -497,6 +818,7 @@ def find_header(filepath, extra_paths=None, extra_subdirs=None, limit=False):
         pathlist += glob.glob(path_expr)
     if not limit:
         pathlist += options.default_path_prefixes + options.local_search_paths
+    dname, fname = os.path.split(filepath)
     for path in pathlist:
         if path != None and os.path.exists(path):
             for sub in subdirs:
@@ -504,21 +826,21 @@ def find_header(filepath, extra_paths=None, extra_subdirs=None, limit=False):
                 for ext_path in ext_paths:
                     if options.DEBUG:
                         print('Searching ' + ext_path + ' for ' + filepath)
-                    dname, fname = os.path.split(filepath)
-                    for root, dirnames, filenames in os.walk(ext_path):
-                        rt = os.path.normpath(root)
-                        if dname in dirnames and \
-                           fname in [os.path.basename(x) for x in
-                                     glob.glob(os.path.join(rt, dname, '*'))]:
+                    if dname:
+                        for rt in file_index.find_directories(ext_path, dname):
                             directory = os.path.join(rt, dname)
-                            if options.DEBUG:
-                                print('Found ' + os.path.join(directory, fname))
-                            return os.path.dirname(directory).rstrip(os.sep)
-                        for fn in filenames:
-                            if dname == '' and fnmatch.fnmatch(fn, fname):
+                            if os.path.exists(os.path.join(directory, fname)):
                                 if options.DEBUG:
-                                    print('Found ' + os.path.join(rt, fname))
+                                    print('Found ' +
+                                          os.path.join(directory, fname))
                                 return rt.rstrip(os.sep)
+                    else:
+                        found = file_index.find_files(ext_path, fname)
+                        if found:
+                            rt = found[0][0]
+                            if options.DEBUG:
+                                print('Found ' + os.path.join(rt, fname))
+                            return rt.rstrip(os.sep)
     raise ConfigError(fname, 'Header not found.')
 
 
@@ -543,32 +865,30 @@ def find_definitions(name, extra_paths=None, extra_subdirs=None,
         pathlist += glob.glob(path_expr)
     if not limit:
         pathlist += options.default_path_prefixes + options.local_search_paths
+    patterns = []
+    for prefix in prefixes:
+        for def_suffix in def_suffixes:
+            if wildcard:
+                patterns.append(prefix + name + '*' + def_suffix)
+            else:
+                patterns.append(prefix + name + def_suffix)
     for path in pathlist:
         if path != None and os.path.exists(path):
             for sub in subdirs:
-                for root, _, filenames in \
-                    os.walk(os.path.join(path, sub)):
-                    for prefix in prefixes:
-                        for def_suffix in def_suffixes:
-                            if wildcard:
-                                filename = prefix + name + '*' + def_suffix
-                            else:
-                                filename = prefix + name + def_suffix
+                search_dir = os.path.join(path, sub)
+                if options.DEBUG:
+                    print('Searching ' + search_dir + ' for ' +
+                          ', '.join(patterns))
+                for root, filenames in file_index.find_files(search_dir,
+                                                             patterns):
+                    for filename in patterns:
+                        defs = fnmatch.filter(filenames, filename)
+                        if len(defs) > 0:
                             if options.DEBUG:
-                                print('Searching ' + root + ' for ' + filename)
-                            defs = []
-                            for fn in filenames:
-                                if fnmatch.fnmatch(fn, filename):
-                                    if single:
-                                        if options.DEBUG:
-                                            print('Found at ' + root)
-                                        return root.rstrip(os.sep), [fn]
-                                    else:
-                                        defs.append(fn)
-                            if len(defs) > 0:
-                                if options.DEBUG:
-                                    print('Found at ' + root)
-                                return root.rstrip(os.sep), defs
+                                print('Found at ' + root)
+                            if single:
+                                return root.rstrip(os.sep), defs[:1]
+                            return root.rstrip(os.sep), defs
     raise ConfigError(name, 'Library definitions not found.')
 
 
@@ -610,34 +930,31 @@ def find_libraries(name, extra_paths=None, extra_subdirs=None,
         pathlist += glob.glob(path_expr)
     if not limit:
         pathlist += options.default_path_prefixes + options.local_search_paths
+    patterns = []
+    for prefix in prefixes:
+        for suffix in suffixes:
+            if wildcard:
+                patterns.append(prefix + name + '*' + suffix)
+            else:
+                patterns.append(prefix + name + suffix)
     for path in pathlist:
         if path != None and os.path.exists(path):
             for subpath in default_lib_paths:
                 for sub in subdirs:
-                    for root, _, filenames in \
-                            os.walk(os.path.join(path, subpath, sub)):
-                        for prefix in prefixes:
-                            for suffix in suffixes:
-                                if wildcard:
-                                    filename = prefix + name + '*' + suffix
-                                else:
-                                    filename = prefix + name + suffix
+                    search_dir = os.path.join(path, subpath, sub)
+                    if options.DEBUG:
+                        print('Searching ' + search_dir + \
+                              ' for ' + ', '.join(patterns))
+                    for root, filenames in file_index.find_files(search_dir,
+                                                                 patterns):
+                        for filename in patterns:
+                            libs = fnmatch.filter(filenames, filename)
+                            if len(libs) > 0:
                                 if options.DEBUG:
-                                    print('Searching ' + root + \
-                                        ' for ' + filename)
-                                libs = []
-                                for fn in filenames:
-                                    if fnmatch.fnmatch(fn, filename):
-                                        if single:
-                                            if options.DEBUG:
-                                                print('Found at ' + root)
-                                            return root.rstrip(os.sep), fn
-                                        else:
-                                            libs.append(fn)
-                                if len(libs) > 0:
-                                    if options.DEBUG:
-                                        print('Found at ' + root)
-                                    return root.rstrip(os.sep), libs
+                                    print('Found at ' + root)
+                                if single:
+                                    return root.rstrip(os.sep), libs[0]
+                                return root.rstrip(os.sep), libs
     raise ConfigError(name, 'Library not found.')
 
 
@@ -880,16 +1197,11 @@ def install_pyscript(website, name, locally=True):
         raise ConfigError(name, 'Unable to install: ' + str(sys.exc_info()[1]))
 
 
-def install_pypkg_process(cmd_line, environ, log, shell):
+def install_pypkg_process(cmd_line, environ, log, shell, cwd=None):
     try:
-        p = subprocess.Popen(cmd_line, env=environ, stdout=log, stderr=log,
-                             shell=shell)
-        status = process_progress(p)
-        log.close()
-    except KeyboardInterrupt:
-        p.terminate()
+        status = run_process(cmd_line, log, env=environ, shell=shell, cwd=cwd)
+    finally:
         log.close()
-        raise
     return status
 
 
@@ -906,9 +1218,9 @@ def install_pypkg_without_fetch(name, env=None, src_dir=None, locally=True,
         extra_cmds = []
     if extra_args is None:
         extra_args = []
-    here = os.path.abspath(os.getcwd())
     target_dir = os.path.abspath(options.target_build_dir)
     target_lib_dir = os.path.join(target_dir, options.local_lib_dir)
+    working_dir = os.path.join(target_dir, src_dir)
 
     if not os.path.exists(os.path.join(target_dir, src_dir)):
         mkdir(os.path.join(target_dir, src_dir))
@@ -920,7 +1232,6 @@ def install_pypkg_without_fetch(name, env=None, src_dir=None, locally=True,
     if not os.path.exists(target_lib_dir):
         os.makedirs(target_lib_dir)
     try:
-        os.chdir(os.path.join(target_dir, src_dir))
         environ = os.environ.copy()
         shell = False
         if 'windows' in platform.system().lower():
@@ -953,7 +1264,8 @@ def install_pypkg_without_fetch(name, env=None, src_dir=None, locally=True,
             log.write('Env: ' + str(environ) + '\n')
         log.write('\n')
         log.flush()
-        status = install_pypkg_process(cmd_line, environ, log, shell)
+        status = install_pypkg_process(cmd_line, environ, log, shell,
+                                       working_dir)
         failed = False
         if status != 0:
             log = open(log_file, 'r')
@@ -970,7 +1282,8 @@ def install_pypkg_without_fetch(name, env=None, src_dir=None, locally=True,
                 log.write("\nRETRYING\n")
                 log.flush()
                 cmd_line.append("--prefix=")
-                status = install_pypkg_process(cmd_line, environ, log, shell)
+                status = install_pypkg_process(cmd_line, environ, log, shell,
+                                               working_dir)
                 if status == 0:
                     failed = False
         if failed:
@@ -983,9 +1296,7 @@ def install_pypkg_without_fetch(name, env=None, src_dir=None, locally=True,
         if locally:
             if not target_lib_dir in sys.path:
                 sys.path.insert(0, target_lib_dir)
-        os.chdir(here)
     except Exception:  # pylint: disable=W0703
-        os.chdir(here)
         raise ConfigError(name, 'Unable to install:\n' +
                           str(sys.exc_info()[1]) + '\n' +
                           traceback.format_exc())
@@ -1026,7 +1337,6 @@ def autotools_install_without_fetch(environ, src_dir, locally=True,
         extra_cfg = []
     if addtnl_env is None:
         addtnl_env = dict()
-    here = os.path.abspath(os.getcwd())
 
     if locally:
         prefix = os.path.abspath(options.target_build_dir)
@@ -1036,56 +1346,60 @@ def autotools_install_without_fetch(environ, src_dir, locally=True,
         prefix = options.global_prefix
     prefix = convert2unixpath(prefix)  ## MinGW shell strips backslashes
 
-    build_dir = os.path.join(options.target_build_dir,
-                             src_dir)  ## build in-place
+    build_dir = os.path.abspath(os.path.join(options.target_build_dir,
+                                             src_dir))  ## build in-place
     mkdir(build_dir)
-    os.chdir(build_dir)
-    log = open('build.log', 'w')
+    make = ['make', '-j' + str(cpu_budget.jobs())]
+    log = open(os.path.join(build_dir, 'build.log'), 'w')
+    dots = ActivityDots()
     try:
         if 'windows' in platform.system().lower():
             ## Assumes MinGW present, detected, and loaded in environment
-            if not os.path.exists('configure'):
+            if not os.path.exists(os.path.join(build_dir, 'configure')):
                 mingw_check_call(environ, ['autoreconf', '-i'],
-                                 stdout=log, stderr=log)
+                                 stdout=log, stderr=log, cwd=build_dir)
             mingw_check_call(environ, ['./configure',
                                        '--prefix="' + prefix + '"'] +
                              extra_cfg, stdout=log, stderr=log,
-                             addtnl_env=addtnl_env)
-            mingw_check_call(environ, ['make'], stdout=log, stderr=log,
-                             addtnl_env=addtnl_env)
+                             addtnl_env=addtnl_env, cwd=build_dir)
+            mingw_check_call(environ, make, stdout=log, stderr=log,
+                             addtnl_env=addtnl_env, cwd=build_dir)
             try:
                 mingw_check_call(environ, ['make', 'install'],
-                                 stdout=log, stderr=log, addtnl_env=addtnl_env)
+                                 stdout=log, stderr=log, addtnl_env=addtnl_env,
+                                 cwd=build_dir)
             except subprocess.CalledProcessError:
                 pass
         else:
             os_environ = os.environ.copy()
             os_environ = dict(list(os_environ.items()) +
                               list(addtnl_env.items()))
-            if not os.path.exists('configure'):
-                check_call(['autoreconf', '-i'], stdout=log, stderr=log)
-            check_call(['./configure', '--prefix=' + prefix] + extra_cfg,
-                       stdout=log, stderr=log, env=os_environ)
-            check_call(['make'], stdout=log, stderr=log, env=os_environ)
+            if not os.path.exists(os.path.join(build_dir, 'configure')):
+                check_process(['autoreconf', '-i'], log, dots, cwd=build_dir)
+            check_process(['./configure', '--prefix=' + prefix] + extra_cfg,
+                          log, dots, env=os_environ, cwd=build_dir)
+            check_process(make, log, dots, env=os_environ, cwd=build_dir)
             try:
                 if locally:
-                    check_call(['make', 'install'], stdout=log, stderr=log,
-                               env=os_environ)
+                    check_process(['make', 'install'], log, dots,
+                                  env=os_environ, cwd=build_dir)
                 else:
                     admin_check_call(['make', 'install'], stdout=log,
-                                     stderr=log, addtnl_env=addtnl_env)
+                                     stderr=log, addtnl_env=addtnl_env,
+                                     cwd=build_dir)
             except subprocess.CalledProcessError:
                 pass
     finally:
         log.close()
-        os.chdir(here)
+    dots.finish()
 
 
 def autotools_install(environ, website, archive, src_dir, locally=True,
                       extra_cfg=None, addtnl_env=None):
     fetch(''.join(website), archive, archive)
     unarchive(archive, src_dir)
-    autotools_install_without_fetch(environ, locally, extra_cfg, addtnl_env)
+    autotools_install_without_fetch(environ, src_dir, locally,
+                                    extra_cfg, addtnl_env)
 
 
 def system_uses_apt_get():
@@ -1225,12 +1539,13 @@ def call(cmd_line, *args, **kwargs):
 
 def check_call(cmd_line, *args, **kwargs):
     status = subprocess.call(cmd_line, *args, **kwargs)
+    file_index.invalidate()  ## may have installed something
     if status != 0:
         raise subprocess.CalledProcessError(status, cmd_line)
     
 
 def admin_check_call(cmd_line, quiet=False, stdout=None, stderr=None,
-                     addtnl_env=None):
+                     addtnl_env=None, cwd=None):
     if addtnl_env is None:
         addtnl_env = dict()
     if 'windows' in platform.system().lower():
@@ -1241,13 +1556,16 @@ def admin_check_call(cmd_line, quiet=False, stdout=None, stderr=None,
             from win32com.shell.shell import ShellExecuteEx
             from win32event import WaitForSingleObject, INFINITE
             from win32process import GetExitCodeProcess
-            handle = ShellExecuteEx(lpVerb='runas', lpFile=cmd_line)['hProcess']
+            handle = ShellExecuteEx(lpVerb='runas', lpFile=cmd_line,
+                                    lpDirectory=cwd)['hProcess']
             WaitForSingleObject(handle, INFINITE)
             status = GetExitCodeProcess(handle)
+            file_index.invalidate()
             if status != 0:
                 raise subprocess.CalledProcessError(status, cmd_line)
         else:
-            check_call([cmd_line], stdout=stdout, stderr=stderr, env=addtnl_env)
+            check_call([cmd_line], stdout=stdout, stderr=stderr, env=addtnl_env,
+                       cwd=cwd)
     else:
         os_environ = os.environ.copy()
         os_environ = dict(list(os_environ.items()) + list(addtnl_env.items()))
@@ -1258,15 +1576,16 @@ def admin_check_call(cmd_line, quiet=False, stdout=None, stderr=None,
             sudo_prefix = ['sudo']
         if quiet:
             check_call(sudo_prefix + cmd_line, stdout=stdout, stderr=stderr,
-                       env=os_environ)
+                       env=os_environ, cwd=cwd)
         else:
             check_call(sudo_prefix + cmd_line,
-                       stdout=sys.stdout, stderr=sys.stderr, env=os_environ)
+                       stdout=sys.stdout, stderr=sys.stderr, env=os_environ,
+                       cwd=cwd)
 
 
 # pylint: disable=W0613
 def mingw_check_call(environ, cmd_line, stdin=None, stdout=None, stderr=None,
-                     addtnl_env=None):
+                     addtnl_env=None, cwd=None):
     if addtnl_env is None:
         addtnl_env = dict()
     path = os.path.join(environ['MSYS_DIR'], 'bin') + ';' + \
@@ -1279,8 +1598,9 @@ def mingw_check_call(environ, cmd_line, stdin=None, stdout=None, stderr=None,
     if not is_string(cmd_line):
         cmd_line = ' '.join(cmd_line)
     p = subprocess.Popen(shell + ' -c "' + cmd_line + '"',
-                         env=os_environ, stdout=stdout, stderr=stderr)
+                         env=os_environ, stdout=stdout, stderr=stderr, cwd=cwd)
     status = p.wait()
+    file_index.invalidate()
     if status != 0:
         raise subprocess.CalledProcessError(status, cmd_line)
 
@@ -29,31 +29,59 @@ recursive build support
 
 import os
 import sys
-import subprocess
 
-from sysdevel.distutils.building import process_progress
+from sysdevel.distutils.supervisor import ProcessSupervisor, run_process
+from sysdevel.distutils.parallel import cpu_share, JOBS_VARIABLE
 from sysdevel.distutils import options
 
 
-def process_package(fnctn, build_base, progress, pyexe, argv,
-                    pkg_name, pkg_dir, addtnl_args=None):
+def _strip_jobs(argv):
+    ## plain distutils does not know -j/--jobs
+    stripped = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+        elif arg in ['-j', '--jobs']:
+            skip_next = True
+        elif not arg.startswith('--jobs=') and \
+             not (arg.startswith('-j') and arg[2:].isdigit()):
+            stripped.append(arg)
+    return stripped
+
+
+def _share_jobs(argv, share):
+    ## give -j/--jobs options the value share
+    shared = []
+    replace_next = False
+    for arg in argv:
+        if replace_next:
+            arg = str(share)
+            replace_next = False
+        elif arg in ['-j', '--jobs']:
+            replace_next = True
+        elif arg.startswith('--jobs='):
+            arg = '--jobs=' + str(share)
+        elif arg.startswith('-j') and arg[2:].isdigit():
+            arg = '-j' + str(share)
+        shared.append(arg)
+    return shared
+
+
+def package_command(fnctn, pyexe, argv, pkg_dir, addtnl_args=None):
+    '''
+    Command line that runs fnctn in the subpackage at pkg_dir.
+    '''
     if addtnl_args is None:
         addtnl_args = []
-    sys.stdout.write(fnctn.upper() + 'ING ' + pkg_name + ' in ' + pkg_dir + ' ')
-    logging = True
-    if 'clean' in fnctn:
-        logging = False
-    log_file = os.path.join(build_base, pkg_name + '_' + fnctn + '.log')
-    if logging:
-        log = open(log_file, 'w')
-    else:
-        log = open(os.devnull, 'w')
+    argv = list(argv)
 
-    from sysdevel.distutils.prerequisites import RequirementsFinder
+    from sysdevel.distutils.prerequisites import find_requirements
     from sysdevel.distutils.core import CustomCommands
-    rf = RequirementsFinder(os.path.join(pkg_dir, 'setup.py'))
+    rf = find_requirements(os.path.join(pkg_dir, 'setup.py'))
     if not rf.is_sysdevel_build:  ## regular distutils
-        args = list(argv)
+        args = _strip_jobs(argv)
+        argv = list(args)
         for arg in args:
             if '--sublevel' in arg or '--download-dir' in arg:
                 argv.remove(arg)
@@ -61,20 +89,27 @@ def process_package(fnctn, build_base, progress, pyexe, argv,
                 argv.remove(arg)
         if len(argv) == 0:
             argv.append('build')
+    return [pyexe, os.path.join(pkg_dir, 'setup.py')] + argv + addtnl_args
+
+
+def _log_file(fnctn, build_base, pkg_name):
+    if 'clean' in fnctn:
+        return None
+    return os.path.join(build_base, pkg_name + '_' + fnctn + '.log')
 
+
+def process_package(fnctn, build_base, pyexe, argv,
+                    pkg_name, pkg_dir, addtnl_args=None):
+    sys.stdout.write(fnctn.upper() + 'ING ' + pkg_name + ' in ' + pkg_dir + ' ')
+    log_file = _log_file(fnctn, build_base, pkg_name)
     try:
-        cmd_line = [pyexe, os.path.join(pkg_dir, 'setup.py'),
-                    ] + argv + addtnl_args
-        p = subprocess.Popen(cmd_line, stdout=log, stderr=log)
-        status = progress(p)
-        log.close()
+        cmd_line = package_command(fnctn, pyexe, argv, pkg_dir, addtnl_args)
+        status = run_process(cmd_line, log_file)
     except KeyboardInterrupt:
-        p.terminate()
-        log.close()
         status = 1
     if status != 0:
         sys.stdout.write(' failed')
-        if logging:
+        if log_file:
             sys.stdout.write('; See ' + log_file)
     else:
         sys.stdout.write(' done')
@@ -82,43 +117,174 @@ def process_package(fnctn, build_base, progress, pyexe, argv,
     return pkg_name, status
 
 
+def subpackage_dependencies(subpackages):
+    '''
+    For each (name, directory) subpackage, the names of the other
+    subpackages that it requires, from its setup.py.
+    '''
+    from sysdevel.distutils.prerequisites import find_requirements
+    from sysdevel.distutils.prerequisites import requirement_versioning
+    names = dict([(name.lower(), name) for name, _ in subpackages])
+    dependencies = dict()
+    for pkg_name, pkg_dir in subpackages:
+        required = []
+        try:
+            rf = find_requirements(os.path.join(pkg_dir, 'setup.py'))
+            for req in rf.requires_list + rf.prerequisite_list:
+                req_name = requirement_versioning(req)[0]
+                if req_name is None:
+                    continue
+                dep = names.get(req_name.lower())
+                if dep is not None and dep != pkg_name and \
+                   not dep in required:
+                    required.append(dep)
+        except Exception:  # pylint: disable=W0703
+            pass  ## unreadable setup.py: no ordering constraints
+        dependencies[pkg_name] = required
+    return dependencies
+
+
+class SubpackageScheduler(object):
+    '''
+    Runs a setup.py command in each subpackage, as a separate process,
+    with up to 'jobs' at once. A subpackage starts once the
+    subpackages it requires have succeeded; those depending on a
+    failure are skipped. Output goes to per-package logs, with a
+    status line on the console.
+    Each process gets an equal share of the 'jobs' CPUs for its own
+    parallelism (--jobs, and JOBS_VARIABLE for the default).
+    '''
+    def __init__(self, fnctn, build_base, subpackages, argv, jobs,
+                 ordered=True, out=sys.stdout):
+        self.fnctn = fnctn
+        self.build_base = build_base
+        self.subpackages = list(subpackages)
+        self.argv = list(argv)
+        self.jobs = max(1, jobs)
+        self.share = max(1, self.jobs // max(1, min(self.jobs,
+                                                    len(self.subpackages))))
+        self.out = out
+        if ordered:
+            self.dependencies = subpackage_dependencies(self.subpackages)
+        else:
+            self.dependencies = dict([(name, []) for name, _
+                                      in self.subpackages])
+
+    def _start(self, supervisor, pkg_name):
+        pkg_dir = dict(self.subpackages)[pkg_name]
+        cmd_line = package_command(self.fnctn, sys.executable,
+                                   _share_jobs(self.argv, self.share), pkg_dir)
+        env = dict(os.environ)
+        env[JOBS_VARIABLE] = str(self.share)
+        supervisor.start(pkg_name, cmd_line,
+                         _log_file(self.fnctn, self.build_base, pkg_name),
+                         env=env)
+
+    def _status(self, done, running):
+        if options.VERBOSE:
+            line = '%sING %d/%d  [%s]' % (self.fnctn.upper(), done,
+                                           len(self.subpackages),
+                                           ', '.join(running))
+            self.out.write('\r' + line[:78].ljust(78))
+            self.out.flush()
+
+    def _report(self, pkg_name, status):
+        pkg_dir = dict(self.subpackages)[pkg_name]
+        line = self.fnctn.upper() + 'ING ' + pkg_name + ' in ' + pkg_dir + ' '
+        if status is None:
+            line += ' skipped'
+        elif status != 0:
+            line += ' failed'
+            log_file = _log_file(self.fnctn, self.build_base, pkg_name)
+            if log_file:
+                line += '; See ' + log_file
+        else:
+            line += ' done'
+        self.out.write('\r' + line.ljust(78) + '\n')
+
+    def run(self, quit_on_error=False):
+        '''
+        Returns a dictionary of name: exit status (None if skipped).
+        '''
+        results = dict()
+        waiting = [name for name, _ in self.subpackages]
+        running = []
+        stop = False
+        supervisor = ProcessSupervisor(
+            lambda s: self._status(len(results), s.running()))
+        try:
+            while waiting or running:
+                for pkg_name in list(waiting):
+                    deps = self.dependencies.get(pkg_name, [])
+                    if [d for d in deps if d in results and results[d] != 0]:
+                        waiting.remove(pkg_name)
+                        results[pkg_name] = None  ## dependency failed
+                        self._report(pkg_name, None)
+                ready = []
+                if not stop:
+                    for pkg_name in waiting:
+                        if len(running) + len(ready) >= self.jobs:
+                            break
+                        deps = self.dependencies.get(pkg_name, [])
+                        if not [d for d in deps if not d in results]:
+                            ready.append(pkg_name)
+                    if waiting and not running and not ready:
+                        ## circular requirements: take them in order
+                        ready.append(waiting[0])
+                for pkg_name in ready:
+                    waiting.remove(pkg_name)
+                    try:
+                        self._start(supervisor, pkg_name)
+                        running.append(pkg_name)
+                    except OSError:
+                        results[pkg_name] = 1
+                        self._report(pkg_name, 1)
+                if not running:
+                    if ready:
+                        continue  ## failed to start; skip dependents
+                    break
+                self._status(len(results), running)
+                pkg_name, status = supervisor.wait_any()
+                running.remove(pkg_name)
+                results[pkg_name] = status
+                self._report(pkg_name, status)
+                if status != 0 and quit_on_error:
+                    stop = True
+        except KeyboardInterrupt:
+            supervisor.terminate()
+            raise
+        return results
+
+
 def process_subpackages(parallel, fnctn, build_base, subpackages,
                         argv, quit_on_error):
+    '''
+    Run fnctn in each subpackage. 'parallel' is the number of
+    subpackages processed at once (True for one per CPU).
+    '''
+    jobs = 1
+    if parallel is True:
+        jobs = cpu_share()
+    elif parallel:
+        jobs = int(parallel)
     failed_somewhere = False
-    parallel = False ## FIXME reenable parallel build
-    try:
-        if not parallel:
-            raise ImportError
-        ## parallel building
-        import pp
-        job_server = pp.Server()
-        results = [job_server.submit(process_package,
-                                     (fnctn, build_base, process_progress,
-                                      sys.executable, argv,) + sub,
-                                     (), ('os', 'sys', 'subprocess',
-                                          'sysdevel.distutils.prerequisites'))
-                   for sub in subpackages]
-        has_failed = False
-        for result in results:
-            res_tpl = result()
-            if res_tpl is None:
-                raise Exception("Parallel build failed.")
-            _, status = res_tpl
-            if status != 0:
-                has_failed = True
-        if has_failed:
-            failed_somewhere = True
-            if quit_on_error:
-                sys.exit(status)
-
-    except ImportError: ## serial building
+    if jobs <= 1:  ## serial building
         for sub in subpackages:
-            args = (fnctn, build_base, process_progress,
-                    sys.executable, argv,) + sub
+            args = (fnctn, build_base, sys.executable, argv,) + tuple(sub)
             _, status = process_package(*args)  # pylint: disable=W0142
             if status != 0:
                 failed_somewhere = True
                 if quit_on_error:
                     sys.exit(status)
+        return failed_somewhere
 
+    scheduler = SubpackageScheduler(fnctn, build_base, subpackages, argv,
+                                    jobs, not 'clean' in fnctn)
+    results = scheduler.run(quit_on_error)
+    for status in results.values():
+        if status != 0:
+            failed_somewhere = True
+    if failed_somewhere and quit_on_error:
+        statuses = [s for s in results.values() if s]
+        sys.exit(statuses[0])
     return failed_somewhere
@@ -0,0 +1,235 @@
+"""
+Copyright 2013.  Los Alamos National Security, LLC.
+This material was produced under U.S. Government contract
+DE-AC52-06NA25396 for Los Alamos National Laboratory (LANL), which is
+operated by Los Alamos National Security, LLC for the U.S. Department
+of Energy. The U.S. Government has rights to use, reproduce, and
+distribute this software.  NEITHER THE GOVERNMENT NOR LOS ALAMOS
+NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+modified to produce derivative works, such modified software should be
+clearly marked, so as not to confuse it with the version available
+from LANL.
+
+Licensed under the Mozilla Public License, Version 2.0 (the
+"License"); you may not use this file except in compliance with the
+License. You may obtain a copy of the License at
+http://www.mozilla.org/MPL/2.0/
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+# pylint: disable=W0105
+"""
+Supervision of concurrent child processes
+"""
+
+import os
+import sys
+import errno
+import time
+import threading
+import subprocess
+
+try:
+    import queue  # pylint: disable=F0401
+except ImportError:
+    import Queue as queue
+
+from sysdevel.util import is_string
+from sysdevel.distutils.parallel import _wait
+from sysdevel.distutils.file_index import file_index
+from sysdevel.distutils import options
+
+
+BLOCK_SIZE = 64 * 1024
+
+## progress is redrawn at most this often for child output (seconds)
+PROGRESS_INTERVAL = 0.2
+
+
+class ProcessSupervisor(object):
+    '''
+    Waits on any number of child processes at once. The output of each
+    child is copied to its own log as it arrives, by a reader thread
+    per child, and exits are reported in the order they happen.
+    An optional progress callable is given the supervisor on each
+    event (child output is rate limited to PROGRESS_INTERVAL).
+    '''
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.processes = dict()
+        self.output = dict()   ## name: bytes written so far
+        self.results = dict()  ## name: exit status
+        self._events = queue.Queue()
+        self._last_progress = 0
+
+    def start(self, name, cmd_line, log=None, **kwargs):
+        '''
+        Start cmd_line (with the given Popen keywords), its stdout and
+        stderr going to log: an open file, a file name, or None to discard.
+        '''
+        close = False
+        if log is None:
+            log = open(os.devnull, 'w')
+            close = True
+        elif is_string(log):
+            log = open(log, 'w')
+            close = True
+        try:
+            p = subprocess.Popen(cmd_line, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT, **kwargs)
+        except:
+            if close:
+                log.close()
+            raise
+        self._follow(name, p, log, close)
+        return p
+
+    def watch(self, name, p):
+        '''
+        Supervise a process started elsewhere (its output is not captured).
+        '''
+        self._follow(name, p, None, False)
+
+    def _follow(self, name, p, log, close):
+        self.processes[name] = p
+        self.output[name] = 0
+        t = threading.Thread(target=self._pump, args=(name, p, log, close))
+        t.setDaemon(True)
+        t.start()
+
+    def _pump(self, name, p, log, close):
+        status = -1
+        try:
+            if p.stdout is not None:
+                sink = None
+                if log is not None:
+                    sink = getattr(log, 'buffer', log)
+                    log.flush()  ## after anything the caller wrote
+                fd = p.stdout.fileno()
+                while True:
+                    try:
+                        data = os.read(fd, BLOCK_SIZE)
+                    except OSError:
+                        if sys.exc_info()[1].errno == errno.EINTR:
+                            continue
+                        break
+                    if not data:
+                        break
+                    if sink is not None:
+                        try:
+                            sink.write(data)
+                            sink.flush()
+                        except (IOError, OSError):
+                            sink = None  ## keep draining the child
+                    self._events.put((name, len(data), None))
+                p.stdout.close()
+            status = p.wait()
+        finally:
+            if close:
+                log.close()
+            self._events.put((name, 0, status))
+
+    def running(self):
+        return [name for name in self.processes if not name in self.results]
+
+    def wait_any(self):
+        '''
+        Block until a child exits. Returns (name, exit status),
+        or None if nothing is running.
+        '''
+        while self.running():
+            name, size, status = _wait(self._events)
+            if status is None:
+                self.output[name] += size
+                self._report(False)
+                continue
+            self.results[name] = status
+            file_index.invalidate()  ## the child may have installed files
+            self._report(True)
+            return name, status
+        return None
+
+    def wait_all(self):
+        '''
+        Block until every child exits. Returns a name: exit status dictionary.
+        '''
+        while self.wait_any() is not None:
+            pass
+        return dict(self.results)
+
+    def terminate(self):
+        for name in self.running():
+            try:
+                self.processes[name].terminate()
+            except OSError:
+                pass
+
+    def _report(self, finished):
+        if self.progress is None:
+            return
+        now = time.time()
+        if finished or now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            self.progress(self)
+
+
+class ActivityDots(object):
+    '''
+    Console activity indicator (if VERBOSE): cycling dots, advanced
+    as the supervised child produces output.
+    '''
+    max_dots = 10
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.dots = 0
+
+    def __call__(self, supervisor):
+        if options.VERBOSE:
+            if self.dots:
+                self.out.write('\b' * self.dots)
+            self.dots = (self.dots + 1) % self.max_dots
+            self.out.write('.' * self.dots)
+            self.out.flush()
+
+    def finish(self):
+        if options.VERBOSE:
+            self.out.write('\b' * self.dots)
+            self.out.write('.' * self.max_dots)
+            self.out.flush()
+
+
+def run_process(cmd_line, log=None, dots=None, **kwargs):
+    '''
+    Run cmd_line (with the given Popen keywords) to completion, its
+    output going to log (see ProcessSupervisor.start), with activity
+    dots on the console. Returns the exit status.
+    A sequence of commands can share dots, to be finished by the caller.
+    '''
+    finish = dots is None
+    if finish:
+        dots = ActivityDots()
+    supervisor = ProcessSupervisor(dots)
+    try:
+        supervisor.start('process', cmd_line, log, **kwargs)
+        status = supervisor.wait_any()[1]
+    except KeyboardInterrupt:
+        supervisor.terminate()
+        raise
+    if finish:
+        dots.finish()
+    return status
+
+
+def check_process(cmd_line, log=None, dots=None, **kwargs):
+    '''
+    Like run_process, but raises CalledProcessError on failure.
+    '''
+    status = run_process(cmd_line, log, dots, **kwargs)
+    if status != 0:
+        raise subprocess.CalledProcessError(status, cmd_line)